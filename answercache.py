@@ -0,0 +1,162 @@
+"""Cache of completed answers, so a repeated question about unchanged files is answered without a request."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+DEFAULT_ANSWER_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".claudefc", "answers.sqlite3")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 7 * 24 * 60 * 60  # Seconds an answer stays valid
+REPLAY_CHUNK_SIZE = 256  # Characters per chunk when a cached answer is streamed back
+
+
+def normalize_question(question):
+    """Fold case, whitespace and trailing punctuation, which don't change what is being asked."""
+    return " ".join(question.casefold().split()).rstrip("?.! ")
+
+
+def answer_key(context, question, model, max_tokens, history=(), omitted=0):
+    """Return the cache key for a question about context, after the given conversation history."""
+    digest = context if isinstance(context, str) else context.digest()
+    parts = [digest, model, str(max_tokens), str(omitted), normalize_question(question)]
+    for earlier_question, answer in history:
+        parts.extend((earlier_question, answer))
+    data = "\0".join(parts).encode("utf-8", errors="surrogatepass")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def replay_chunks(text, size=REPLAY_CHUNK_SIZE):
+    """Split a cached answer into chunks to send like a streamed one."""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+class AnswerCache:
+    """Completed answers and their token usage, keyed by answer_key().
+
+    Entries expire ttl seconds after they were stored, and the least
+    recently used ones are evicted once the answers exceed max_bytes. They
+    are kept in SQLite at db_path; with db_path=None, or if the database
+    can't be opened, the cache is kept in memory instead.
+    """
+
+    def __init__(self, db_path=DEFAULT_ANSWER_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.persistent = db_path is not None
+        self._memory = OrderedDict()  # key -> (answer, usage, stored_at), least recently used first
+        self._memory_bytes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        if not self.persistent:
+            return
+        try:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            with closing(sqlite3.connect(db_path, timeout=30)) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS answers ("
+                    "key TEXT PRIMARY KEY, answer TEXT, usage TEXT, size INTEGER, stored_at REAL, last_used REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        except (OSError, sqlite3.Error) as e:
+            print(f"Answer cache kept in memory ({db_path}): {str(e)}")
+            self.persistent = False
+
+    def _conn(self):
+        # One connection per thread, since web requests are served on several
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30)
+        return conn
+
+    def get(self, key):
+        """Return (answer, usage) for key, or None if it isn't cached or has expired."""
+        now = time.time()
+        if self.persistent:
+            try:
+                with self._conn() as conn:
+                    row = conn.execute("SELECT answer, usage, stored_at FROM answers WHERE key = ?", (key,)).fetchone()
+                    if row is not None and now - row[2] <= self.ttl:
+                        conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+                        entry = (row[0], json.loads(row[1]))
+                    else:
+                        entry = None
+            except sqlite3.Error as e:
+                print(f"Error reading answer cache: {str(e)}")
+                entry = None
+        else:
+            with self._lock:
+                cached = self._memory.get(key)
+                if cached is not None and now - cached[2] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    entry = cached[:2]
+                else:
+                    entry = None
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, answer, usage):
+        """Store a completed answer, evicting expired and least recently used entries as needed."""
+        if not answer:
+            return
+        now = time.time()
+        size = len(answer.encode("utf-8", errors="surrogatepass"))
+        if size > self.max_bytes:
+            return
+
+        if not self.persistent:
+            with self._lock:
+                old = self._memory.pop(key, None)
+                if old is not None:
+                    self._memory_bytes -= len(old[0].encode("utf-8", errors="surrogatepass"))
+                self._memory[key] = (answer, usage, now)
+                self._memory_bytes += size
+                while self._memory_bytes > self.max_bytes or (
+                        self._memory and now - next(iter(self._memory.values()))[2] > self.ttl):
+                    _, (evicted, _, _) = self._memory.popitem(last=False)
+                    self._memory_bytes -= len(evicted.encode("utf-8", errors="surrogatepass"))
+            return
+
+        try:
+            with self._conn() as conn:
+                conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, answer, json.dumps(usage), size, now, now))
+                conn.execute("DELETE FROM answers WHERE stored_at < ?", (now - self.ttl,))
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+                if total > self.max_bytes:
+                    # Drop the least recently used answers until the rest fit
+                    rows = conn.execute("SELECT key, size FROM answers ORDER BY last_used").fetchall()
+                    evict = []
+                    for old_key, old_size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        evict.append((old_key,))
+                        total -= old_size
+                    conn.executemany("DELETE FROM answers WHERE key = ?", evict)
+        except sqlite3.Error as e:
+            print(f"Error writing answer cache: {str(e)}")
+
+    def clear(self):
+        """Forget every cached answer."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.persistent:
+            try:
+                with self._conn() as conn:
+                    conn.execute("DELETE FROM answers")
+            except sqlite3.Error as e:
+                print(f"Error clearing answer cache: {str(e)}")
@@ -0,0 +1,112 @@
+"""Asking many questions about one context through the Message Batches API.
+
+Batches are processed asynchronously at half the price of individual
+requests, which suits large offline question sets such as nightly audits.
+Every request repeats the same cached file context, so questions after the
+first read it from the prompt cache.
+"""
+import json
+import time
+
+import scheduler
+from prompts import SYSTEM_PROMPT, build_messages, usage_dict
+
+MAX_BATCH_REQUESTS = 100000
+MAX_BATCH_BYTES = 200 * 1024 * 1024  # Below the API's 256MB limit on a batch
+POLL_INITIAL_DELAY = 5.0  # Seconds before the first status check
+POLL_MAX_DELAY = 120.0
+POLL_BACKOFF = 1.5
+
+
+def batch_requests(context, questions, model, max_tokens):
+    """Return one batch request per question, with custom_ids recording their position."""
+    requests = []
+    for i, question in enumerate(questions):
+        # Pack the files most relevant to each question if they don't all fit
+        question_context = context.for_question(question)
+        requests.append({
+            "custom_id": f"q{i}",
+            "params": {
+                "model": model,
+                "max_tokens": max_tokens,
+                "system": SYSTEM_PROMPT,
+                "messages": build_messages(question_context, question),
+            },
+        })
+    return requests
+
+
+def split_requests(requests, max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES):
+    """Split requests into lists that each fit in one batch."""
+    batch, size = [], 0
+    for request in requests:
+        request_size = len(json.dumps(request))
+        if batch and (len(batch) >= max_requests or size + request_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(request)
+        size += request_size
+    if batch:
+        yield batch
+
+
+def wait_for_batch(client, batch_id, initial_delay=POLL_INITIAL_DELAY, max_delay=POLL_MAX_DELAY,
+                   timeout=None, sleep=time.sleep):
+    """Poll a batch, backing off between checks, until it has ended. Returns the final batch.
+
+    Raises TimeoutError if it is still running after timeout seconds.
+    """
+    started = time.monotonic()
+    delay = initial_delay
+    while True:
+        batch = scheduler.call(client, client.messages.batches.retrieve, batch_id, priority=scheduler.BACKGROUND)
+        if batch.processing_status == "ended":
+            return batch
+        if timeout is not None and time.monotonic() - started + delay > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {batch.processing_status} after {timeout:.0f}s")
+        sleep(delay)
+        delay = min(delay * POLL_BACKOFF, max_delay)
+
+
+def _batch_results(client, batch_id):
+    return list(client.messages.batches.results(batch_id))
+
+
+def _result_dict(result):
+    if result.type == "succeeded":
+        message = result.message
+        text = "".join(block.text for block in message.content if block.type == "text")
+        return {"answer": text, "usage": usage_dict(message.usage)}
+    if result.type == "errored":
+        error = getattr(result.error, "error", result.error)
+        return {"error": getattr(error, "message", str(error))}
+    return {"error": f"Request {result.type}"}
+
+
+def run_batches(client, context, questions, model, max_tokens, on_submit=None, **poll_options):
+    """Ask every question about context through the Message Batches API.
+
+    Returns one dict per question, in input order, holding the answer and
+    token usage or an error. on_submit, if given, is called with each batch ID
+    once it has been created. poll_options are passed on to wait_for_batch().
+    """
+    results = [None] * len(questions)
+    batch_ids = []
+    for requests in split_requests(batch_requests(context, questions, model, max_tokens)):
+        batch = scheduler.call(client, client.messages.batches.create, requests=requests,
+                               priority=scheduler.BACKGROUND)
+        batch_ids.append(batch.id)
+        if on_submit is not None:
+            on_submit(batch.id)
+
+    for batch_id in batch_ids:
+        wait_for_batch(client, batch_id, **poll_options)
+        # Results come back in any order; custom_id says which question each one answers.
+        # They are read in full inside the slot, so a download that fails part way is retried
+        responses = scheduler.call(client, _batch_results, client, batch_id, priority=scheduler.BACKGROUND)
+        for response in responses:
+            result = _result_dict(response.result)
+            result["batch_id"] = batch_id
+            results[int(response.custom_id[1:])] = result
+
+    return [result if result is not None else {"error": "No result returned"} for result in results]
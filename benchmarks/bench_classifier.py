@@ -0,0 +1,94 @@
+"""Classification cost per file: the old per-character is_text_file vs. classifier.TextClassifier.
+
+Builds a mixed corpus in a temporary directory (source files, extensionless
+and unknown-extension text in ASCII, UTF-8 and UTF-16, and binary files),
+then classifies every file with each implementation. Disagreements with the
+expected verdict are reported per kind.
+
+    python benchmarks/bench_classifier.py [FILES_PER_KIND]
+"""
+import codecs
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifier import BINARY_EXTENSIONS, TEXT_EXTENSIONS, TextClassifier
+
+ASCII_LINE = b"def handler(request, *args, **kwargs):  # process the incoming request\n"
+UTF8_LINE = "Résumé des paramètres – « valeur par défaut » 設定ファイル\n".encode("utf-8")
+
+
+def legacy_is_text_file(file_path):
+    """The per-character check previously copied into claudefc.py and webui.py."""
+    try:
+        _, ext = os.path.splitext(file_path.lower())
+        if ext in BINARY_EXTENSIONS:
+            return False
+        if ext in TEXT_EXTENSIONS:
+            return True
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            sample = f.read(1024)
+            if sample:
+                printable_count = sum(1 for c in sample if 32 <= ord(c) <= 126 or c in '\n\r\t')
+                return printable_count / len(sample) > 0.9
+            return True
+    except UnicodeDecodeError:
+        return False
+    except Exception:
+        return False
+
+
+def build_corpus(root, per_kind, rng):
+    """Write the corpus and return [(kind, path, expected_is_text)]."""
+    kinds = {
+        # kind: (file name pattern, content factory, expected verdict)
+        "known text ext": ("module_{}.py", lambda i: ASCII_LINE * 40, True),
+        "known binary ext": ("image_{}.png", lambda i: os.urandom(4096), False),
+        "no ext, ASCII": ("Makefile_{}", lambda i: ASCII_LINE * 40, True),
+        "unknown ext, UTF-8": ("notes_{}.cfg", lambda i: UTF8_LINE * 40, True),
+        "unknown ext, UTF-16": ("strings_{}.rc", lambda i: codecs.BOM_UTF16_LE + (ASCII_LINE * 20).decode().encode("utf-16-le"), True),
+        "duplicate LICENSE": ("LICENSE_{}", lambda i: UTF8_LINE * 20, True),
+        "unknown ext, binary": ("blob_{}.dat", lambda i: os.urandom(4096), False),
+        "unknown ext, NUL padded": ("record_{}.idx", lambda i: (b"key=value\0" + b"\0" * 22) * 64, False),
+    }
+    corpus = []
+    for kind, (pattern, factory, expected) in kinds.items():
+        for i in range(per_kind):
+            path = os.path.join(root, pattern.format(i))
+            with open(path, "wb") as f:
+                f.write(factory(i))
+            corpus.append((kind, path, expected))
+    rng.shuffle(corpus)
+    return corpus
+
+
+def run(label, is_text_file, corpus):
+    started = time.perf_counter()
+    verdicts = [is_text_file(path) for _, path, _ in corpus]
+    elapsed = time.perf_counter() - started
+
+    wrong = {}
+    for (kind, _, expected), verdict in zip(corpus, verdicts):
+        if verdict != expected:
+            wrong[kind] = wrong.get(kind, 0) + 1
+    print(f"{label:30s} {elapsed / len(corpus) * 1e6:8.1f} us/file   misclassified: {wrong or 'none'}")
+
+
+if __name__ == "__main__":
+    per_kind = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as root:
+        corpus = build_corpus(root, per_kind, rng)
+        print(f"{len(corpus)} files, {per_kind} per kind")
+
+        # Read everything once so both implementations see a warm page cache
+        run("warm-up", legacy_is_text_file, corpus)
+        run("legacy is_text_file", legacy_is_text_file, corpus)
+
+        classifier = TextClassifier()
+        run("TextClassifier (cold memo)", classifier.is_text_file, corpus)
+        run("TextClassifier (warm memo)", classifier.is_text_file, corpus)
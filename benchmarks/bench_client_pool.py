@@ -0,0 +1,65 @@
+"""First-byte latency with a new client per request vs. the pooled ClientRegistry.
+
+Runs against the local mock Messages API, so it measures client construction
+and connection setup only (no TLS); against the real API the pooled client
+also skips a TLS handshake per request.
+
+    python benchmarks/bench_client_pool.py [REQUESTS]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import anthropic
+
+from clients import ClientRegistry
+from mock_api import MockConfig, start_mock_server
+
+
+def first_byte(client):
+    """Seconds from sending a streamed request to receiving the first text delta."""
+    started = time.perf_counter()
+    with client.messages.stream(
+        model="claude-3-7-sonnet-20250219",
+        max_tokens=16,
+        messages=[{"role": "user", "content": "ping"}],
+    ) as stream:
+        for _ in stream.text_stream:
+            elapsed = time.perf_counter() - started
+            break
+        for _ in stream.text_stream:
+            pass
+    return elapsed
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:28s} median {statistics.median(samples) * 1000:7.2f} ms   p95 {p95 * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    server, base_url = start_mock_server(MockConfig(ttft=0.0, answer_tokens=4))
+    os.environ["ANTHROPIC_BASE_URL"] = base_url
+
+    # Before: a new client (and connection pool) for every question
+    fresh = []
+    for _ in range(requests):
+        client = anthropic.Anthropic(api_key="mock-key", base_url=base_url)
+        fresh.append(first_byte(client))
+        client.close()
+    report("new client per request", fresh)
+
+    # After: one pooled client reused across questions
+    registry = ClientRegistry()
+    pooled = []
+    for _ in range(requests):
+        with registry.client("mock-key") as client:
+            pooled.append(first_byte(client))
+    report("pooled ClientRegistry", pooled)
+    registry.close()
+    server.shutdown()
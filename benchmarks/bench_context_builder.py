@@ -0,0 +1,69 @@
+"""Microbenchmark: ContextBuilder vs. repeated string concatenation.
+
+Run from the repository root:
+
+    python benchmarks/bench_context_builder.py [FILES] [FILE_SIZE]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contextbuilder import ContextBuilder, file_header
+
+
+class _Holder:
+    """Mimics the GUI, which accumulated the context on an instance attribute."""
+    file_contents = ""
+
+
+def concat_attribute(files):
+    holder = _Holder()
+    for path, content in files:
+        holder.file_contents += file_header(path) + content
+    return holder.file_contents
+
+
+def concat_local(files):
+    file_contents = ""
+    for path, content in files:
+        file_contents += file_header(path) + content
+    return file_contents
+
+
+def builder(files):
+    context = ContextBuilder(max_size=sys.maxsize)
+    for path, content in files:
+        context.add_file(path, content)
+    return context.build()
+
+
+def measure(func, files):
+    # Time without tracing, then run again to record peak memory
+    started = time.perf_counter()
+    result = func(files)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    func(files)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    files = [(f"src/pkg{i % 50}/module_{i}.py", ("x = %d\n" % i) * (size // 8)) for i in range(count)]
+
+    expected = None
+    for name, func in (("+= on attribute", concat_attribute), ("+= on local", concat_local),
+                       ("ContextBuilder", builder)):
+        result, elapsed, peak = measure(func, files)
+        if expected is None:
+            expected = result
+        assert result == expected, f"{name} produced different output"
+        print(f"{name:16s} {elapsed * 1000:8.1f} ms  peak {peak / (1024 * 1024):6.1f} MB  "
+              f"({len(result) / (1024 * 1024):.1f} MB context)")
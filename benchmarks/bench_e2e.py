@@ -0,0 +1,285 @@
+"""End-to-end benchmark: loading, uploading and answering against the local mock Messages API.
+
+Builds a synthetic repository, then measures
+  - load: the desktop loading path (pipeline.load_folder), cold and with a warm file cache
+  - upload: POST /api/upload on webui.py with every file of the repository
+  - ask: time to first token and tokens/sec delivered by pipeline.ask
+  - sessions: concurrent sessions of connect, upload and questions over HTTP against webui.py
+and writes the results as JSON. Pass --compare with an earlier results file
+to see the change in each metric.
+
+    python benchmarks/bench_e2e.py [--files 2000] [--sessions 8] [--output results.json] [--compare old.json]
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from mock_api import MockConfig, start_mock_server
+from synthetic_repo import make_repo
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+# The mock doesn't care which model is asked for; keep the SDK's model deprecation notices out of the report
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(values):
+    return {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95),
+            "mean": statistics.fmean(values) if values else None}
+
+
+def bench_load(repo, max_tokens):
+    from filecache import FileCache
+    from pipeline import load_folder, new_context
+    from scanner import ScanStats
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FileCache(os.path.join(cache_dir, "files.sqlite3"))
+        for label in ("cold", "warm"):
+            context = new_context(MODEL, max_tokens)
+            stats = ScanStats()
+            load_folder(repo, context, stats=stats, cache=cache)
+            results[label] = {"seconds": round(stats.elapsed, 4), "files": stats.files_read,
+                              "mb_per_sec": round(stats.bytes_per_sec / 1e6, 1),
+                              "tokens": context.total_tokens, "peak_rss_mb": peak_rss_mb()}
+    return results
+
+
+def multipart_body(repo, boundary):
+    out = io.BytesIO()
+    for directory, _, names in os.walk(repo):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            relpath = os.path.relpath(path, repo).replace(os.sep, '/')
+            out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="files[]"; '
+                      f'filename="{relpath}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+            out.write(data + b'\r\n')
+    out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="model"\r\n\r\n{MODEL}\r\n'.encode())
+    out.write(f'--{boundary}--\r\n'.encode())
+    return out.getvalue()
+
+
+def bench_upload(webui, repo):
+    boundary = uuid.uuid4().hex
+    body = multipart_body(repo, boundary)
+    client = webui.app.test_client()
+    started = time.perf_counter()
+    response = client.post('/api/upload', data=body, content_type=f'multipart/form-data; boundary={boundary}')
+    elapsed = time.perf_counter() - started
+    result = response.get_json()
+    if not result.get("success"):
+        raise RuntimeError(f"Upload failed: {result.get('message')}")
+    return {"seconds": round(elapsed, 4), "mb": round(len(body) / 1e6, 1), "files": len(result.get("files", [])),
+            "mb_per_sec": round(len(body) / 1e6 / elapsed, 1), "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_ask(repo, base_url, questions, max_tokens):
+    from clients import make_client
+    from conversation import Conversation
+    from pipeline import ask, load_folder, new_context
+
+    context = new_context(MODEL, max_tokens)
+    load_folder(repo, context)
+    client = make_client("bench", max_connections=4)
+    client = client.with_options(base_url=base_url)
+
+    first_tokens, rates = [], []
+    try:
+        for i in range(questions):
+            answer = ask(client, Conversation(context), f"Question {i}: where is the cache handled?", MODEL, max_tokens)
+            first_tokens.append(answer.first_token)
+            streaming = answer.elapsed - answer.first_token
+            if streaming > 0:
+                rates.append(answer.usage["output_tokens"] / streaming)
+    finally:
+        client.close()
+    return {"ttft_seconds": summarize(first_tokens), "tokens_per_sec": summarize(rates),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def _session(base_url, upload_body, boundary, questions, session_id, samples, errors):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    try:
+        opener.open(urllib.request.Request(f"{base_url}/api/connect", data=json.dumps({"api_key": "bench"}).encode(),
+                                           headers={"Content-Type": "application/json"})).read()
+        opener.open(urllib.request.Request(f"{base_url}/api/upload", data=upload_body,
+                                           headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})).read()
+        for i in range(questions):
+            query = urllib.parse.urlencode({"question": f"Session {session_id} question {i}", "max_tokens": 1024})
+            started = time.perf_counter()
+            first = None
+            with opener.open(f"{base_url}/api/ask-stream?{query}") as response:
+                for line in response:
+                    if not line.startswith(b"data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if "error" in event:
+                        raise RuntimeError(event["error"])
+                    if first is None and "chunk" in event:
+                        first = time.perf_counter() - started
+                    if event.get("done"):
+                        break
+            samples.append((first, time.perf_counter() - started))
+    except Exception as e:
+        errors.append(str(e))
+
+
+def bench_sessions(webui, repo, sessions, questions):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, webui.app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    boundary = uuid.uuid4().hex
+    upload_body = multipart_body(repo, boundary)
+    samples, errors = [], []
+    workers = [threading.Thread(target=_session, args=(base_url, upload_body, boundary, questions, i, samples, errors))
+               for i in range(sessions)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    return {"sessions": sessions, "answers": len(samples), "errors": len(errors), "seconds": round(elapsed, 3),
+            "answers_per_sec": round(len(samples) / elapsed, 2),
+            "ttft_seconds": summarize([first for first, _ in samples if first is not None]),
+            "answer_seconds": summarize([total for _, total in samples]), "peak_rss_mb": peak_rss_mb()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """Yield (dotted.name, value) for every number in a results dict."""
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(old, new):
+    old_metrics = dict(flatten(old["results"]))
+    print(f"\nChange from {old.get('commit') or 'previous run'} to {new.get('commit') or 'this run'}:")
+    for name, value in flatten(new["results"]):
+        before = old_metrics.get(name)
+        if before:
+            print(f"  {name:40s} {before:>12.4g} -> {value:<12.4g} {(value - before) / before:+7.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--mean-size", type=int, default=4096)
+    parser.add_argument("--binary-ratio", type=float, default=0.1)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--ttft", type=float, default=0.05, help="mock seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=500.0, help="mock output rate")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=10, help="questions per measurement and session")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent web sessions")
+    parser.add_argument("--max-tokens", type=int, default=4096)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    mock_config = MockConfig(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens)
+    server, base_url = start_mock_server(mock_config)
+    os.environ["ANTHROPIC_BASE_URL"] = base_url
+
+    import webui
+    from answercache import AnswerCache
+    # Every question should reach the mock, so nothing is answered from the cache
+    webui.answer_cache = AnswerCache(None, max_bytes=0)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as repo:
+        counts = make_repo(repo, files=args.files, mean_size=args.mean_size, binary_ratio=args.binary_ratio,
+                           depth=args.depth)
+        print(f"Repository: {counts['text']} text and {counts['binary']} binary files, {counts['bytes'] / 1e6:.1f} MB")
+
+        for name, run in (
+            ("load", lambda: bench_load(repo, args.max_tokens)),
+            ("upload", lambda: bench_upload(webui, repo)),
+            ("ask", lambda: bench_ask(repo, base_url, args.questions, args.max_tokens)),
+            ("sessions", lambda: bench_sessions(webui, repo, args.sessions, args.questions)),
+        ):
+            results[name] = run()
+            print(f"{name:10s} {json.dumps(results[name])}")
+    server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "repository": counts,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
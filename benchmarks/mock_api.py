@@ -0,0 +1,287 @@
+"""Local mock of the Anthropic Messages API for offline benchmarks.
+
+Serves POST /v1/messages (streaming and non-streaming),
+POST /v1/messages/count_tokens and the Message Batches endpoints
+(/v1/messages/batches) with configurable latency and token rate.
+Point a client at it with base_url, or set ANTHROPIC_BASE_URL.
+
+It can also throttle like the real API: with request or input-token
+limits per window it sends anthropic-ratelimit-* headers and answers 429
+with retry-after past them, past max_concurrent streams it answers 429,
+and overload_ratio of requests get 529.
+
+    python benchmarks/mock_api.py [PORT]
+"""
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockConfig:
+    """Knobs controlling how the mock answers."""
+
+    def __init__(self, ttft=0.05, tokens_per_sec=500.0, answer_tokens=200, chunk_tokens=4, batch_seconds=1.0,
+                 requests_per_window=None, input_tokens_per_window=None, window=1.0, max_concurrent=None,
+                 overload_ratio=0.0, retry_after=1):
+        self.ttft = ttft  # Seconds before the first text delta
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.chunk_tokens = chunk_tokens
+        self.batch_seconds = batch_seconds  # Seconds before a submitted batch has ended
+        # Throttling of POST /v1/messages; None means unlimited
+        self.requests_per_window = requests_per_window
+        self.input_tokens_per_window = input_tokens_per_window
+        self.window = window  # Seconds before the request and token budgets refill
+        self.max_concurrent = max_concurrent
+        self.overload_ratio = overload_ratio  # Fraction of requests answered 529 overloaded
+        self.retry_after = retry_after  # Seconds, sent with every 429
+
+
+class Throttle:
+    """Request and input-token budgets per fixed window, and a cap on concurrent requests."""
+
+    def __init__(self, config):
+        self.config = config
+        self.window_start = time.monotonic()
+        self.requests = 0
+        self.input_tokens = 0
+        self.active = 0
+        self.refused = 0
+        self.overloaded = 0
+        self.peak_active = 0
+        self._lock = threading.Lock()
+
+    def admit(self, input_tokens):
+        """Start a request. Returns (status, error type, headers); status 200 means go ahead, then call done()."""
+        config = self.config
+        with self._lock:
+            now = time.monotonic()
+            if now - self.window_start >= config.window:
+                self.window_start, self.requests, self.input_tokens = now, 0, 0
+            reset = (datetime.now(timezone.utc) + timedelta(seconds=config.window - (now - self.window_start)))
+            reset = reset.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+            headers = {}
+            over = False
+            for kind, limit, used, needed in (("requests", config.requests_per_window, self.requests, 1),
+                                              ("input-tokens", config.input_tokens_per_window, self.input_tokens,
+                                               input_tokens)):
+                if limit is None:
+                    continue
+                over = over or used + needed > limit
+                headers[f"anthropic-ratelimit-{kind}-limit"] = str(limit)
+                headers[f"anthropic-ratelimit-{kind}-remaining"] = str(max(0, limit - used - (0 if over else needed)))
+                headers[f"anthropic-ratelimit-{kind}-reset"] = reset
+            if over or (config.max_concurrent is not None and self.active >= config.max_concurrent):
+                self.refused += 1
+                headers["retry-after"] = str(config.retry_after)
+                return 429, "rate_limit_error", headers
+            if config.overload_ratio and random.random() < config.overload_ratio:
+                self.overloaded += 1
+                return 529, "overloaded_error", headers
+
+            self.requests += 1
+            self.input_tokens += input_tokens
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            return 200, None, headers
+
+    def done(self):
+        with self._lock:
+            self.active -= 1
+
+
+def _input_tokens(body):
+    """Rough input size of a request, about four characters per token."""
+    return max(1, len(json.dumps(body.get("messages", []))) // 4)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Without TCP_NODELAY, small SSE writes on a kept-alive connection stall on delayed ACKs
+    disable_nagle_algorithm = True
+    config = MockConfig()
+    batches = {}  # batch ID -> (submitted at, requests); each server gets its own
+    batch_ids = itertools.count(1)
+    throttle = None  # Each server gets its own
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_event(self, name, payload):
+        self._write_chunk(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        body = self._read_json()
+        if path == "/v1/messages/count_tokens":
+            self._send_json({"input_tokens": _input_tokens(body)})
+        elif path == "/v1/messages":
+            self.handle_messages(body)
+        elif path == "/v1/messages/batches":
+            batch_id = f"msgbatch_mock{next(self.batch_ids)}"
+            self.batches[batch_id] = (time.monotonic(), body.get("requests", []))
+            self._send_json(self.batch(batch_id))
+        else:
+            self._not_found(path)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        parts = path.strip("/").split("/")
+        if parts[:3] != ["v1", "messages", "batches"] or len(parts) not in (4, 5) or parts[3] not in self.batches:
+            return self._not_found(path)
+        if len(parts) == 4:
+            return self._send_json(self.batch(parts[3]))
+        if parts[4] != "results" or not self._batch_ended(parts[3]):
+            return self._not_found(path)
+
+        # Results are returned in reverse, since the real API makes no promise about their order
+        config = self.config
+        text = "token " * config.answer_tokens
+        lines = [json.dumps({"custom_id": request["custom_id"], "result": {
+            "type": "succeeded", "message": self.message(request["params"], text, config.answer_tokens)}})
+            for request in reversed(self.batches[parts[3]][1])]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self, path):
+        self._send_json({"type": "error", "error": {"type": "not_found_error", "message": path}}, 404)
+
+    def _batch_ended(self, batch_id):
+        return time.monotonic() - self.batches[batch_id][0] >= self.config.batch_seconds
+
+    def batch(self, batch_id):
+        requests = self.batches[batch_id][1]
+        ended = self._batch_ended(batch_id)
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0 if ended else len(requests), "succeeded": len(requests) if ended else 0,
+                               "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": "2025-01-01T00:00:00Z",
+            "expires_at": "2025-01-02T00:00:00Z",
+            "ended_at": "2025-01-01T00:01:00Z" if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"http://{self.headers.get('Host')}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def message(self, body, text, output_tokens):
+        return {
+            "id": "msg_mock",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": [{"type": "text", "text": text}] if text else [],
+            "stop_reason": "end_turn" if text else None,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": _input_tokens(body),
+                "output_tokens": output_tokens,
+                "cache_read_input_tokens": 0,
+                "cache_creation_input_tokens": 0,
+            },
+        }
+
+    def handle_messages(self, body):
+        status, error_type, headers = self.throttle.admit(_input_tokens(body))
+        if status != 200:
+            self._send_json({"type": "error", "error": {"type": error_type, "message": "Mock throttled the request"}},
+                            status, headers)
+            return
+        try:
+            self.answer(body, headers)
+        finally:
+            self.throttle.done()
+
+    def answer(self, body, headers):
+        config = self.config
+        chunks = max(1, config.answer_tokens // config.chunk_tokens)
+        words = ["token "] * config.chunk_tokens
+
+        if not body.get("stream"):
+            time.sleep(config.ttft + config.answer_tokens / config.tokens_per_sec)
+            self._send_json(self.message(body, "".join(words) * chunks, config.answer_tokens), headers=headers)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        self._send_event("message_start", {"type": "message_start", "message": self.message(body, "", 1)})
+        self._send_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                 "content_block": {"type": "text", "text": ""}})
+        time.sleep(config.ttft)
+        interval = config.chunk_tokens / config.tokens_per_sec
+        try:
+            for _ in range(chunks):
+                self._send_event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                         "delta": {"type": "text_delta", "text": "".join(words)}})
+                time.sleep(interval)
+            self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self._send_event("message_delta", {"type": "message_delta",
+                                               "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                               "usage": {"output_tokens": config.answer_tokens}})
+            self._send_event("message_stop", {"type": "message_stop"})
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-stream
+            pass
+
+
+class MockServer(ThreadingHTTPServer):
+    # socketserver's default listen backlog of 5 drops connections when many clients open at once,
+    # and each dropped one waits a second for its SYN to be retried
+    request_queue_size = 1024
+
+
+def start_mock_server(config=None, port=0, handler=MockHandler):
+    """Start the mock in a background thread. Returns (server, base_url)."""
+    config = config or MockConfig()
+    handler = type("ConfiguredMockHandler", (handler,), {"config": config, "batches": {}, "throttle": Throttle(config)})
+    server = MockServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    server, url = start_mock_server(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f"Mock Messages API listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
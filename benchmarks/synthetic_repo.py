@@ -0,0 +1,89 @@
+"""Generate synthetic repositories for benchmarks.
+
+Text files are made of identifier-rich source lines in a mix of languages;
+binary files are random bytes with a binary extension or none. Files
+are spread over a directory tree of the given depth and fan-out, and a
+node_modules directory is added for the ignore rules to prune.
+
+    python benchmarks/synthetic_repo.py DEST [FILES] [MEAN_SIZE] [BINARY_RATIO] [DEPTH]
+"""
+import os
+import random
+import sys
+
+TEXT_KINDS = (
+    ('.py', "def {a}_{b}(self, {c}):\n    return self.{d}({c}) + {n}\n"),
+    ('.js', "export function {a}{B}({c}) {{ return {d}({c}) + {n}; }}\n"),
+    ('.go', "func ({a} *{B}) {d}({c} int) int {{ return {c} + {n} }}\n"),
+    ('.md', "The {a} {b} uses {c} to {d} every {n} requests.\n"),
+    ('.json', '  "{a}_{b}": {{"{c}": {n}, "{d}": true}},\n'),
+    ('', "{A}_{B}={c}:{n}  # {d}\n"),  # Extensionless text, classified by content
+)
+BINARY_EXTENSIONS = ('.png', '.pdf', '.bin', '')  # Not .zip, which the web UI would open as an archive
+WORDS = ("request", "session", "cache", "token", "stream", "client", "parser", "index", "config", "handler",
+         "buffer", "socket", "upload", "context", "budget", "worker", "queue", "router", "schema", "record")
+
+
+def _line(template, rng):
+    a, b, c, d = (rng.choice(WORDS) for _ in range(4))
+    return template.format(a=a, b=b, c=c, d=d, A=a.upper(), B=b.capitalize(), n=rng.randrange(1000))
+
+
+def _directories(root, depth, fanout):
+    dirs = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [os.path.join(parent, f"{WORDS[i % len(WORDS)]}{i}") for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    for path in dirs:
+        os.makedirs(path, exist_ok=True)
+    return dirs
+
+
+def make_repo(root, files=1000, mean_size=4096, binary_ratio=0.1, depth=3, fanout=3, ignored_files=50, seed=1):
+    """Write a synthetic repository under root. Returns {'text': n, 'binary': n, 'bytes': n}."""
+    rng = random.Random(seed)
+    dirs = _directories(root, depth, fanout)
+    counts = {'text': 0, 'binary': 0, 'bytes': 0}
+
+    for i in range(files):
+        directory = rng.choice(dirs)
+        # Sizes vary around the mean, as real files do
+        size = max(16, int(rng.expovariate(1 / mean_size)))
+        if rng.random() < binary_ratio:
+            path = os.path.join(directory, f"asset_{i}{rng.choice(BINARY_EXTENSIONS)}")
+            data = rng.randbytes(size)
+            counts['binary'] += 1
+        else:
+            extension, template = rng.choice(TEXT_KINDS)
+            path = os.path.join(directory, f"{rng.choice(WORDS)}_{i}{extension}")
+            lines = []
+            written = 0
+            while written < size:
+                line = _line(template, rng)
+                lines.append(line)
+                written += len(line)
+            data = "".join(lines).encode('utf-8')
+            counts['text'] += 1
+        with open(path, 'wb') as f:
+            f.write(data)
+        counts['bytes'] += len(data)
+
+    # A dependency directory the default ignore rules should skip without reading
+    vendored = os.path.join(root, 'node_modules', 'vendored')
+    os.makedirs(vendored, exist_ok=True)
+    for i in range(ignored_files):
+        with open(os.path.join(vendored, f"dep_{i}.js"), 'w', encoding='utf-8') as f:
+            f.write(_line(TEXT_KINDS[1][1], rng) * 20)
+    return counts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    args = sys.argv[2:]
+    options = dict(zip(('files', 'mean_size', 'binary_ratio', 'depth'), args))
+    counts = make_repo(sys.argv[1], files=int(options.get('files', 1000)),
+                       mean_size=int(options.get('mean_size', 4096)),
+                       binary_ratio=float(options.get('binary_ratio', 0.1)), depth=int(options.get('depth', 3)))
+    print(f"{counts['text']} text and {counts['binary']} binary files, {counts['bytes'] / 1e6:.1f} MB")
@@ -0,0 +1,168 @@
+"""Byte-level text/binary classification shared by the desktop app, scanner and web UI."""
+import codecs
+import hashlib
+import os
+import threading
+
+SAMPLE_SIZE = 8192  # Bytes at the start of a file used to classify it
+MAX_CONTROL_RATIO = 0.1  # Text may contain a few stray control bytes, binary has many
+MAX_HIGH_BYTE_RATIO = 0.3  # For samples that are not valid UTF-8, e.g. Latin-1 text
+MEMO_SIZE = 65536  # Content verdicts remembered before the memo is reset
+
+BINARY_EXTENSIONS = {
+    # Images
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.ico', '.svg',
+    # Audio
+    '.mp3', '.wav', '.ogg', '.flac', '.aac', '.wma', '.m4a',
+    # Video
+    '.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm',
+    # Archives
+    '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2',
+    # Executables
+    '.exe', '.dll', '.so', '.dylib', '.bin',
+    # Other binary
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.db', '.sqlite', '.mdb', '.class', '.pyc', '.o'
+}
+
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.py', '.js', '.html', '.css', '.java', '.c', '.cpp', '.h',
+    '.cs', '.php', '.rb', '.go', '.rs', '.ts', '.swift', '.kt', '.scala', '.pl',
+    '.sql', '.json', '.xml', '.yaml', '.yml', '.toml', '.ini', '.conf', '.sh',
+    '.bat', '.ps1', '.log', '.csv', '.rst', '.r', '.dart', '.lua'
+}
+
+# Byte order marks, longest first since the UTF-32 LE mark starts with the UTF-16 LE one
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Control bytes other than tab, newline, form feed, carriage return and escape (ANSI colours in logs)
+CONTROL_BYTES = bytes(b for b in range(32) if b not in (9, 10, 12, 13, 27)) + b'\x7f'
+HIGH_BYTES = bytes(range(128, 256))
+CONTROL_CHARS = dict.fromkeys(CONTROL_BYTES)  # str.translate table deleting the same characters
+
+
+def text_encoding(head):
+    """Return the encoding to decode a file with, from the byte order mark in its first bytes."""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    return 'utf-8'
+
+
+def decode_text(data):
+    """Decode a text file's bytes the way a text-mode read would, newlines included."""
+    text = data.decode(text_encoding(data[:4]), errors='ignore')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _valid_prefix(head, encoding):
+    # A sample can end part-way through a character, so decode it incrementally
+    try:
+        return codecs.getincrementaldecoder(encoding)('strict').decode(head, False)
+    except UnicodeDecodeError:
+        return None
+
+
+def sniff(head):
+    """Classify a file from its first bytes. Returns True for text."""
+    if not head:
+        return True  # Empty file is considered text
+
+    encoding = text_encoding(head)
+    if encoding != 'utf-8':
+        # A BOM only counts if what follows decodes in that encoding
+        text = _valid_prefix(head, encoding)
+        if text is None:
+            return False
+        return len(text) - len(text.translate(CONTROL_CHARS)) <= len(text) * MAX_CONTROL_RATIO
+
+    if b'\0' in head:
+        return False
+    controls = len(head) - len(head.translate(None, CONTROL_BYTES))
+    if controls > len(head) * MAX_CONTROL_RATIO:
+        return False
+    if head.isascii() or _valid_prefix(head, 'utf-8') is not None:
+        return True
+    high = len(head) - len(head.translate(None, HIGH_BYTES))
+    return high <= len(head) * MAX_HIGH_BYTE_RATIO
+
+
+class TextClassifier:
+    """Decides whether a file is text, from its extension or else its first bytes.
+
+    Extensions are looked up in a registry that starts from TEXT_EXTENSIONS
+    and BINARY_EXTENSIONS and can be changed with register() and
+    unregister(). Files with other extensions are sniffed, and the verdict
+    is memoized by a hash of the sample, so identical files (licences,
+    vendored copies, generated stubs) are only examined once.
+    """
+
+    def __init__(self, text_extensions=TEXT_EXTENSIONS, binary_extensions=BINARY_EXTENSIONS,
+                 sample_size=SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self._extensions = {}
+        self._verdicts = {}
+        self._lock = threading.Lock()
+        self.register(binary_extensions, False)
+        self.register(text_extensions, True)
+
+    @staticmethod
+    def _normalize(extension):
+        extension = extension.lower()
+        return extension if extension.startswith('.') else '.' + extension
+
+    def register(self, extensions, is_text):
+        """Always treat files with these extensions as text (is_text=True) or binary."""
+        for extension in extensions:
+            self._extensions[self._normalize(extension)] = bool(is_text)
+
+    def unregister(self, extensions):
+        """Go back to sniffing the content of files with these extensions."""
+        for extension in extensions:
+            self._extensions.pop(self._normalize(extension), None)
+
+    def extension_verdict(self, path):
+        """Return True or False if the extension decides, or None if the content must be checked."""
+        return self._extensions.get(os.path.splitext(path)[1].lower())
+
+    def classify(self, head):
+        """Return True if a file starting with these bytes is text."""
+        sample = bytes(head[:self.sample_size])
+        if sample.isascii() and len(sample.translate(None, CONTROL_BYTES)) == len(sample):
+            return True  # Fast path for plain ASCII text
+
+        key = hashlib.blake2b(sample, digest_size=16).digest()
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            verdict = sniff(sample)
+            with self._lock:
+                if len(self._verdicts) >= MEMO_SIZE:
+                    self._verdicts.clear()
+                self._verdicts[key] = verdict
+        return verdict
+
+    def is_text_file(self, file_path, head=None):
+        """Determine if a file is a text file that can be read.
+
+        If head (the file's first bytes) is given, it is checked instead of opening file_path.
+        """
+        verdict = self.extension_verdict(file_path)
+        if verdict is not None:
+            return verdict
+        if head is None:
+            try:
+                with open(file_path, 'rb') as f:
+                    head = f.read(self.sample_size)
+            except OSError:
+                return False
+        return self.classify(head)
+
+
+default_classifier = TextClassifier()
+is_text_file = default_classifier.is_text_file
@@ -1,11 +1,105 @@
-import os
 import sys
+import time
 import tkinter as tk
 from tkinter import filedialog, ttk, scrolledtext
 import threading
 import mimetypes
-import anthropic
-import time
+import queue
+from answercache import AnswerCache
+from clients import make_client
+from contextbuilder import ContextBuilder
+from conversation import Conversation
+from filecache import FileCache
+from metrics import phase_summary
+from pipeline import ask, ask_sharded, load_folder, new_context, refresh_files
+from prompts import usage_summary
+from ranking import FileCorpus
+from scanner import ScanStats
+from tokens import TokenCounter
+from watcher import FolderWatcher
+
+FRAME_INTERVAL_MS = 33  # Redraw a streaming answer at most ~30 times a second
+STREAMING_NOTE = "\n\n[Response streaming...]"
+MAX_DIAGNOSTIC_LINES = 500  # Older lines are dropped from the diagnostics panel
+
+
+class StreamRenderer:
+    """Appends a streamed answer to a Text widget without blocking the thread reading the stream.
+
+    The reading thread put()s chunks on a queue. The Tk thread drains it
+    every interval_ms and inserts only the new text, just before the
+    streaming note, so each frame costs as much as its chunks rather than
+    the whole answer so far.
+    """
+    _DONE = object()
+
+    def __init__(self, root, widget, interval_ms=FRAME_INTERVAL_MS):
+        self.root = root
+        self.widget = widget
+        self.interval_ms = interval_ms
+        self._queue = queue.SimpleQueue()
+        self._job = None
+
+    def start(self):
+        """Clear the widget and begin draining chunks. Call from the Tk thread."""
+        # Chunks may already be queued, so keep them
+        if self._job is not None:
+            self.root.after_cancel(self._job)
+        self.widget.config(state=tk.NORMAL)
+        self.widget.delete(1.0, tk.END)
+        self.widget.insert(tk.END, STREAMING_NOTE)
+        # Text inserted at a right-gravity mark goes before it, so the note stays last
+        self.widget.mark_set("answer_end", 1.0)
+        self.widget.mark_gravity("answer_end", tk.RIGHT)
+        self.widget.config(state=tk.DISABLED)
+        self._job = self.root.after(self.interval_ms, self._drain)
+
+    def put(self, text):
+        """Queue a chunk of the answer. Safe from any thread and never blocks."""
+        self._queue.put(text)
+
+    def finish(self):
+        """Mark the end of the answer; the note is removed once everything is shown."""
+        self._queue.put(self._DONE)
+
+    def cancel(self):
+        """Stop rendering and drop queued chunks. Call from the Tk thread."""
+        if self._job is not None:
+            self.root.after_cancel(self._job)
+            self._job = None
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def _drain(self):
+        parts = []
+        done = False
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._DONE:
+                done = True
+                break
+            parts.append(item)
+
+        if parts or done:
+            # Only follow the new text if the user hasn't scrolled up to read
+            follow = self.widget.yview()[1] >= 1.0
+            self.widget.config(state=tk.NORMAL)
+            if parts:
+                self.widget.insert("answer_end", "".join(parts))
+            if done:
+                self.widget.delete("answer_end", tk.END)
+            self.widget.config(state=tk.DISABLED)
+            if follow:
+                self.widget.see(tk.END)
+
+        self._job = None if done else self.root.after(self.interval_ms, self._drain)
+
 
 class ClaudeAPIApp:
     def __init__(self, root):
@@ -15,8 +109,22 @@ class ClaudeAPIApp:
         self.root.configure(padx=10, pady=10)
         
         self.client = None
-        self.context_files = []
-        self.file_contents = ""
+        self.context = ContextBuilder()
+        self.conversation = Conversation(self.context)
+        self.corpus = FileCorpus()
+        self.token_counter = TokenCounter()
+        
+        # Watch mode refreshes changed files from a background thread; questions and
+        # loads hold this lock so they never see a context half updated
+        self.context_lock = threading.Lock()
+        self.loaded_folder = None
+        self.watcher = None
+        
+        # Remembers file verdicts and contents so reloads only re-read changed files
+        self.file_cache = FileCache()
+        
+        # Remembers answers, so asking the same question about unchanged files is instant
+        self.answer_cache = AnswerCache()
         
         # Set up mime types
         mimetypes.init()
@@ -77,9 +185,23 @@ class ClaudeAPIApp:
         load_btn = ttk.Button(content_frame, text="Load Files", command=self.load_files)
         load_btn.grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
         
+        # Exact token counts use the API's counting endpoint instead of the local estimate
+        self.exact_tokens_var = tk.BooleanVar(value=False)
+        exact_tokens_check = ttk.Checkbutton(content_frame, text="Exact token counts (slower)",
+                                             variable=self.exact_tokens_var)
+        exact_tokens_check.grid(row=1, column=2, sticky=tk.W, padx=5, pady=5)
+        
+        # Keep the loaded files current as they change on disk, re-reading only the changed ones
+        self.watch_var = tk.BooleanVar(value=False)
+        watch_check = ttk.Checkbutton(content_frame, text="Watch folder for changes", variable=self.watch_var,
+                                      command=self.toggle_watch)
+        watch_check.grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
+        self.watch_status_var = tk.StringVar(value="")
+        ttk.Label(content_frame, textvariable=self.watch_status_var).grid(row=2, column=2, sticky=tk.W, padx=5, pady=5)
+        
         # Files display
         self.files_display = scrolledtext.ScrolledText(content_frame, height=5, width=70, wrap=tk.WORD)
-        self.files_display.grid(row=2, column=0, columnspan=3, padx=5, pady=5, sticky=tk.W+tk.E)
+        self.files_display.grid(row=3, column=0, columnspan=3, padx=5, pady=5, sticky=tk.W+tk.E)
         self.files_display.config(state=tk.DISABLED)
         
         # Question Frame
@@ -91,19 +213,65 @@ class ClaudeAPIApp:
         self.question_entry = scrolledtext.ScrolledText(question_frame, height=3, width=70, wrap=tk.WORD)
         self.question_entry.pack(fill=tk.X, padx=5, pady=5)
         
-        # Send Button
-        self.send_btn = ttk.Button(question_frame, text="Send to Claude", command=self.send_question)
-        self.send_btn.pack(anchor=tk.W, padx=5, pady=5)
+        # Send Button, and one to start over with the same files
+        button_frame = ttk.Frame(question_frame)
+        button_frame.pack(anchor=tk.W)
+        self.send_btn = ttk.Button(button_frame, text="Send to Claude", command=self.send_question)
+        self.send_btn.pack(side=tk.LEFT, padx=5, pady=5)
+        self.new_conversation_btn = ttk.Button(button_frame, text="New Conversation", command=self.new_conversation)
+        self.new_conversation_btn.pack(side=tk.LEFT, padx=5, pady=5)
+        
+        # Ask every shard of a folder too large for one request, then merge the answers
+        self.sharded_var = tk.BooleanVar(value=False)
+        sharded_check = ttk.Checkbutton(button_frame, text="Search all files (map-reduce)", variable=self.sharded_var)
+        sharded_check.pack(side=tk.LEFT, padx=5, pady=5)
         
         # Answer Display
         ttk.Label(question_frame, text="Claude's Answer:").pack(anchor=tk.W, padx=5, pady=5)
         self.answer_display = scrolledtext.ScrolledText(question_frame, height=12, width=70, wrap=tk.WORD)
         self.answer_display.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         self.answer_display.config(state=tk.DISABLED)
+        self.renderer = StreamRenderer(self.root, self.answer_display)
+        
+        # Token usage of the last answer, including prompt cache reads and writes
+        self.usage_var = tk.StringVar(value="")
+        ttk.Label(question_frame, textvariable=self.usage_var).pack(anchor=tk.W, padx=5)
         
         # Progress bar
         self.progress = ttk.Progressbar(self.root, orient=tk.HORIZONTAL, length=100, mode='indeterminate')
         self.progress.pack(fill=tk.X, padx=5, pady=5)
+        
+        # Diagnostics: phase timings of loads, refreshes and answers, hidden until asked for
+        self.diagnostics_var = tk.BooleanVar(value=False)
+        diagnostics_check = ttk.Checkbutton(self.root, text="Show diagnostics", variable=self.diagnostics_var,
+                                            command=self.toggle_diagnostics)
+        diagnostics_check.pack(anchor=tk.W, padx=5)
+        self.diagnostics_frame = ttk.LabelFrame(self.root, text="Diagnostics")
+        self.diagnostics_display = scrolledtext.ScrolledText(self.diagnostics_frame, height=6, width=70, wrap=tk.WORD)
+        self.diagnostics_display.pack(fill=tk.X, padx=5, pady=5)
+        self.diagnostics_display.config(state=tk.DISABLED)
+    
+    def toggle_diagnostics(self):
+        if self.diagnostics_var.get():
+            self.diagnostics_frame.pack(fill=tk.X, padx=5, pady=5)
+        else:
+            self.diagnostics_frame.pack_forget()
+    
+    def log_diagnostic(self, text):
+        """Add a timestamped line to the diagnostics panel. Safe to call from any thread."""
+        line = f"{time.strftime('%H:%M:%S')} {text}\n"
+        self.root.after(0, lambda: self._append_diagnostic(line))
+    
+    def _append_diagnostic(self, line):
+        display = self.diagnostics_display
+        display.config(state=tk.NORMAL)
+        display.insert(tk.END, line)
+        # The Text widget always ends with a newline, so it holds one more line than was inserted
+        excess = int(display.index('end-1c').split('.')[0]) - 1 - MAX_DIAGNOSTIC_LINES
+        if excess > 0:
+            display.delete(1.0, f"{excess + 1}.0")
+        display.config(state=tk.DISABLED)
+        display.see(tk.END)
     
     def connect_to_api(self):
         api_key = self.api_key_var.get()
@@ -113,7 +281,8 @@ class ClaudeAPIApp:
             return
         
         try:
-            self.client = anthropic.Anthropic(api_key=api_key)
+            # Long-lived client with explicit connection-pool limits and timeouts
+            self.client = make_client(api_key)
             self.status_var.set("Connected to Claude API")
             self.connect_btn.config(state=tk.DISABLED)
         except Exception as e:
@@ -124,66 +293,6 @@ class ClaudeAPIApp:
         if folder_path:
             self.content_path_var.set(folder_path)
     
-    def is_text_file(self, file_path):
-        """Determine if a file is a text file that can be read."""
-        try:
-            # Check for common binary file extensions to exclude
-            binary_extensions = {
-                # Images
-                '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.ico', '.svg',
-                # Audio
-                '.mp3', '.wav', '.ogg', '.flac', '.aac', '.wma', '.m4a',
-                # Video
-                '.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm',
-                # Archives
-                '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2',
-                # Executables
-                '.exe', '.dll', '.so', '.dylib', '.bin',
-                # Other binary
-                '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', 
-                '.db', '.sqlite', '.mdb', '.class', '.pyc', '.o'
-            }
-            
-            # Get file extension
-            _, ext = os.path.splitext(file_path.lower())
-            
-            # Check if it's a binary file by extension
-            if ext in binary_extensions:
-                return False
-            
-            # Known text file extensions
-            text_extensions = {
-                '.txt', '.md', '.py', '.js', '.html', '.css', '.java', '.c', '.cpp', '.h',
-                '.cs', '.php', '.rb', '.go', '.rs', '.ts', '.swift', '.kt', '.scala', '.pl',
-                '.sql', '.json', '.xml', '.yaml', '.yml', '.toml', '.ini', '.conf', '.sh',
-                '.bat', '.ps1', '.log', '.csv', '.rst', '.r', '.dart', '.lua'
-            }
-            
-            # If it's a known text extension, return True
-            if ext in text_extensions:
-                return True
-            
-            # For files we're not sure about, try to read them
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                sample = f.read(1024)  # Read first 1KB
-                
-                # Simple heuristic: if the sample contains mostly printable ASCII, 
-                # it's probably text
-                if sample:
-                    # Count printable characters
-                    printable_count = sum(1 for c in sample if 32 <= ord(c) <= 126 or c in '\n\r\t')
-                    ratio = printable_count / len(sample)
-                    
-                    # If more than 90% characters are printable, consider it text
-                    return ratio > 0.9
-                
-                return True  # Empty file is considered text
-                
-        except UnicodeDecodeError:
-            return False
-        except Exception:
-            return False
-    
     def load_files(self):
         folder_path = self.content_path_var.get()
         if not folder_path:
@@ -193,9 +302,23 @@ class ClaudeAPIApp:
             self.files_display.config(state=tk.DISABLED)
             return
         
+        try:
+            max_tokens = self.token_limit_var.get()
+        except tk.TclError:
+            self._show_error("Error: Max Tokens must be a number")
+            return
+        
+        # Pack files into whatever the selected model has left after the response
+        model = self.model_var.get()
+        self.token_counter.client = self.client if self.exact_tokens_var.get() else None
+        self.token_counter.model = model
+        
         # Clear previous data
-        self.context_files = []
-        self.file_contents = ""
+        self.stop_watching()
+        self.context = new_context(model, max_tokens, self.token_counter)
+        self.conversation = Conversation(self.context)
+        self.corpus = FileCorpus()
+        self.loaded_folder = None
         
         self.files_display.config(state=tk.NORMAL)
         self.files_display.delete(1.0, tk.END)
@@ -211,69 +334,33 @@ class ClaudeAPIApp:
         thread.start()
     
     def _load_files_thread(self, folder_path):
-        total_size = 0  # Track total content size
-        max_content_size = 4 * 1024 * 1024  # ~4MB limit (rough estimate)
-        truncated = False
+        context = self.context
+        corpus = self.corpus
+        stats = ScanStats()
+        
+        def progress(count):
+            # Update display every few files
+            if count % 10 == 0:
+                self.root.after(0, lambda: self._update_files_display_loading(count))
         
         try:
-            # Walk through all files recursively
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    
-                    # Check if we can read this as text
-                    if self.is_text_file(file_path):
-                        try:
-                            # Check file size before reading
-                            file_size = os.path.getsize(file_path)
-                            
-                            # Skip overly large files
-                            if file_size > 1024 * 1024:  # Skip files larger than 1MB
-                                continue
-                                
-                            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                content = f.read()
-                                relative_path = os.path.relpath(file_path, folder_path)
-                                self.context_files.append(relative_path)
-                                
-                                # Add file content with header to the combined content
-                                file_header = f"\n\n==== FILE: {relative_path} ====\n\n"
-                                
-                                # Check if adding this file would exceed our limit
-                                content_to_add = file_header + content
-                                if total_size + len(content_to_add) > max_content_size:
-                                    truncated = True
-                                    # Only add if we have room for at least the header and some content
-                                    if total_size + len(file_header) + 100 < max_content_size:
-                                        truncated_content = content[:max_content_size - total_size - len(file_header) - 50]
-                                        self.file_contents += file_header + truncated_content + "\n[Content truncated due to size]"
-                                        total_size = max_content_size
-                                    break
-                                
-                                self.file_contents += content_to_add
-                                total_size += len(content_to_add)
-                            
-                            # Update display every few files
-                            if len(self.context_files) % 10 == 0:
-                                self.root.after(0, lambda cnt=len(self.context_files): self._update_files_display_loading(cnt))
-                                
-                        except Exception as e:
-                            print(f"Error reading {file_path}: {str(e)}")
-                            
-                    # Break the outer loop if we've hit our content size limit
-                    if truncated:
-                        break
-                        
-                if truncated:
-                    break
+            with self.context_lock:
+                load_folder(folder_path, context, corpus, stats, self.file_cache, progress)
+            self.root.after(0, lambda: self._loaded(folder_path, context))
             
-            # Add a note about truncation if needed
-            if truncated:
-                self.file_contents += "\n\n==== NOTE: Content was truncated due to size limitations ====\n"
+            # Phase timings for the diagnostics panel; the same numbers feed the metrics registry
+            self.log_diagnostic(f"Scanned {folder_path}: {stats.summary()}; read {stats.read_seconds:.2f}s and "
+                                f"classify {stats.classify_seconds:.2f}s over all threads")
             
             # Final update to display
-            self.root.after(0, lambda cnt=len(self.context_files), trunc=truncated: 
-                           self._update_files_display_complete(cnt, trunc))
+            summary = f"{stats.summary()}\nContext: ~{context.total_tokens:,} of {context.token_budget:,} tokens"
+            if context.outlined or context.omitted:
+                summary += f"\n{context.outlined:,} files included as outlines, {context.omitted:,} left out"
+            if context.corpus is not None:
+                summary += (f"\nIndexed {len(corpus):,} files; each question is sent the most relevant ones "
+                            f"that fit")
+            self.root.after(0, lambda cnt=len(context), trunc=context.truncated, summary=summary:
+                           self._update_files_display_complete(cnt, trunc, summary))
             
         except Exception as e:
             error_msg = f"Error loading files: {str(e)}"
@@ -281,30 +368,82 @@ class ClaudeAPIApp:
         finally:
             self.root.after(0, self.progress.stop)
     
+    def _loaded(self, folder_path, context):
+        # Unless another load started meanwhile
+        if context is self.context:
+            self.loaded_folder = folder_path
+            if self.watch_var.get():
+                self.start_watching()
+    
+    def toggle_watch(self):
+        if not self.watch_var.get():
+            self.stop_watching()
+        elif self.loaded_folder is not None:
+            self.start_watching()
+    
+    def start_watching(self):
+        self.stop_watching()
+        folder_path, conversation, corpus = self.loaded_folder, self.conversation, self.corpus
+        self.watcher = FolderWatcher(folder_path, lambda paths: self._refresh_changed(folder_path, conversation,
+                                                                                     corpus, paths))
+        # The first walk of the folder lists every directory, so keep it off the Tk thread
+        watcher = self.watcher
+        
+        def start():
+            try:
+                watcher.start()
+                self.root.after(0, lambda: watcher is self.watcher and
+                                self.watch_status_var.set(f"Watching ({watcher.backend})"))
+            except OSError as e:
+                self.root.after(0, lambda msg=f"Can't watch: {str(e)}": self.watch_status_var.set(msg))
+        
+        threading.Thread(target=start, daemon=True).start()
+    
+    def stop_watching(self):
+        if self.watcher is not None:
+            # Don't wait: a refresh in progress may be waiting on this thread
+            self.watcher.stop(wait=False)
+            self.watcher = None
+        self.watch_status_var.set("")
+    
+    def _refresh_changed(self, folder_path, conversation, corpus, paths):
+        # Called on the watcher's thread after a burst of changes settles
+        with self.context_lock:
+            if conversation is not self.conversation:
+                return  # Another folder was loaded meanwhile
+            updated, removed = refresh_files(folder_path, paths, conversation, corpus, cache=self.file_cache)
+        if updated or removed:
+            status = f"{len(updated)} files updated, {len(removed)} removed at {time.strftime('%H:%M:%S')}"
+            self.log_diagnostic(f"Refreshed {folder_path}: {status}")
+            self.root.after(0, lambda: self.watch_status_var.set(status))
+    
     def _update_files_display_loading(self, count):
         self.files_display.config(state=tk.NORMAL)
         self.files_display.delete(1.0, tk.END)
         self.files_display.insert(tk.END, f"Loading files... Found {count} so far")
         self.files_display.config(state=tk.DISABLED)
     
-    def _update_files_display_complete(self, count, truncated=False):
+    def _update_files_display_complete(self, count, truncated=False, summary=None):
         self.files_display.config(state=tk.NORMAL)
         self.files_display.delete(1.0, tk.END)
         
-        if not self.context_files:
+        if not self.context:
             self.files_display.insert(tk.END, "No readable text files found in the selected folder.")
         else:
             message = f"Loaded {count} files"
             if truncated:
                 message += " (content truncated due to size limits)"
-            message += ".\n\n"
+            message += ".\n"
+            if summary:
+                message += f"Scan: {summary}\n"
+            message += "\n"
             
             self.files_display.insert(tk.END, message)
             if count <= 20:
-                for file in self.context_files:
+                for file in self.context.files:
                     self.files_display.insert(tk.END, f"- {file}\n")
             else:
-                for file in self.context_files[:10]:
+                for file in self.context.files[:10]:
                     self.files_display.insert(tk.END, f"- {file}\n")
                 self.files_display.insert(tk.END, f"... and {count - 10} more files.\n")
         
@@ -324,7 +463,7 @@ class ClaudeAPIApp:
             self.answer_display.config(state=tk.DISABLED)
             return
         
-        if not self.file_contents:
+        if not self.context:
             self.answer_display.config(state=tk.NORMAL)
             self.answer_display.delete(1.0, tk.END)
             self.answer_display.insert(tk.END, "Error: No files loaded")
@@ -341,12 +480,14 @@ class ClaudeAPIApp:
         
         # Disable UI elements during processing
         self.send_btn.config(state=tk.DISABLED)
+        self.new_conversation_btn.config(state=tk.DISABLED)
         self.question_entry.config(state=tk.DISABLED)
         
         self.answer_display.config(state=tk.NORMAL)
         self.answer_display.delete(1.0, tk.END)
         self.answer_display.insert(tk.END, "Sending request to Claude, please wait...")
         self.answer_display.config(state=tk.DISABLED)
+        self.usage_var.set("")
         
         self.progress.start()
         
@@ -357,15 +498,7 @@ class ClaudeAPIApp:
     
     def _send_question_thread(self, question):
         try:
-            # Prepare the system prompt
-            system_prompt = (
-                "You are an assistant that analyzes and answers questions about the provided files. "
-                "The user will provide file contents and ask questions about them. "
-                "Be concise but thorough in your responses."
-            )
-            
-            # Create the prompt for Claude with context
-            prompt = f"Here are the files to analyze:\n\n{self.file_contents}\n\nBased on these files, please answer the following question:\n{question}"
+            conversation = self.conversation
             
             # Get token limit
             max_tokens = self.token_limit_var.get()
@@ -377,29 +510,36 @@ class ClaudeAPIApp:
                 # First update to show we're sending the request
                 self.root.after(0, lambda: self._update_answer_display("Request sent to Claude API, waiting for response..."))
                 
-                # Use streaming API for long requests
-                with self.client.messages.stream(
-                    model=self.model_var.get(),
-                    system=system_prompt,
-                    max_tokens=max_tokens,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                ) as stream:
-                    # Initialize the full answer
-                    full_answer = ""
-                    
-                    # Process the incoming stream
-                    for text in stream.text_stream:
-                        full_answer += text
-                        # Update the display with what we have so far
-                        self.root.after(0, lambda answer=full_answer: self._update_answer_display(
-                            f"{answer}\n\n[Response streaming...]"))
-                        # Small sleep to avoid too frequent updates
-                        time.sleep(0.1)
-                    
-                    # Final update with complete answer
-                    self.root.after(0, lambda a=full_answer: self._update_answer_display(a))
+                # Changes found by watch mode wait until the answer is done
+                with self.context_lock:
+                    if self.sharded_var.get():
+                        # Shards are answered in parallel, with progress shown under the answer,
+                        # and the merged answer streams to the renderer like any other
+                        answer = ask_sharded(self.client, conversation.context, question, self.model_var.get(),
+                                             max_tokens, on_start=lambda: self.root.after(0, self.renderer.start),
+                                             on_text=self.renderer.put, on_progress=self._show_shard_progress)
+                    else:
+                        # Use streaming API for long requests. Each chunk goes to the renderer,
+                        # which appends it on the next frame; this thread never waits on the UI.
+                        # Repeated questions are replayed from the answer cache the same way
+                        answer = ask(self.client, conversation, question, self.model_var.get(), max_tokens,
+                                     on_start=lambda: self.root.after(0, self.renderer.start),
+                                     on_text=self.renderer.put, cache=self.answer_cache)
+                self.renderer.finish()
+                
+                # Show how much of the prompt was served from the cache
+                usage = usage_summary(answer.usage)
+                if answer.shards > 1:
+                    failed = f", {answer.failed_shards} failed" if answer.failed_shards else ""
+                    usage = f"Merged from {answer.shards} shards{failed}. {usage}"
+                elif answer.cached:
+                    usage = f"Answered from cache, no request sent (originally {usage[0].lower()}{usage[1:]})"
+                if answer.context is not conversation.context:
+                    usage = f"{len(answer.context)} most relevant files sent. {usage}"
+                if not answer.shards and len(conversation) > 1:
+                    usage = f"Follow-up {len(conversation) - 1}. {usage}"
+                self.root.after(0, lambda u=usage: self.usage_var.set(u))
+                self.log_diagnostic(f"Answered: {phase_summary(answer)}")
                 
             except TimeoutError:
                 self.root.after(0, lambda: self._update_answer_display(
@@ -412,7 +552,25 @@ class ClaudeAPIApp:
         finally:
             self.root.after(0, self._reset_ui)
     
+    def _show_shard_progress(self, event):
+        # Called on the worker thread as the shards are planned and answered
+        if 'plan' in event:
+            message = f"Asking {len(event['plan'])} shards of {sum(event['plan'])} files..."
+        elif 'failed' in event:
+            message = f"Shard {event['shard']} of {event['of']} failed: {event['failed']}"
+        else:
+            message = f"Shard {event['shard']} of {event['of']} answered ({event['files']} files)"
+        self.root.after(0, lambda: self.usage_var.set(message))
+    
+    def new_conversation(self):
+        # Later questions start again from the files alone
+        self.conversation.reset()
+        self._update_answer_display("New conversation started.")
+        self.usage_var.set("")
+    
     def _update_answer_display(self, text):
+        # Replacing the whole answer ends any stream being rendered
+        self.renderer.cancel()
         self.answer_display.config(state=tk.NORMAL)
         self.answer_display.delete(1.0, tk.END)
         self.answer_display.insert(tk.END, text)
@@ -421,6 +579,7 @@ class ClaudeAPIApp:
     def _reset_ui(self):
         self.progress.stop()
         self.send_btn.config(state=tk.NORMAL)
+        self.new_conversation_btn.config(state=tk.NORMAL)
         self.question_entry.config(state=tk.NORMAL)
 
 
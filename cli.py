@@ -0,0 +1,225 @@
+"""Headless batch mode: ask every question about every folder and write the answers as JSONL.
+
+    python cli.py REPO [REPO ...] --questions QUESTIONS.txt [--parallel 4] [--output answers.jsonl]
+    python cli.py REPO [REPO ...] --questions QUESTIONS.txt --batch
+    python cli.py REPO [REPO ...] --questions QUESTIONS.txt --sharded
+
+The API key is read from ANTHROPIC_API_KEY (or --api-key). Questions are
+read one per line; blank lines and lines starting with '#' are skipped.
+Each answer is written as soon as it completes, one JSON object per line,
+with its timings and token usage; each folder gets a line when it has loaded.
+Folders are loaded one at a time, just before their questions are asked,
+and let go once they are answered, so at most --parallel are held in
+memory however many are given.
+With --batch the questions about each folder go through the Message
+Batches API instead, at lower cost, and its answers are written in
+question order once the batch has ended. With --sharded each question
+about a folder too large for one request is asked of every shard of it
+and the partial answers merged (see mapreduce.py).
+The GUI and the web UI share the loading and prompt code in pipeline.py.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import scheduler
+from answercache import AnswerCache
+from batches import run_batches
+from clients import make_client
+from conversation import Conversation
+from filecache import FileCache
+from mapreduce import MAP_CONCURRENCY
+from pipeline import ask, ask_sharded, load_folder, new_context
+from ranking import FileCorpus
+from scanner import ScanStats
+from tokens import TokenCounter
+
+DEFAULT_MODEL = "claude-3-7-sonnet-20250219"
+DEFAULT_MAX_TOKENS = 4096
+DEFAULT_PARALLEL = 4
+
+
+def read_questions(path):
+    """Return the questions in a file ('-' for stdin), one per line."""
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def load_repo(folder_path, model, max_tokens, counter, cache):
+    """Load a folder into a new context. Returns (context, stats)."""
+    context = new_context(model, max_tokens, counter)
+    stats = ScanStats()
+    load_folder(folder_path, context, FileCorpus(), stats, cache)
+    return context, stats
+
+
+def answer_record(repo, question, client, context, model, max_tokens, cache=None, sharded=False):
+    """Ask one question and return its JSONL record; errors are recorded, not raised."""
+    record = {"repo": repo, "question": question, "model": model}
+    try:
+        # Nobody is watching these answers arrive, so they give way to interactive requests
+        if sharded:
+            answer = ask_sharded(client, context, question, model, max_tokens, priority=scheduler.BACKGROUND)
+        else:
+            # Questions are independent, but all of them share the cached file context
+            answer = ask(client, Conversation(context), question, model, max_tokens, cache=cache,
+                         priority=scheduler.BACKGROUND)
+    except Exception as e:
+        record["error"] = str(e)
+        return record
+
+    record.update({
+        "answer": answer.text,
+        "usage": answer.usage,
+        "first_token_seconds": round(answer.first_token, 3) if answer.first_token is not None else None,
+        "seconds": round(answer.elapsed, 3),
+    })
+    if answer.cached:
+        record["cached"] = True
+    if answer.shards > 1:
+        record["shards"] = answer.shards
+        record["failed_shards"] = answer.failed_shards
+    if answer.context is not context:
+        record["files_sent"] = len(answer.context)
+    return record
+
+
+def batch_records(repo, questions, client, context, model, max_tokens):
+    """Ask every question through the Message Batches API and return their JSONL records, in order."""
+    started = time.perf_counter()
+    try:
+        results = run_batches(client, context, questions, model, max_tokens,
+                              on_submit=lambda batch_id: print(f"Submitted {batch_id} for {repo}", file=sys.stderr))
+    except Exception as e:
+        return [{"repo": repo, "question": question, "model": model, "error": str(e)} for question in questions]
+
+    seconds = round(time.perf_counter() - started, 3)
+    return [dict({"repo": repo, "question": question, "model": model}, seconds=seconds, **result)
+            for question, result in zip(questions, results)]
+
+
+def run(repos, questions, client, model, max_tokens, parallel, out, batch=False, answer_cache=None,
+        sharded=False):
+    """Ask every question about every repo on up to parallel threads, writing records to out as they finish.
+
+    A repo is loaded only once fewer than parallel are still being asked
+    about. Returns the number of failed requests.
+    """
+    counter = TokenCounter()
+    cache = FileCache()
+    lock = threading.Lock()
+    loaded = threading.Semaphore(parallel)
+    failed = 0
+
+    def write(*records):
+        nonlocal failed
+        with lock:
+            for record in records:
+                failed += "error" in record
+                out.write(json.dumps(record) + "\n")
+            out.flush()
+
+    def finished(future):
+        # A folder's batch results are written together, in question order
+        records = future.result()
+        if batch:
+            write(*records)
+        else:
+            write(records)
+
+    def ask_repo(executor, repo):
+        context, stats = load_repo(repo, model, max_tokens, counter, cache)
+        print(f"Loaded {repo}: {stats.summary()}; ~{context.total_tokens:,} tokens", file=sys.stderr)
+        write({"repo": repo, "loaded_files": len(context.corpus or context),
+               "tokens": context.total_tokens, "load_seconds": round(stats.elapsed, 3)})
+
+        if batch:
+            # One thread per folder polls its batches while the next folder loads
+            futures = [executor.submit(batch_records, repo, questions, client, context, model, max_tokens)]
+        else:
+            # The next folder loads while these questions are in flight
+            futures = [executor.submit(answer_record, repo, question, client, context, model, max_tokens,
+                                       answer_cache, sharded)
+                       for question in questions]
+
+        # Once the last of them is done nothing refers to the context, and another folder may load
+        pending = len(futures)
+
+        def done(future):
+            nonlocal pending
+            try:
+                finished(future)
+            finally:
+                with lock:
+                    pending -= 1
+                    last = not pending
+                if last:
+                    loaded.release()
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        for repo in repos:
+            loaded.acquire()
+            ask_repo(executor, repo)
+
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ask questions about one or more folders without the GUI.")
+    parser.add_argument("repos", nargs="+", metavar="REPO", help="folder to load")
+    parser.add_argument("-q", "--questions", required=True, help="file with one question per line, or - for stdin")
+    parser.add_argument("-o", "--output", help="JSONL file to write (default: stdout)")
+    parser.add_argument("-p", "--parallel", type=int, default=DEFAULT_PARALLEL, help="requests in flight at once")
+    parser.add_argument("-m", "--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--batch", action="store_true", help="use the Message Batches API (slower, cheaper)")
+    parser.add_argument("--sharded", action="store_true",
+                        help="ask every shard of a folder too large for one request and merge the answers")
+    parser.add_argument("--no-answer-cache", action="store_true", help="always send questions, even repeated ones")
+    parser.add_argument("--api-key", default=os.environ.get("ANTHROPIC_API_KEY"))
+    args = parser.parse_args(argv)
+
+    if args.batch and args.sharded:
+        parser.error("--batch and --sharded can't be combined")
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or ANTHROPIC_API_KEY)")
+    for repo in args.repos:
+        if not os.path.isdir(repo):
+            parser.error(f"not a folder: {repo}")
+    questions = read_questions(args.questions)
+    if not questions:
+        parser.error("no questions given")
+
+    parallel = max(1, args.parallel)
+    # Each sharded question has up to MAP_CONCURRENCY shard requests of its own in flight
+    client = make_client(args.api_key, max_connections=parallel * MAP_CONCURRENCY if args.sharded else parallel)
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    started = time.perf_counter()
+    try:
+        answer_cache = None if args.no_answer_cache else AnswerCache()
+        failed = run(args.repos, questions, client, args.model, args.max_tokens, parallel, out, args.batch,
+                     answer_cache, args.sharded)
+    finally:
+        client.close()
+        if out is not sys.stdout:
+            out.close()
+
+    total = len(args.repos) * len(questions)
+    print(f"{total - failed} of {total} questions answered in {time.perf_counter() - started:.1f}s",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
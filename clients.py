@@ -0,0 +1,150 @@
+"""Long-lived, pooled Anthropic clients shared across requests and threads."""
+import asyncio
+import hashlib
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+import anthropic
+
+MAX_CONNECTIONS = 20
+ASYNC_MAX_CONNECTIONS = 500  # One async process serves many concurrent streams
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60.0  # Seconds an idle connection is kept open
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 600.0  # Long answers can pause between chunks while the model thinks
+IDLE_CLIENT_TTL = 15 * 60  # Close clients unused for this many seconds
+
+
+def _pool_options(max_connections, max_keepalive, keepalive_expiry):
+    # Built from the SDK's exports, so they suit whichever HTTP library it was installed with
+    limits_type = type(anthropic.DEFAULT_CONNECTION_LIMITS)
+    return {
+        "limits": limits_type(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        "timeout": anthropic.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    }
+
+
+def make_client(api_key, max_connections=MAX_CONNECTIONS, max_keepalive=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY):
+    """Create an Anthropic client with explicit connection-pool limits and timeouts.
+
+    The SDK's own retries are off: requests are retried by scheduler.py,
+    which knows about every other request sharing the rate limits.
+    """
+    http_client = anthropic.DefaultHttpxClient(**_pool_options(max_connections, max_keepalive, keepalive_expiry))
+    return anthropic.Anthropic(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def make_async_client(api_key, max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive=MAX_KEEPALIVE_CONNECTIONS,
+                      keepalive_expiry=KEEPALIVE_EXPIRY):
+    """Create an AsyncAnthropic client with the same pool settings, sized for many concurrent streams."""
+    http_client = anthropic.DefaultAsyncHttpxClient(**_pool_options(max_connections, max_keepalive, keepalive_expiry))
+    return anthropic.AsyncAnthropic(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def _close_client(client):
+    # AsyncAnthropic.close() is a coroutine; schedule it on the running loop
+    result = client.close()
+    if inspect.isawaitable(result):
+        try:
+            asyncio.get_running_loop().create_task(result)
+        except RuntimeError:
+            asyncio.run(result)
+
+
+def key_fingerprint(api_key):
+    """Return a short digest that identifies an API key."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class _Pooled:
+    __slots__ = ("client", "active", "last_used")
+
+    def __init__(self, client):
+        self.client = client
+        self.active = 0
+        self.last_used = time.monotonic()
+
+
+class ClientRegistry:
+    """Thread-safe registry of one pooled client per API key.
+
+    Reusing a client keeps its HTTP connections (and TLS sessions) alive
+    between requests. Clients that have been idle for idle_ttl seconds are
+    closed, but never while a request is still using them.
+    """
+
+    def __init__(self, idle_ttl=IDLE_CLIENT_TTL, factory=make_client):
+        self.idle_ttl = idle_ttl
+        self.factory = factory
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, api_key):
+        """Return the shared client for api_key, creating it if needed."""
+        with self._lock:
+            pooled = self._get_locked(api_key)
+            return pooled.client
+
+    @contextmanager
+    def client(self, api_key):
+        """Borrow the shared client for api_key for the length of a request."""
+        with self._lock:
+            pooled = self._get_locked(api_key)
+            pooled.active += 1
+        try:
+            yield pooled.client
+        finally:
+            with self._lock:
+                pooled.active -= 1
+                pooled.last_used = time.monotonic()
+
+    def _get_locked(self, api_key):
+        self._evict_idle()
+        fingerprint = key_fingerprint(api_key)
+        pooled = self._clients.get(fingerprint)
+        if pooled is None:
+            pooled = self._clients[fingerprint] = _Pooled(self.factory(api_key))
+        pooled.last_used = time.monotonic()
+        return pooled
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.idle_ttl
+        for fingerprint, pooled in list(self._clients.items()):
+            if pooled.active == 0 and pooled.last_used < deadline:
+                del self._clients[fingerprint]
+                try:
+                    _close_client(pooled.client)
+                except Exception:
+                    pass
+
+    def close(self):
+        """Close every client, e.g. when the server shuts down."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for pooled in clients.values():
+            try:
+                _close_client(pooled.client)
+            except Exception:
+                pass
+
+    async def aclose(self):
+        """Close every client from inside a running event loop."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for pooled in clients.values():
+            try:
+                result = pooled.client.close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                pass
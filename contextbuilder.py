@@ -0,0 +1,301 @@
+"""Shared assembly of file contents into the context sent to Claude."""
+from filecache import content_hash
+from outline import outline_file
+from tokens import estimate_tokens
+
+MAX_CONTEXT_SIZE = 4 * 1024 * 1024  # ~4MB limit (rough estimate)
+TRUNCATED_FILE_NOTE = "\n[Content truncated due to size]"
+TRUNCATED_CONTEXT_NOTE = "\n\n==== NOTE: Content was truncated due to size limitations ====\n"
+OUTLINE_NOTE = "[Outline only: imports, signatures and docstrings; the full file did not fit]\n\n"
+
+
+def file_header(relative_path):
+    """Return the header that introduces a file in the context."""
+    return f"\n\n==== FILE: {relative_path} ====\n\n"
+
+
+class FileSegment:
+    """A single file's slice of the assembled context."""
+    __slots__ = ("path", "text", "start", "tokens", "truncated", "outlined")
+
+    def __init__(self, path, text, start, tokens=0, truncated=False, outlined=False):
+        self.path = path
+        self.text = text
+        self.start = start
+        self.tokens = tokens
+        self.truncated = truncated
+        self.outlined = outlined
+
+    @property
+    def end(self):
+        return self.start + len(self.text)
+
+
+class ContextBuilder:
+    """Collects file segments and joins them into one string only when needed.
+
+    Appending a file is O(1); the context string is built once by build()
+    and reused until more files are added. Each segment records its offset
+    in the built string so individual files can be addressed later.
+    replace_file() and remove_file() update a single file in place, for
+    keeping the context current as files change on disk.
+
+    The context is capped at max_size characters and, when token_budget is
+    given, at that many tokens as counted by counter (a tokens.TokenCounter,
+    or the local estimate if no counter is given). truncated is set while
+    the limits have cut a file short or kept one out.
+
+    With outline=True, the first file that doesn't fit and every file after
+    it go in as outlines (see outline.py) for as long as those fit, instead
+    of the context being cut off there. Files without an outliner are left
+    out and counted in omitted.
+
+    If more files were loaded than fit, corpus (a ranking.FileCorpus) holds
+    all of them, and for_question() packs the ones relevant to a question.
+    """
+
+    def __init__(self, max_size=MAX_CONTEXT_SIZE, token_budget=None, counter=None, outline=False):
+        self.max_size = max_size
+        self.token_budget = token_budget
+        self.counter = counter
+        self.outline = outline
+        self.segments = []
+        self.total_size = 0
+        self.total_tokens = 0
+        self.truncated = False
+        self.outlined = 0
+        self.omitted = 0
+        self.corpus = None
+        self._index = {}
+        self._left_out = False  # The limits kept a file out entirely, rather than cutting one short
+        self._built = None
+        self._digest = None  # (assembled context, its hash)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __bool__(self):
+        return bool(self.segments)
+
+    @property
+    def files(self):
+        return [segment.path for segment in self.segments]
+
+    @property
+    def overflowed(self):
+        """True once a file has been cut short, outlined or left out."""
+        return self.truncated or self.outlined > 0 or self.omitted > 0
+
+    def segment(self, relative_path):
+        """Return the FileSegment for relative_path, or None."""
+        return self._index.get(relative_path)
+
+    def add_file(self, relative_path, content):
+        """Append a file to the context.
+
+        Returns False once the size limit has been reached, in which case the
+        file was cut short (or left out if there was no room) and no more
+        files should be added.
+        """
+        if self.truncated:
+            return False
+        if self.outline and self.overflowed:
+            return self._add_outline(relative_path, content)
+
+        header = file_header(relative_path)
+        text = header + content
+        tokens = self._count(text, relative_path)
+        if self.outline and not self._fits(text, tokens):
+            # From here on files go in as outlines
+            return self._add_outline(relative_path, content)
+
+        # Cut the file short if it would exceed either limit
+        keep = None
+        if self.total_size + len(text) > self.max_size:
+            # Only add if we have room for at least the header and some content
+            if self.total_size + len(header) + 100 < self.max_size:
+                keep = self.max_size - self.total_size - len(header) - 50
+            else:
+                keep = 0
+        if self.token_budget is not None and self.total_tokens + tokens > self.token_budget:
+            remaining = self.token_budget - self.total_tokens
+            chars_per_token = len(text) / max(tokens, 1)
+            # Leave some slack since the count of a prefix is only proportional
+            token_keep = int((remaining * 0.95 - 30) * chars_per_token) - len(header)
+            keep = token_keep if keep is None else min(keep, token_keep)
+
+        if keep is None:
+            self._append(relative_path, text, tokens)
+            return True
+
+        self.truncated = True
+        if keep > 0:
+            text = header + content[:keep] + TRUNCATED_FILE_NOTE
+            self._append(relative_path, text, self._count(text, relative_path), truncated=True)
+        else:
+            self._left_out = True
+        return False
+
+    def _fits(self, text, tokens):
+        if self.total_size + len(text) > self.max_size:
+            return False
+        return self.token_budget is None or self.total_tokens + tokens <= self.token_budget
+
+    def _add_outline(self, relative_path, content):
+        outline = outline_file(relative_path, content)
+        if outline is None:
+            self.omitted += 1
+            return True
+
+        text = file_header(relative_path) + OUTLINE_NOTE + outline
+        tokens = self._count(text, relative_path)
+        if not self._fits(text, tokens):
+            self.truncated = True
+            self._left_out = True
+            return False
+        self._append(relative_path, text, tokens, outlined=True)
+        self.outlined += 1
+        return True
+
+    def replace_file(self, relative_path, content):
+        """Replace a loaded file's segment with new content, in full or as an outline as before.
+
+        Returns False, changing nothing, if the file isn't in the context, was
+        cut short, or no longer fits the limits; the context then has to be
+        packed again to take the change.
+        """
+        segment = self._index.get(relative_path)
+        if segment is None or segment.truncated:
+            return False
+        if segment.outlined:
+            outline = outline_file(relative_path, content)
+            if outline is None:
+                return False
+            text = file_header(relative_path) + OUTLINE_NOTE + outline
+        else:
+            text = file_header(relative_path) + content
+        tokens = self._count(text, relative_path)
+        if self.total_size - len(segment.text) + len(text) > self.max_size:
+            return False
+        if self.token_budget is not None and self.total_tokens - segment.tokens + tokens > self.token_budget:
+            return False
+
+        self.total_size += len(text) - len(segment.text)
+        self.total_tokens += tokens - segment.tokens
+        segment.text = text
+        segment.tokens = tokens
+        self._update_truncated()
+        self._built = None
+        return True
+
+    def remove_file(self, relative_path):
+        """Drop a file from the context. Returns False if it wasn't in it."""
+        segment = self._index.pop(relative_path, None)
+        if segment is None:
+            return False
+        self.segments.remove(segment)
+        self.total_size -= len(segment.text)
+        self.total_tokens -= segment.tokens
+        if segment.outlined:
+            self.outlined -= 1
+        self._update_truncated()
+        self._built = None
+        return True
+
+    def _update_truncated(self):
+        # Truncated only while a file the limits kept out, or one they cut short, is still missing
+        self.truncated = self._left_out or any(segment.truncated for segment in self.segments)
+
+    def clear(self):
+        """Empty the context, keeping its limits, so it can be packed again."""
+        self.segments = []
+        self.total_size = 0
+        self.total_tokens = 0
+        self.truncated = False
+        self.outlined = 0
+        self.omitted = 0
+        self.corpus = None
+        self._index = {}
+        self._left_out = False
+        self._built = None
+
+    def for_question(self, question):
+        """Return the context to send with question.
+
+        When every loaded file fitted (or there is no corpus) this is the
+        context itself, which stays byte-identical for prompt caching.
+        Otherwise the corpus is ranked against the question and its best
+        matches are packed into a new context with the same limits.
+        """
+        if self.corpus is None or not self.overflowed:
+            return self
+        return self.corpus.pack(question, ContextBuilder(self.max_size, self.token_budget, self.counter,
+                                                         outline=self.outline))
+
+    def _count(self, text, relative_path):
+        if self.token_budget is None:
+            return 0
+        if self.counter is None:
+            return estimate_tokens(text, relative_path)
+        return self.counter.count(text, relative_path)
+
+    def _append(self, relative_path, text, tokens, truncated=False, outlined=False):
+        segment = FileSegment(relative_path, text, self.total_size, tokens, truncated, outlined)
+        self.segments.append(segment)
+        self._index[relative_path] = segment
+        self.total_size += len(text)
+        self.total_tokens += tokens
+        self._built = None
+
+    def __getstate__(self):
+        # Token counters hold locks and API clients, so they don't travel with the context
+        state = self.__dict__.copy()
+        state['counter'] = None
+        state['_built'] = None
+        state['_digest'] = None
+        return state
+
+    def chunks(self, max_chunks):
+        """Split the assembled context at file boundaries into at most max_chunks strings.
+
+        Chunks are filled greedily up to a power-of-two target size, so the
+        boundaries before an edited file stay put when its size changes and
+        earlier chunks remain byte-identical (and cacheable) across rebuilds.
+        """
+        context = self.build()
+        target = 1
+        while target * max_chunks < self.total_size:
+            target *= 2
+
+        chunks = []
+        chunk_start = 0
+        for segment in self.segments:
+            if len(chunks) >= max_chunks - 1:
+                break
+            if segment.end - chunk_start >= target:
+                chunks.append(context[chunk_start:segment.end])
+                chunk_start = segment.end
+        if chunk_start < len(context) or not chunks:
+            chunks.append(context[chunk_start:])
+        return chunks
+
+    def build(self):
+        """Return the assembled context, joining the segments on first use."""
+        if self._built is None:
+            # Files replaced or removed since the last build move the ones after them
+            start = 0
+            for segment in self.segments:
+                segment.start = start
+                start += len(segment.text)
+            parts = [segment.text for segment in self.segments]
+            if self.truncated:
+                parts.append(TRUNCATED_CONTEXT_NOTE)
+            self._built = "".join(parts)
+        return self._built
+
+    def digest(self):
+        """Return a hash of the assembled context, computed once per rebuild."""
+        context = self.build()
+        if self._digest is None or self._digest[0] is not context:
+            self._digest = (context, content_hash(context))
+        return self._digest[1]
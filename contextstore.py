@@ -0,0 +1,174 @@
+"""Server-side store for assembled file contexts, keyed by an opaque context ID."""
+import os
+import pickle
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL = 2 * 60 * 60  # Seconds since last use
+
+
+def context_nbytes(context):
+    """Approximate memory held by a ContextBuilder (or plain string, or anything with an nbytes() method)."""
+    if hasattr(context, 'nbytes'):
+        return context.nbytes()
+    if isinstance(context, str):
+        return sys.getsizeof(context)
+    size = sum(sys.getsizeof(segment.text) for segment in context.segments)
+    if context._built is not None:
+        size += sys.getsizeof(context._built)
+    if context.corpus is not None:
+        size += context.corpus.nbytes()
+    return size
+
+
+class _Entry:
+    __slots__ = ("context", "nbytes", "last_used")
+
+    def __init__(self, context, nbytes):
+        self.context = context
+        self.nbytes = nbytes
+        self.last_used = time.monotonic()
+
+
+class ContextStore:
+    """Thread-safe LRU of contexts with a global memory ceiling and TTL expiry.
+
+    When the ceiling is reached the least recently used contexts are evicted.
+    Contexts that report their own size with nbytes(), like a Conversation
+    whose history grows, are measured again each time they are fetched.
+    If spill_dir is set, evicted contexts are written there and loaded back on
+    the next get() instead of being lost; spilled files expire with the same TTL.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.nbytes = 0
+        self._last_sweep = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, context):
+        """Store a context and return its new ID."""
+        context_id = secrets.token_urlsafe(16)
+        entry = _Entry(context, context_nbytes(context))
+        with self._lock:
+            self._entries[context_id] = entry
+            self.nbytes += entry.nbytes
+            self._expire()
+            self._evict()
+        return context_id
+
+    def get(self, context_id):
+        """Return the context for context_id, or None if it is unknown or expired."""
+        if not context_id or not context_id.replace('-', '').replace('_', '').isalnum():
+            return None
+
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(context_id)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(context_id)
+                if hasattr(entry.context, 'nbytes'):
+                    nbytes = entry.context.nbytes()
+                    self.nbytes += nbytes - entry.nbytes
+                    entry.nbytes = nbytes
+                    self._evict(keep=context_id)
+                return entry.context
+
+            context = self._load_spilled(context_id)
+            if context is None:
+                return None
+            entry = _Entry(context, context_nbytes(context))
+            self._entries[context_id] = entry
+            self.nbytes += entry.nbytes
+            self._evict(keep=context_id)
+            return context
+
+    def delete(self, context_id):
+        if not context_id:
+            return
+        with self._lock:
+            entry = self._entries.pop(context_id, None)
+            if entry is not None:
+                self.nbytes -= entry.nbytes
+            self._remove_spilled(context_id)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        # Entries are in LRU order, so expired ones are at the front
+        while self._entries:
+            context_id, entry = next(iter(self._entries.items()))
+            if entry.last_used > deadline:
+                break
+            del self._entries[context_id]
+            self.nbytes -= entry.nbytes
+
+        # Sweeping spilled files means listing a directory, so do it at most once a minute
+        if self.spill_dir and time.monotonic() - self._last_sweep > 60 and os.path.isdir(self.spill_dir):
+            self._last_sweep = time.monotonic()
+            wall_deadline = time.time() - self.ttl
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                try:
+                    if os.path.getmtime(path) < wall_deadline:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def _evict(self, keep=None):
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            context_id = next(iter(self._entries))
+            if context_id == keep:
+                self._entries.move_to_end(context_id)
+                continue
+            entry = self._entries.pop(context_id)
+            self.nbytes -= entry.nbytes
+            self._spill(context_id, entry.context)
+
+    def _spill_path(self, context_id):
+        return os.path.join(self.spill_dir, f"{context_id}.pickle")
+
+    def _spill(self, context_id, context):
+        if not self.spill_dir:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(context_id), 'wb') as f:
+                pickle.dump(context, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except (OSError, pickle.PickleError) as e:
+            print(f"Error spilling context {context_id}: {str(e)}")
+
+    def _load_spilled(self, context_id):
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(context_id)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                context = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.PickleError) as e:
+            print(f"Error loading context {context_id}: {str(e)}")
+            return None
+        os.remove(path)
+        return context
+
+    def _remove_spilled(self, context_id):
+        if self.spill_dir:
+            try:
+                os.remove(self._spill_path(context_id))
+            except OSError:
+                pass
@@ -0,0 +1,108 @@
+"""Multi-turn conversations about one file context."""
+import sys
+import threading
+
+from contextstore import context_nbytes
+from prompts import build_messages
+from tokens import estimate_tokens
+
+
+class Conversation:
+    """A file context and the questions asked about it so far.
+
+    Every request opens with the same first turn, the file context, followed
+    by the earlier questions and answers, so a follow-up reads all of that
+    from the prompt cache and only pays in full for the new question. For
+    the same reason, when the context is ranked per question, the files
+    picked for the first question are kept for the rest of the conversation.
+    Once the history outgrows its token budget the oldest turns are dropped.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.pinned = None  # The context sent with every turn, fixed by the first answer
+        self.turns = []  # (question, answer, tokens), oldest first
+        self.history_tokens = 0
+        self.history_nbytes = 0  # Memory held by the turns, kept up to date as they come and go
+        self.omitted = 0  # Turns trimmed from the start of the history
+        self._context_nbytes = None  # Memory held by the context and the pinned one, measured when first asked
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.turns) + self.omitted
+
+    def __bool__(self):
+        return bool(self.context)
+
+    def context_for(self, question):
+        """Return the context to send with question: the pinned one, or the files most relevant to it."""
+        pinned = self.pinned
+        return pinned if pinned is not None else self.context.for_question(question)
+
+    def messages(self, question, context, history_budget=None):
+        """Return the messages for question, first dropping the oldest turns beyond history_budget tokens."""
+        with self._lock:
+            if history_budget is not None:
+                budget = history_budget - estimate_tokens(question)
+                while self.turns and self.history_tokens > budget:
+                    dropped_question, dropped_answer, tokens = self.turns.pop(0)
+                    self.history_tokens -= tokens
+                    self.history_nbytes -= _turn_nbytes(dropped_question, dropped_answer)
+                    self.omitted += 1
+        history, omitted = self.history()
+        return build_messages(context, question, history, omitted)
+
+    def history(self):
+        """Return the (question, answer) pairs sent with the next question, and how many were trimmed."""
+        with self._lock:
+            return [(question, answer) for question, answer, _ in self.turns], self.omitted
+
+    def add_turn(self, question, answer, context):
+        """Record an answered question. The first answer pins context for the rest of the conversation."""
+        if not answer:
+            return
+        tokens = estimate_tokens(question) + estimate_tokens(answer)
+        with self._lock:
+            if self.pinned is None:
+                self.pinned = context
+                self._context_nbytes = None
+            self.turns.append((question, answer, tokens))
+            self.history_tokens += tokens
+            self.history_nbytes += _turn_nbytes(question, answer)
+
+    def reset(self):
+        """Start a new conversation about the same files."""
+        with self._lock:
+            self.pinned = None
+            self._context_nbytes = None
+            self.turns = []
+            self.history_tokens = 0
+            self.history_nbytes = 0
+            self.omitted = 0
+
+    def nbytes(self):
+        """Approximate memory held by the context and the history. Cheap once the context has been measured."""
+        with self._lock:
+            pinned = self.pinned
+            size = self._context_nbytes
+        if size is None:
+            size = context_nbytes(self.context)
+            if pinned is not None and pinned is not self.context:
+                size += context_nbytes(pinned)
+            with self._lock:
+                if self.pinned is pinned:
+                    self._context_nbytes = size
+        return size + self.history_nbytes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def _turn_nbytes(question, answer):
+    return sys.getsizeof(question) + sys.getsizeof(answer)
@@ -0,0 +1,145 @@
+"""Persistent per-file cache so reloading a folder only re-reads files that changed."""
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".claudefc", "filecache.sqlite3")
+
+
+def content_hash(content):
+    """Return a short, stable hash of decoded file content."""
+    return hashlib.blake2b(content.encode('utf-8', errors='surrogatepass'), digest_size=16).hexdigest()
+
+
+class CachedFile:
+    """Classification verdict and content of a file at a given mtime and size."""
+    __slots__ = ("mtime_ns", "size", "is_text", "content_hash", "content")
+
+    def __init__(self, mtime_ns, size, is_text, content_hash=None, content=None):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.is_text = is_text
+        self.content_hash = content_hash
+        self.content = content
+
+
+class FileCache:
+    """SQLite-backed cache of file verdicts and contents keyed on path, mtime and size.
+
+    Metadata for a folder is loaded once with begin(); contents are fetched
+    lazily on a cache hit. New and changed entries are kept in memory and
+    written in a single transaction by finish(), which also drops rows for
+    files that disappeared. If the database can't be opened the cache keeps
+    working in memory for the rest of the session.
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        self.db_path = db_path
+        self.root = None
+        self.entries = {}
+        self.dirty = {}
+        self.seen = set()
+        self.persistent = True
+        self._local = threading.local()
+
+        try:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS files ("
+                    "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, "
+                    "is_text INTEGER, content_hash TEXT, content TEXT)"
+                )
+        except (OSError, sqlite3.Error) as e:
+            print(f"File cache disabled ({db_path}): {str(e)}")
+            self.persistent = False
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _thread_conn(self):
+        # sqlite3 connections can't be shared across the scanner's worker threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def begin(self, root):
+        """Prepare for a scan of root, loading its cached metadata if needed."""
+        root = os.path.abspath(root)
+        self.seen = set()
+        if root == self.root:
+            return
+
+        self.root = root
+        self.entries = {}
+        self.dirty = {}
+        if not self.persistent:
+            return
+
+        prefix = os.path.join(root, "")
+        try:
+            with closing(self._connect()) as conn, conn:
+                rows = conn.execute(
+                    "SELECT path, mtime_ns, size, is_text, content_hash FROM files "
+                    "WHERE path >= ? AND path < ?",
+                    (prefix, prefix + "\uffff"),
+                )
+                for path, mtime_ns, size, is_text, digest in rows:
+                    self.entries[path] = CachedFile(mtime_ns, size, bool(is_text), digest)
+        except sqlite3.Error as e:
+            print(f"Error reading file cache: {str(e)}")
+
+    def lookup(self, path, st):
+        """Return the CachedFile for path if it is unchanged since it was cached."""
+        path = os.path.abspath(path)
+        self.seen.add(path)
+        entry = self.entries.get(path)
+        if entry is None or entry.mtime_ns != st.st_mtime_ns or entry.size != st.st_size:
+            return None
+
+        if entry.is_text and entry.content is None:
+            try:
+                row = self._thread_conn().execute(
+                    "SELECT content FROM files WHERE path = ?", (path,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is None or row[0] is None:
+                return None
+            entry.content = row[0]
+        return entry
+
+    def store(self, path, st, is_text, content=None):
+        """Record a freshly classified (and, for text files, read) file."""
+        path = os.path.abspath(path)
+        digest = content_hash(content) if content is not None else None
+        entry = CachedFile(st.st_mtime_ns, st.st_size, is_text, digest, content)
+        self.entries[path] = entry
+        self.dirty[path] = entry
+        return entry
+
+    def finish(self, complete=True):
+        """Persist new entries; if the scan was complete, forget removed files."""
+        removed = []
+        if complete and self.root is not None:
+            removed = [path for path in self.entries if path not in self.seen]
+            for path in removed:
+                del self.entries[path]
+
+        dirty, self.dirty = self.dirty, {}
+        if not self.persistent or (not dirty and not removed):
+            return
+
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    [(path, e.mtime_ns, e.size, int(e.is_text), e.content_hash, e.content)
+                     for path, e in dirty.items()],
+                )
+                conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+        except sqlite3.Error as e:
+            print(f"Error writing file cache: {str(e)}")
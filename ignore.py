@@ -0,0 +1,160 @@
+""".gitignore-style rules used to prune the directory walk."""
+import os
+import re
+
+IGNORE_FILES = ('.gitignore', '.ignore')
+
+# Always skipped unless an ignore file re-includes them with a "!" rule
+DEFAULT_IGNORES = (
+    # Version control
+    '.git/', '.hg/', '.svn/',
+    # Dependencies and virtual environments
+    'node_modules/', 'bower_components/', 'venv/', '.venv/', 'site-packages/',
+    # Build output
+    'build/', 'dist/', '*.egg-info/', '.eggs/',
+    # Caches
+    '__pycache__/', '.mypy_cache/', '.pytest_cache/', '.ruff_cache/', '.tox/', '.nox/', '.cache/',
+    # Editors and OS metadata
+    '.idea/', '.vscode/', '.DS_Store',
+)
+
+
+def _translate(pattern):
+    """Translate the body of a gitignore pattern into a regular expression."""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            out.append('(?:.*/)?')  # Zero or more directories
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == n:
+            out.append('/.*')  # Everything inside
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[':
+            end = pattern.find(']', i + 2 if pattern.startswith(('[!', '[^'), i) else i + 1)
+            if end == -1:
+                out.append(re.escape('['))
+                i += 1
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end + 1
+        elif pattern[i] == '\\' and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+
+class IgnoreRules:
+    """The rules from one ignore file (or the default list), relative to base.
+
+    base is the directory holding the file, as a '/'-separated path relative
+    to the scanned folder ('' for the folder itself).
+    """
+
+    def __init__(self, lines, base=''):
+        self.base = base
+        self.rules = []  # (regex, negate, dir_only)
+        for line in lines:
+            rule = self._parse(line)
+            if rule is not None:
+                self.rules.append(rule)
+
+    @staticmethod
+    def _parse(line):
+        line = line.rstrip('\n\r')
+        # Trailing spaces are ignored unless escaped
+        stripped = line.rstrip(' ')
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            stripped += ' '
+        line = stripped
+        if not line or line.startswith('#'):
+            return None
+
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith(('\\!', '\\#')):
+            line = line[1:]
+
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            return None
+
+        # A slash anywhere but the end anchors the pattern to the ignore file's directory
+        anchored = '/' in line
+        line = line.lstrip('/')
+        prefix = '' if anchored else '(?:.*/)?'
+        try:
+            regex = re.compile(prefix + _translate(line) + r'\Z', re.DOTALL)
+        except re.error:
+            return None
+        return regex, negate, dir_only
+
+    @classmethod
+    def from_file(cls, path, base=''):
+        """Load rules from an ignore file, or return None if it can't be read."""
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                return cls(f.readlines(), base)
+        except OSError:
+            return None
+
+    def match(self, relpath, is_dir):
+        """Return True if ignored, False if re-included by a "!" rule, or None if no rule matches."""
+        if self.base:
+            relpath = relpath[len(self.base) + 1:]
+        result = None
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                result = not negate
+        return result
+
+
+class IgnoreFilter:
+    """Decides which entries of a walk to skip, from the defaults and nested ignore files.
+
+    Rules from deeper directories take precedence, and within one file the
+    last matching rule wins, as in git. The walker keeps a chain of rule
+    sets per directory: chain_for() extends a parent's chain with any ignore
+    files a directory contains.
+    """
+
+    def __init__(self, defaults=DEFAULT_IGNORES, ignore_files=IGNORE_FILES):
+        self.ignore_files = ignore_files
+        self.root_chain = (IgnoreRules(defaults),) if defaults else ()
+
+    def chain_for(self, directory, relpath, chain, names):
+        """Return the rule chain for a directory, given its parent's chain and its entry names."""
+        for name in self.ignore_files:
+            if name in names:
+                rules = IgnoreRules.from_file(os.path.join(directory, name), relpath)
+                if rules is not None and rules.rules:
+                    chain = chain + (rules,)
+        return chain
+
+    @staticmethod
+    def ignored(chain, relpath, is_dir):
+        """Return True if the entry at relpath should be skipped."""
+        for rules in reversed(chain):
+            result = rules.match(relpath, is_dir)
+            if result is not None:
+                return result
+        return False
@@ -0,0 +1,206 @@
+"""Answering a question about more files than fit in one request, by map-reduce over shards.
+
+The loaded files, most relevant to the question first, are split into
+shards that each fit one request. The question is asked about every shard
+in parallel (map), and a last request merges the partial answers (reduce),
+streamed like any other answer. Shards are planned from the per-file token
+estimates kept by the FileCorpus, so planning doesn't reread or recount any
+file. Both map_reduce() and map_reduce_async() yield the same events:
+
+    {'plan': [files in each shard]}
+    {'shard': n, 'of': count, 'files': files}, or with 'failed': message, as each shard is answered
+    {'chunk': text} for the merged answer
+    {'done': True, 'usage': tokens over all requests, 'shards': count, 'failed': failures}
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+import scheduler
+from contextbuilder import ContextBuilder
+from prompts import SYSTEM_PROMPT, add_usage, build_messages, reduce_messages, shard_messages, usage_dict
+from tokens import context_budget
+
+MAX_SHARDS = 8  # Files past this many shards are left out
+MAP_CONCURRENCY = 4  # Shards asked at once
+MAP_MAX_TOKENS = 4096  # Output allowed per partial answer, keeping the reduce request small
+PLAN_MARGIN = 0.9  # Fill shards to this fraction of the budget, since token estimates are approximate
+
+
+def plan_shards(corpus, question, token_budget, max_shards=MAX_SHARDS):
+    """Split the corpus, most relevant files first, into lists of paths estimated to fit token_budget each."""
+    limit = token_budget * PLAN_MARGIN
+    shards = []
+    shard, used = [], 0
+    for path in corpus.ranked_paths(question):
+        tokens = corpus.tokens[path]
+        if shard and used + tokens > limit:
+            shards.append(shard)
+            if len(shards) >= max_shards:
+                return shards
+            shard, used = [], 0
+        shard.append(path)
+        used += tokens
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def shard_contexts(context, question, model, max_shards=MAX_SHARDS):
+    """Return a ContextBuilder per shard of context's files. A context whose files all fit is one shard."""
+    if context.corpus is None or not context.overflowed:
+        return [context]
+
+    corpus = context.corpus
+    budget = context_budget(model, MAP_MAX_TOKENS, history_tokens=0)
+    shards = []
+    for paths in plan_shards(corpus, question, budget, max_shards):
+        shard = ContextBuilder(context.max_size, budget, context.counter)
+        for path in paths:
+            if not shard.add_file(path, corpus.files[path]):
+                break
+        shards.append(shard)
+    return shards
+
+
+def _map_params(shard, question, index, count, model, max_tokens):
+    if count == 1:
+        # Nothing to merge, so the only shard is asked the question directly
+        return dict(model=model, system=SYSTEM_PROMPT, max_tokens=max_tokens,
+                    messages=build_messages(shard, question))
+    return dict(model=model, system=SYSTEM_PROMPT, max_tokens=min(max_tokens, MAP_MAX_TOKENS),
+                messages=shard_messages(shard, question, index, count))
+
+
+def _reduce_params(question, partials, count, model, max_tokens):
+    if not partials:
+        raise RuntimeError(f"None of the {count} shards could be answered")
+    return dict(model=model, system=SYSTEM_PROMPT, max_tokens=max_tokens,
+                messages=reduce_messages(question, sorted(partials), count))
+
+
+def _ask_shard(client, params, priority):
+    started = time.perf_counter()
+    with scheduler.stream(client, priority, **params) as stream:
+        message = stream.get_final_message()
+    metrics.SHARD_SECONDS.observe(time.perf_counter() - started)
+    return "".join(block.text for block in message.content if block.type == "text"), usage_dict(message.usage)
+
+
+async def _ask_shard_async(client, params, semaphore, priority):
+    async with semaphore:
+        started = time.perf_counter()
+        async with scheduler.astream(client, priority, **params) as stream:
+            message = await stream.get_final_message()
+    metrics.SHARD_SECONDS.observe(time.perf_counter() - started)
+    return "".join(block.text for block in message.content if block.type == "text"), usage_dict(message.usage)
+
+
+def map_reduce(client, context, question, model, max_tokens, max_shards=MAX_SHARDS, concurrency=MAP_CONCURRENCY,
+               priority=scheduler.INTERACTIVE):
+    """Answer question from every shard of context's files, yielding the events described above."""
+    started = time.perf_counter()
+    shards = shard_contexts(context, question, model, max_shards)
+    count = len(shards)
+    yield {'plan': [len(shard) for shard in shards]}
+
+    usage = {}
+    first_token = None
+    partials = []
+    try:
+        if count > 1:
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            try:
+                futures = {executor.submit(_ask_shard, client, _map_params(shard, question, index, count, model,
+                                                                           max_tokens), priority): index
+                           for index, shard in enumerate(shards, 1)}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    event = {'shard': index, 'of': count, 'files': len(shards[index - 1])}
+                    try:
+                        text, shard_usage = future.result()
+                        partials.append((index, text))
+                        add_usage(usage, shard_usage)
+                    except Exception as e:
+                        event['failed'] = str(e)
+                    yield event
+            finally:
+                # If the consumer stops early, don't wait for shards nobody will read
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        params = (_map_params(shards[0], question, 1, 1, model, max_tokens) if count == 1
+                  else _reduce_params(question, partials, count, model, max_tokens))
+        with scheduler.stream(client, priority, **params) as stream:
+            for text in stream.text_stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                yield {'chunk': text}
+            add_usage(usage, usage_dict(stream.get_final_message().usage))
+    except Exception:
+        metrics.ANSWER_ERRORS.inc()
+        raise
+
+    metrics.observe_answer(usage, first_token, time.perf_counter() - started)
+    yield {'done': True, 'usage': usage, 'shards': count, 'failed': count - len(partials) if count > 1 else 0}
+
+
+async def map_reduce_async(client, context, question, model, max_tokens, max_shards=MAX_SHARDS,
+                           concurrency=MAP_CONCURRENCY, run_blocking=None, priority=scheduler.INTERACTIVE):
+    """map_reduce() for an AsyncAnthropic client.
+
+    run_blocking, if given, is awaited as run_blocking(func, *args) to plan
+    the shards off the event loop.
+    """
+    started = time.perf_counter()
+    if run_blocking is None:
+        shards = shard_contexts(context, question, model, max_shards)
+    else:
+        shards = await run_blocking(shard_contexts, context, question, model, max_shards)
+    count = len(shards)
+    yield {'plan': [len(shard) for shard in shards]}
+
+    usage = {}
+    first_token = None
+    partials = []
+    try:
+        if count > 1:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def ask(index, shard):
+                try:
+                    return index, await _ask_shard_async(
+                        client, _map_params(shard, question, index, count, model, max_tokens), semaphore, priority)
+                except Exception as e:
+                    return index, e
+
+            tasks = [asyncio.ensure_future(ask(index, shard)) for index, shard in enumerate(shards, 1)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    index, result = await next_done
+                    event = {'shard': index, 'of': count, 'files': len(shards[index - 1])}
+                    if isinstance(result, Exception):
+                        event['failed'] = str(result)
+                    else:
+                        text, shard_usage = result
+                        partials.append((index, text))
+                        add_usage(usage, shard_usage)
+                    yield event
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        params = (_map_params(shards[0], question, 1, 1, model, max_tokens) if count == 1
+                  else _reduce_params(question, partials, count, model, max_tokens))
+        async with scheduler.astream(client, priority, **params) as stream:
+            async for text in stream.text_stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                yield {'chunk': text}
+            add_usage(usage, usage_dict((await stream.get_final_message()).usage))
+    except Exception:
+        metrics.ANSWER_ERRORS.inc()
+        raise
+
+    metrics.observe_answer(usage, first_token, time.perf_counter() - started)
+    yield {'done': True, 'usage': usage, 'shards': count, 'failed': count - len(partials) if count > 1 else 0}
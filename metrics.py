@@ -0,0 +1,245 @@
+"""Counters, gauges and histograms for each phase of loading and answering, in the Prometheus text format.
+
+Updating a metric takes a lock and a few additions, and per-file work is
+summed in ScanStats and published once per scan, so instrumentation can
+stay on in production. The web UIs serve REGISTRY.render() on /metrics.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a cached answer replayed in milliseconds to a long answer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RATE_BUCKETS = (5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 1000, 5000)  # Output tokens per second
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing total, optionally split by label values."""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(label, "") for label in self.labels), 0)
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Gauge:
+    """A value that goes up and down, such as a queue length."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def lines(self):
+        yield f"{self.name} {_format_value(self.value)}"
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, with their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the seconds spent in a with block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def lines(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+            yield f'{self.name}_bucket{{le="{le}"}} {cumulative}'
+        yield f"{self.name}_sum {_format_value(total)}"
+        yield f"{self.name}_count {count}"
+
+
+class Registry:
+    """The metrics of a process, by name."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._get(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation):
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, documentation, buckets)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        out = []
+        for metric in metrics:
+            out.append(f"# HELP {metric.name} {metric.documentation}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(metric.lines())
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Loading: folder scans and uploads
+FILES = REGISTRY.counter("claudefc_files_total", "Files seen while loading, by outcome", ("outcome",))
+DIRS_PRUNED = REGISTRY.counter("claudefc_dirs_pruned_total", "Directories skipped by ignore rules")
+BYTES_READ = REGISTRY.counter("claudefc_bytes_read_total", "Bytes of text files read from disk or uploads")
+SCAN_SECONDS = REGISTRY.histogram("claudefc_scan_seconds", "Wall time of a folder scan")
+READ_SECONDS = REGISTRY.counter("claudefc_read_seconds_total", "Time spent opening and reading files, over all threads")
+CLASSIFY_SECONDS = REGISTRY.counter("claudefc_classify_seconds_total", "Time spent classifying files as text or binary")
+UPLOAD_SECONDS = REGISTRY.histogram("claudefc_upload_seconds", "Time to receive and parse an upload")
+PACK_SECONDS = REGISTRY.histogram("claudefc_pack_seconds", "Time to pack loaded files into a context")
+REFRESHED = REGISTRY.counter("claudefc_refreshed_files_total", "Changed files refreshed in a watched folder, by outcome",
+                             ("outcome",))
+REFRESH_SECONDS = REGISTRY.histogram("claudefc_refresh_seconds", "Time to refresh the changed files of a watched folder")
+
+# Answering
+PROMPT_SECONDS = REGISTRY.histogram("claudefc_prompt_seconds", "Time to pick the files and assemble the messages")
+FIRST_TOKEN_SECONDS = REGISTRY.histogram("claudefc_first_token_seconds", "Time from the request to the first text chunk")
+ANSWER_SECONDS = REGISTRY.histogram("claudefc_answer_seconds", "Time from the request to the end of the answer")
+DELIVERY_SECONDS = REGISTRY.counter("claudefc_delivery_seconds_total", "Time spent writing answer chunks to clients")
+TOKENS_PER_SECOND = REGISTRY.histogram("claudefc_output_tokens_per_second", "Output tokens per second after the first",
+                                       RATE_BUCKETS)
+SHARD_SECONDS = REGISTRY.histogram("claudefc_shard_seconds", "Time to answer one shard of a map-reduce question")
+ANSWERS = REGISTRY.counter("claudefc_answers_total", "Questions answered, by source", ("source",))
+ANSWER_ERRORS = REGISTRY.counter("claudefc_answer_errors_total", "Questions that failed")
+TOKENS = REGISTRY.counter("claudefc_tokens_total", "Tokens reported in API usage, by kind", ("kind",))
+
+# Scheduling API requests within the rate limits (see scheduler.py)
+QUEUE_DEPTH = REGISTRY.gauge("claudefc_request_queue_depth", "API requests waiting for a slot")
+ACTIVE_REQUESTS = REGISTRY.gauge("claudefc_active_requests",
+                                 "API requests holding a slot; a stream holds one until its response starts")
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("claudefc_request_queue_wait_seconds", "Time API requests waited for a slot")
+RETRIES = REGISTRY.counter("claudefc_request_retries_total", "API requests retried, by reason", ("reason",))
+
+
+def timed_delivery(events):
+    """Pass a response's chunks through, adding the time spent handing each to the client to DELIVERY_SECONDS."""
+    try:
+        for event in events:
+            started = time.perf_counter()
+            yield event
+            DELIVERY_SECONDS.inc(time.perf_counter() - started)
+    finally:
+        events.close()
+
+
+def observe_scan(stats):
+    """Publish the counts and timings of a finished scan."""
+    FILES.inc(stats.files_read - stats.cache_hits, outcome="read")
+    FILES.inc(stats.cache_hits, outcome="cached")
+    FILES.inc(stats.files_binary, outcome="binary")
+    FILES.inc(stats.entries_skipped, outcome="ignored")
+    FILES.inc(stats.read_errors, outcome="error")
+    DIRS_PRUNED.inc(stats.dirs_pruned)
+    BYTES_READ.inc(stats.bytes_read)
+    SCAN_SECONDS.observe(stats.elapsed)
+    READ_SECONDS.inc(stats.read_seconds)
+    CLASSIFY_SECONDS.inc(stats.classify_seconds)
+
+
+def observe_upload(parser, seconds):
+    """Publish the counts and timing of a parsed upload."""
+    FILES.inc(len(parser.files), outcome="uploaded")
+    FILES.inc(parser.file_count - len(parser.files), outcome="rejected")
+    BYTES_READ.inc(parser.text_size)
+    UPLOAD_SECONDS.observe(seconds)
+
+
+def observe_answer(usage, first_token, elapsed, cached=False):
+    """Publish the timings and token usage of a completed answer."""
+    ANSWERS.inc(source="cache" if cached else "api")
+    ANSWER_SECONDS.observe(elapsed)
+    if first_token is not None:
+        FIRST_TOKEN_SECONDS.observe(first_token)
+    if cached:
+        return
+    output_tokens = usage.get("output_tokens", 0)
+    if first_token is not None and elapsed > first_token and output_tokens > 1:
+        TOKENS_PER_SECOND.observe((output_tokens - 1) / (elapsed - first_token))
+    for kind in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+        TOKENS.inc(usage.get(kind, 0), kind=kind[:-len("_tokens")])
+
+
+def phase_summary(answer):
+    """Return a one-line breakdown of where an Answer's time went."""
+    summary = f"prompt {answer.prompt_seconds * 1000:.0f}ms"
+    if answer.first_token is not None:
+        summary += f", first token {answer.first_token:.2f}s"
+    summary += f", total {answer.elapsed:.2f}s"
+    output_tokens = answer.usage.get("output_tokens", 0)
+    if not answer.cached and answer.first_token is not None and answer.elapsed > answer.first_token:
+        summary += f", {output_tokens / (answer.elapsed - answer.first_token):.0f} tokens/s"
+    return summary
@@ -0,0 +1,154 @@
+"""Compact structural outlines of source files, for files that don't fit the context in full.
+
+An outline keeps a file's imports, class and function signatures and the
+first lines of their docstrings. Python is outlined from its syntax tree;
+other languages with a lightweight line-based regex.
+"""
+import ast
+import os
+import re
+import threading
+
+from filecache import content_hash
+
+DOCSTRING_LINES = 3  # Lines of each docstring kept in the outline
+MAX_LINE_LENGTH = 200
+CACHE_SIZE = 8192  # Outlines remembered before the cache is reset
+
+_C_LIKE = re.compile(
+    r'^\s*(?:'
+    # Imports and modules
+    r'(?:import|package|using|#include|#import|use|mod|extern\s+crate)\b'
+    r'|(?:const|let|var)\s+\w+\s*=\s*require\('
+    # Declarations, with any modifiers in front
+    r'|(?:(?:export|default|public|private|protected|internal|static|abstract|final|sealed|open|data|'
+    r'async|override|virtual|extern|inline|unsafe|pub(?:\([\w:]+\))?|partial|readonly)\s+)*'
+    r'(?:class|interface|struct|enum|trait|impl|type|record|namespace|module|object|fn|func|function|fun|def)\b'
+    # Arrow functions bound to a name
+    r'|(?:export\s+)?(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:\([^)]*\)|\w+)\s*=>'
+    # Doc comments
+    r'|///|//!|/\*\*'
+    r')'
+    # Function and method definitions: a return type and name, then an unterminated parameter list
+    r'|^\s*(?!(?:if|else|for|while|switch|return|catch|throw|new|delete|await|yield|case|do)\b)'
+    r'[A-Za-z_][\w\s\*&:<>,\[\]]*[\s\*&]\**~?[A-Za-z_][\w:]*\s*\([^;]*$'
+)
+
+_PYTHON = re.compile(r'^\s*(?:import|from|class|def|async\s+def)\b')
+_RUBY = re.compile(r'^\s*(?:require|require_relative|module|class|def|attr_\w+|include)\b')
+_PERL = re.compile(r'^\s*(?:use|package|sub)\b')
+_LUA = re.compile(r'^\s*(?:(?:local\s+)?function\b|local\s+\w+\s*=\s*require\b)')
+_SHELL = re.compile(r'^\s*(?:function\s+[\w-]+|[\w-]+\s*\(\)\s*\{?|source\b|\.\s+\S|:\w+)', re.IGNORECASE)
+_R = re.compile(r'^\s*(?:[\w.]+\s*<-\s*function\b|library\(|require\(|source\()')
+_SQL = re.compile(r'^\s*(?:CREATE|ALTER)\b', re.IGNORECASE)
+_MARKDOWN = re.compile(r'^#{1,6}\s')
+_SECTIONS = re.compile(r'^\s*\[[^\]]+\]\s*$')
+_YAML = re.compile(r'^[A-Za-z_][\w.-]*\s*:')
+
+OUTLINE_PATTERNS = {
+    '.py': _PYTHON,
+    '.js': _C_LIKE, '.ts': _C_LIKE, '.java': _C_LIKE, '.c': _C_LIKE, '.cpp': _C_LIKE, '.h': _C_LIKE,
+    '.cs': _C_LIKE, '.php': _C_LIKE, '.go': _C_LIKE, '.rs': _C_LIKE, '.swift': _C_LIKE,
+    '.kt': _C_LIKE, '.scala': _C_LIKE, '.dart': _C_LIKE,
+    '.rb': _RUBY,
+    '.pl': _PERL,
+    '.lua': _LUA,
+    '.sh': _SHELL, '.bat': _SHELL, '.ps1': _SHELL,
+    '.r': _R,
+    '.sql': _SQL,
+    '.md': _MARKDOWN,
+    '.toml': _SECTIONS, '.ini': _SECTIONS, '.conf': _SECTIONS,
+    '.yaml': _YAML, '.yml': _YAML,
+}
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _clip(line):
+    line = line.rstrip()
+    return line if len(line) <= MAX_LINE_LENGTH else line[:MAX_LINE_LENGTH] + ' ...'
+
+
+def outline_lines(content, pattern):
+    """Outline a file by keeping the lines that match pattern."""
+    return [_clip(line) for line in content.splitlines() if pattern.match(line)]
+
+
+def _docstring(node, indent):
+    doc = ast.get_docstring(node)
+    if not doc:
+        return []
+    lines = doc.splitlines()[:DOCSTRING_LINES]
+    if len(doc.splitlines()) > DOCSTRING_LINES:
+        lines.append('...')
+    lines[0] = '"""' + lines[0]
+    lines[-1] += '"""'
+    return [_clip(indent + line) if line else '' for line in lines]
+
+
+def _body_indent(source, node):
+    line = source[node.lineno - 1]
+    return line[:len(line) - len(line.lstrip())] + '    '
+
+
+def _outline_python_node(node, source, out):
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        end = getattr(node, 'end_lineno', None) or node.lineno
+        out.extend(_clip(line) for line in source[node.lineno - 1:end])
+    elif isinstance(node, ast.Assign) and all(isinstance(t, ast.Name) and (t.id.isupper() or t.id == '__all__')
+                                              for t in node.targets):
+        # Module and class constants
+        out.append(_clip(source[node.lineno - 1]))
+    elif isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+        start = min([d.lineno for d in node.decorator_list] + [node.lineno])
+        body_start = node.body[0].lineno
+        # The signature runs from the decorators up to the first line of the body
+        out.extend(_clip(line) for line in source[start - 1:max(body_start - 1, node.lineno)])
+        indent = _body_indent(source, node)
+        out.extend(_docstring(node, indent))
+        if isinstance(node, ast.ClassDef):
+            for child in node.body:
+                _outline_python_node(child, source, out)
+        else:
+            out.append(indent + '...')
+
+
+def outline_python(content):
+    """Outline Python source from its syntax tree, or by regex if it doesn't parse."""
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError, RecursionError):
+        return outline_lines(content, _PYTHON)
+
+    # Line numbers count '\n' only, unlike splitlines()
+    source = content.split('\n')
+    out = _docstring(tree, '')
+    for node in tree.body:
+        _outline_python_node(node, source, out)
+    return out
+
+
+def outline_file(relative_path, content):
+    """Return a compact outline of a file, or None if its type has no outliner or nothing to show.
+
+    Outlines are cached on the content hash, so a file is only outlined once.
+    """
+    ext = os.path.splitext(relative_path.lower())[1]
+    pattern = OUTLINE_PATTERNS.get(ext)
+    if pattern is None:
+        return None
+
+    key = (content_hash(content), ext)
+    with _lock:
+        if key in _cache:
+            return _cache[key]
+
+    lines = outline_python(content) if ext == '.py' else outline_lines(content, pattern)
+    outline = '\n'.join(lines) if lines else None
+
+    with _lock:
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        _cache[key] = outline
+    return outline
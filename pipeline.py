@@ -0,0 +1,254 @@
+"""Loading files into a context and asking questions about it, shared by the desktop app and the command line."""
+import time
+
+import metrics
+import scheduler
+from answercache import answer_key, replay_chunks
+from contextbuilder import ContextBuilder
+from mapreduce import map_reduce
+from prompts import SYSTEM_PROMPT, usage_dict
+from ranking import FileCorpus
+from scanner import ScanStats, read_files, scan_files
+from tokens import context_budget, history_budget
+
+
+def pack_files(files, context, corpus, progress=None):
+    """Add (relative_path, content) pairs to context, keeping every file in corpus for ranking.
+
+    Loading continues past a full context, until the corpus is full, so each
+    question can be matched against every file. If not everything fitted,
+    the corpus is attached to the context. progress, if given, is called
+    with the number of files loaded so far. Returns the paths loaded.
+    """
+    loaded = []
+    packing = 0.0  # Time spent here rather than waiting on files
+    for relative_path, content in files:
+        started = time.perf_counter()
+        if not corpus.add_file(relative_path, content):
+            break
+        loaded.append(relative_path)
+        if not context.truncated:
+            context.add_file(relative_path, content)
+        if context.overflowed:
+            corpus.update_index()
+        packing += time.perf_counter() - started
+        if progress is not None:
+            progress(len(loaded))
+
+    if context.overflowed:
+        # Not everything fits in full, so rank the files against each question instead
+        context.corpus = corpus
+    metrics.PACK_SECONDS.observe(packing)
+    return loaded
+
+
+def new_context(model, max_tokens, counter=None):
+    """Return an empty ContextBuilder sized for what the model has left after max_tokens of output."""
+    # Files past the budget go in as outlines while those still fit
+    return ContextBuilder(token_budget=context_budget(model, max_tokens), counter=counter, outline=True)
+
+
+def load_folder(folder_path, context, corpus=None, stats=None, cache=None, progress=None):
+    """Scan folder_path and pack its text files into context. Returns the paths loaded."""
+    if corpus is None:
+        corpus = FileCorpus()
+    if stats is None:
+        stats = ScanStats()
+    # Classify and read files on a thread pool, in os.walk order;
+    # unchanged files are served from the cache without being opened
+    files = scan_files(folder_path, stats=stats, cache=cache)
+    try:
+        return pack_files(files, context, corpus, progress)
+    finally:
+        files.close()
+        metrics.observe_scan(stats)
+
+
+def refresh_files(folder_path, paths, conversation, corpus, cache=None, stats=None):
+    """Bring a conversation's files up to date with paths under folder_path that changed on disk.
+
+    Only those files are read, and only their segments of the context (and
+    of the context the conversation pinned, if it is another) are replaced,
+    so a refresh costs as much as the changed files. New files are added as
+    a load would add them; files that are gone or no longer text are
+    removed. If a changed file no longer fits where it was, the context is
+    packed again from the corpus, without reading anything more. Returns
+    (paths updated or added, paths removed).
+    """
+    started = time.perf_counter()
+    context = conversation.context
+    updated, removed = [], []
+    repack = False
+    files = read_files(folder_path, paths, cache=cache, stats=stats)
+    try:
+        for path, content in files:
+            old = corpus.files.get(path)
+            if content is not None and content == old:
+                continue  # Touched or rewritten unchanged: keep the context, and its prompt cache
+            if content is None or not corpus.update_file(path, content):
+                # Gone, or no longer fits in the corpus
+                segment = context.segment(path)
+                if corpus.remove_file(path) | context.remove_file(path):
+                    removed.append(path)
+                if segment is not None and segment.truncated:
+                    # The files the cut-short one kept out may fit now
+                    repack = True
+                continue
+            updated.append(path)
+            if old is None:
+                if not context.truncated:
+                    context.add_file(path, content)
+            elif context.segment(path) is not None and not context.replace_file(path, content):
+                repack = True
+    finally:
+        files.close()
+
+    if repack:
+        # The files after the one that grew may now be packed differently
+        context.clear()
+        for path, content in corpus.files.items():
+            if context.truncated:
+                break
+            context.add_file(path, content)
+    if context.overflowed:
+        corpus.update_index()
+        context.corpus = corpus
+
+    pinned = conversation.pinned
+    if pinned is not None and pinned is not context:
+        for path in removed:
+            pinned.remove_file(path)
+        for path in updated:
+            if pinned.segment(path) is not None and not pinned.replace_file(path, corpus.files[path]):
+                # Pick the files for the conversation again with its next question
+                conversation.pinned = None
+                break
+
+    metrics.REFRESHED.inc(len(updated), outcome="updated")
+    metrics.REFRESHED.inc(len(removed), outcome="removed")
+    metrics.REFRESH_SECONDS.observe(time.perf_counter() - started)
+    return updated, removed
+
+
+class Answer:
+    """An answered question: the text, token usage, the context sent and timings in seconds.
+
+    cached is True if the answer was replayed from an AnswerCache. For a
+    map-reduce answer, shards is the number of shards it was merged from and
+    failed_shards how many of those couldn't be answered.
+    """
+
+    def __init__(self, text, usage, context, first_token, elapsed, cached=False, prompt_seconds=0.0, shards=0,
+                 failed_shards=0):
+        self.text = text
+        self.usage = usage
+        self.context = context
+        self.first_token = first_token
+        self.elapsed = elapsed
+        self.cached = cached
+        self.prompt_seconds = prompt_seconds
+        self.shards = shards
+        self.failed_shards = failed_shards
+
+
+def ask(client, conversation, question, model, max_tokens, on_start=None, on_text=None, cache=None,
+        priority=scheduler.INTERACTIVE):
+    """Stream the answer to question, as the next turn of conversation, and return an Answer.
+
+    on_start is called once the response starts and on_text with each chunk
+    of text, on the calling thread. With an AnswerCache, a question already
+    answered about the same context and history is replayed through the
+    same callbacks without a request, and new answers are stored in it.
+    The request waits its turn in the client's Scheduler at priority.
+    """
+    started = time.perf_counter()
+    # Pack the files most relevant to the question if they don't all fit,
+    # or keep the files the conversation started with
+    context = conversation.context_for(question)
+
+    # File context goes in cached blocks, followed by the conversation so far
+    messages = conversation.messages(question, context, history_budget(model, max_tokens, context.total_tokens))
+
+    key = None
+    cached = None
+    if cache is not None:
+        key = answer_key(context, question, model, max_tokens, *conversation.history())
+        cached = cache.get(key)
+    prompt_seconds = time.perf_counter() - started
+    metrics.PROMPT_SECONDS.observe(prompt_seconds)
+
+    first_token = None
+    if cached is not None:
+        text, usage = cached
+        if on_start is not None:
+            on_start()
+        for chunk in replay_chunks(text):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            if on_text is not None:
+                on_text(chunk)
+        conversation.add_turn(question, text, context)
+        elapsed = time.perf_counter() - started
+        metrics.observe_answer(usage, first_token, elapsed, cached=True)
+        return Answer(text, usage, context, first_token, elapsed, True, prompt_seconds)
+
+    answer = []
+    try:
+        with scheduler.stream(
+            client,
+            priority,
+            model=model,
+            system=SYSTEM_PROMPT,
+            max_tokens=max_tokens,
+            messages=messages
+        ) as stream:
+            if on_start is not None:
+                on_start()
+            for text in stream.text_stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                answer.append(text)
+                if on_text is not None:
+                    on_text(text)
+            usage = usage_dict(stream.get_final_message().usage)
+    except Exception:
+        metrics.ANSWER_ERRORS.inc()
+        raise
+
+    text = ''.join(answer)
+    if cache is not None:
+        cache.put(key, text, usage)
+    conversation.add_turn(question, text, context)
+    elapsed = time.perf_counter() - started
+    metrics.observe_answer(usage, first_token, elapsed)
+    return Answer(text, usage, context, first_token, elapsed, prompt_seconds=prompt_seconds)
+
+
+def ask_sharded(client, context, question, model, max_tokens, on_start=None, on_text=None, on_progress=None,
+                priority=scheduler.INTERACTIVE):
+    """Answer question from all of context's files by map-reduce over shards (see mapreduce.py).
+
+    on_progress is called with the plan and each answered shard's event;
+    on_start and on_text as for ask(), for the merged answer. The answer
+    stands alone: it is neither cached nor added to a conversation.
+    """
+    started = time.perf_counter()
+    first_token = None
+    answer = []
+    for event in map_reduce(client, context, question, model, max_tokens, priority=priority):
+        if 'chunk' in event:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+                if on_start is not None:
+                    on_start()
+            answer.append(event['chunk'])
+            if on_text is not None:
+                on_text(event['chunk'])
+        elif event.get('done'):
+            usage, shards, failed = event['usage'], event['shards'], event['failed']
+        elif on_progress is not None:
+            on_progress(event)
+    if first_token is None and on_start is not None:
+        on_start()
+    return Answer(''.join(answer), usage, context, first_token, time.perf_counter() - started,
+                  shards=shards, failed_shards=failed)
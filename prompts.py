@@ -0,0 +1,124 @@
+"""Request layout shared by the desktop app and the web UI."""
+
+SYSTEM_PROMPT = (
+    "You are an assistant that analyzes and answers questions about the provided files. "
+    "The user will provide file contents and ask questions about them. "
+    "Be concise but thorough in your responses."
+)
+
+CONTEXT_PREFIX = "Here are the files to analyze:\n\n"
+QUESTION_PREFIX = "\n\nBased on these files, please answer the following question:\n"
+HISTORY_NOTE = "\n\n(Earlier questions and answers in this conversation have been left out.)"
+
+# Map-reduce over shards of a corpus too large for one request (see mapreduce.py)
+SHARD_NOTE = (
+    "\n\n(These files are part {index} of {count} of a project too large to send at once. Answer from "
+    "these files only, naming the files and code you rely on; if none of them bear on the question, "
+    "reply only \"Nothing relevant.\")"
+)
+REDUCE_PREFIX = (
+    "The files of a project were split into {count} parts, and the question below was answered "
+    "from each part separately. Here are those partial answers:\n\n"
+)
+REDUCE_QUESTION = (
+    "\n\nCombine them into one answer to the question, resolving overlaps and contradictions and "
+    "keeping the file references. Parts that found nothing relevant can be ignored.\n\nQuestion: "
+)
+FAILED_SHARDS_NOTE = "(No answer could be had for {failed} of the {count} parts; say so if it matters.)"
+
+# The API allows four cache breakpoints per request; keep one in reserve
+CONTEXT_CACHE_BREAKPOINTS = 3
+
+
+def context_blocks(context):
+    """Return the file context as content blocks ending in cache breakpoints.
+
+    context is a ContextBuilder, split at file boundaries so that a change
+    late in the context still reuses the cached prefix before it, or an
+    already assembled string, which is sent as a single cached block.
+    """
+    if isinstance(context, str):
+        chunks = [context]
+    else:
+        chunks = context.chunks(CONTEXT_CACHE_BREAKPOINTS)
+
+    blocks = []
+    for i, chunk in enumerate(chunks):
+        blocks.append({
+            "type": "text",
+            "text": CONTEXT_PREFIX + chunk if i == 0 else chunk,
+            "cache_control": {"type": "ephemeral"},
+        })
+    return blocks
+
+
+def build_messages(context, question, history=(), omitted=0):
+    """Return the messages for a question about the file context.
+
+    history holds the earlier (question, answer) pairs of the conversation,
+    oldest first, and omitted how many turns were trimmed from before them.
+    The file context always opens the first user turn, and the last earlier
+    answer takes the reserved cache breakpoint, so a follow-up reads both
+    the context and the conversation so far from the cache.
+    """
+    content = context_blocks(context)
+    if omitted:
+        content.append({"type": "text", "text": HISTORY_NOTE})
+
+    messages = []
+    for earlier_question, answer in history:
+        content.append({"type": "text", "text": earlier_question if messages else QUESTION_PREFIX + earlier_question})
+        messages.append({"role": "user", "content": content})
+        messages.append({"role": "assistant", "content": [{"type": "text", "text": answer}]})
+        content = []
+    if messages:
+        messages[-1]["content"][0]["cache_control"] = {"type": "ephemeral"}
+
+    content.append({"type": "text", "text": question if messages else QUESTION_PREFIX + question})
+    messages.append({"role": "user", "content": content})
+    return messages
+
+
+def shard_messages(context, question, index, count):
+    """Return the messages asking question about shard index (from 1) of count."""
+    return build_messages(context, question + SHARD_NOTE.format(index=index, count=count))
+
+
+def reduce_messages(question, partials, count):
+    """Return the messages merging the partial answers to question from count shards.
+
+    partials holds (shard index, answer) pairs; shards missing from it failed.
+    """
+    parts = [REDUCE_PREFIX.format(count=count)]
+    for index, answer in partials:
+        parts.append(f"==== PART {index} OF {count} ====\n\n{answer.strip()}\n\n")
+    if len(partials) < count:
+        parts.append(FAILED_SHARDS_NOTE.format(failed=count - len(partials), count=count))
+    parts.append(REDUCE_QUESTION + question)
+    return [{"role": "user", "content": [{"type": "text", "text": "".join(parts)}]}]
+
+
+def add_usage(total, usage):
+    """Add the token counts of usage (a dict from usage_dict) into total, and return total."""
+    for kind, count in usage.items():
+        total[kind] = total.get(kind, 0) + count
+    return total
+
+
+def usage_dict(usage):
+    """Return the token counts from a response's usage as a plain dict."""
+    return {
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+    }
+
+
+def usage_summary(usage):
+    """Return a one-line description of a response's token usage."""
+    counts = usage if isinstance(usage, dict) else usage_dict(usage)
+    return (f"Tokens: {counts['input_tokens']:,} input, "
+            f"{counts['cache_read_input_tokens']:,} cache read, "
+            f"{counts['cache_creation_input_tokens']:,} cache write, "
+            f"{counts['output_tokens']:,} output")
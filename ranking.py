@@ -0,0 +1,230 @@
+"""BM25 relevance ranking of loaded files against a question."""
+import math
+import re
+import sys
+from collections import Counter
+from functools import lru_cache
+
+from contextbuilder import file_header
+from tokens import estimate_tokens
+
+MAX_CORPUS_SIZE = 64 * 1024 * 1024  # Text kept for ranking, beyond what fits in one context
+PATH_WEIGHT = 3  # Each path token counts as this many mentions in the file
+MIN_SCORE_RATIO = 0.1  # Leave out files scoring below this fraction of the best match
+K1 = 1.2
+B = 0.75
+
+IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|[0-9]+')
+WORD_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in into is it its me my not of on or
+so that the their then there these this to was we what when where which while who why will with
+you your file files code about explain tell show use used using
+""".split())
+
+
+@lru_cache(maxsize=1 << 16)
+def _terms(identifier):
+    # The identifier itself plus its snake_case and camelCase parts
+    words = WORD_RE.findall(identifier)
+    terms = [identifier.lower()] if len(words) != 1 else []
+    terms.extend(word.lower() for word in words)
+    return tuple(_stem(term) for term in terms if len(term) > 1 and term not in STOP_WORDS)
+
+
+def _stem(term):
+    # Just enough folding for "errors" to find "error"
+    if len(term) > 3 and term.endswith('s') and not term.endswith('ss'):
+        return term[:-1]
+    return term
+
+
+def term_counts(text):
+    """Count the search terms in text: identifiers, split on case and underscores, lower-cased."""
+    counts = Counter()
+    for identifier, count in Counter(IDENTIFIER_RE.findall(text)).items():
+        for term in _terms(identifier):
+            counts[term] += count
+    return counts
+
+
+class RelevanceIndex:
+    """Incremental inverted index scoring files against a query with BM25.
+
+    Files are indexed on their identifiers and path; add() and remove() keep
+    the postings and length statistics up to date as files come and go.
+    """
+
+    def __init__(self):
+        self._lengths = {}  # path -> number of terms
+        self._terms = {}  # path -> distinct terms, to find its postings on removal
+        self._postings = {}  # term -> {path: term frequency}
+        self._total_length = 0
+        self.postings_count = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, path):
+        return path in self._lengths
+
+    def add(self, path, content):
+        """Index a file, replacing any earlier version of it."""
+        self.remove(path)
+        counts = term_counts(content)
+        for term, count in term_counts(path).items():
+            counts[term] += count * PATH_WEIGHT
+
+        postings = self._postings
+        for term, count in counts.items():
+            bucket = postings.get(term)
+            if bucket is None:
+                bucket = postings[term] = {}
+            bucket[path] = count
+        length = sum(counts.values())
+        self._lengths[path] = length
+        self._terms[path] = tuple(counts)
+        self._total_length += length
+        self.postings_count += len(counts)
+
+    def remove(self, path):
+        """Drop a file from the index."""
+        length = self._lengths.pop(path, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._terms.pop(path):
+            bucket = self._postings[term]
+            del bucket[path]
+            self.postings_count -= 1
+            if not bucket:
+                del self._postings[term]
+
+    def scores(self, query):
+        """Return {path: BM25 score} for the files matching any term of query."""
+        count = len(self._lengths)
+        if not count:
+            return {}
+        average = self._total_length / count
+
+        scores = {}
+        for term in term_counts(query):
+            bucket = self._postings.get(term)
+            if not bucket:
+                continue
+            idf = math.log(1 + (count - len(bucket) + 0.5) / (len(bucket) + 0.5))
+            for path, tf in bucket.items():
+                norm = K1 * (1 - B + B * self._lengths[path] / average)
+                scores[path] = scores.get(path, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def rank(self, query):
+        """Return [(path, score)] for matching files, best first."""
+        return sorted(self.scores(query).items(), key=lambda item: -item[1])
+
+
+class FileCorpus:
+    """Every loaded file, in load order, indexed for ranking against questions.
+
+    A ContextBuilder holds what fits in one request; the corpus keeps up to
+    max_size characters of files so each question can be answered from the
+    files most relevant to it. Indexing costs far more than loading, so files
+    are only stored until update_index() is first called (typically once the
+    context overflows) and indexed as they are added after that.
+
+    Each file's estimated token count, header included, is kept in tokens so
+    the corpus can be split into request-sized shards without rereading it.
+    update_file() and remove_file() keep the files and index current as
+    files change on disk.
+    """
+
+    def __init__(self, max_size=MAX_CORPUS_SIZE):
+        self.max_size = max_size
+        self.files = {}
+        self.tokens = {}
+        self.total_size = 0
+        self.truncated = False
+        self.indexing = False
+        self.index = RelevanceIndex()
+        self._pending = []
+
+    def __len__(self):
+        return len(self.files)
+
+    def add_file(self, relative_path, content):
+        """Store a file. Returns False, without adding it, once the corpus is full."""
+        if self.total_size + len(content) > self.max_size:
+            self.truncated = True
+            return False
+        self.files[relative_path] = content
+        self.tokens[relative_path] = estimate_tokens(content, relative_path) + estimate_tokens(file_header(relative_path))
+        self.total_size += len(content)
+        self._pending.append(relative_path)
+        if self.indexing:
+            self.update_index()
+        return True
+
+    def update_file(self, relative_path, content):
+        """Store a new version of a file, or a new file at the end. Returns False, without it, if the corpus is full."""
+        old = self.files.get(relative_path)
+        if old is None:
+            return self.add_file(relative_path, content)
+        if self.total_size - len(old) + len(content) > self.max_size:
+            self.truncated = True
+            return False
+        self.files[relative_path] = content
+        self.tokens[relative_path] = estimate_tokens(content, relative_path) + estimate_tokens(file_header(relative_path))
+        self.total_size += len(content) - len(old)
+        if self.indexing:
+            self.index.add(relative_path, content)
+        return True
+
+    def remove_file(self, relative_path):
+        """Forget a file. Returns False if it wasn't stored."""
+        content = self.files.pop(relative_path, None)
+        if content is None:
+            return False
+        del self.tokens[relative_path]
+        self.total_size -= len(content)
+        self.index.remove(relative_path)
+        return True
+
+    def update_index(self):
+        """Index the files stored so far, and every file added from now on."""
+        self.indexing = True
+        pending, self._pending = self._pending, []
+        for path in pending:
+            # Files can be removed before they are indexed
+            if path in self.files:
+                self.index.add(path, self.files[path])
+
+    def nbytes(self):
+        """Approximate memory held by the files and the index."""
+        return sum(sys.getsizeof(content) for content in self.files.values()) + self.index.postings_count * 100
+
+    def ranked_paths(self, question):
+        """Return every file path, those matching question first, best first, then the rest in load order."""
+        self.update_index()
+        ranked = [path for path, _ in self.index.rank(question)]
+        matched = set(ranked)
+        return ranked + [path for path in self.files if path not in matched]
+
+    def pack(self, question, context):
+        """Fill an empty ContextBuilder with the files that best match question, best first.
+
+        Files scoring well below the best match are left out. If nothing
+        matches, the files are packed in load order.
+        """
+        self.update_index()
+        ranked = self.index.rank(question)
+        if ranked:
+            cutoff = ranked[0][1] * MIN_SCORE_RATIO
+            paths = [path for path, score in ranked if score >= cutoff]
+        else:
+            paths = list(self.files)
+
+        for path in paths:
+            if not context.add_file(path, self.files[path]):
+                break
+        return context
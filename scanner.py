@@ -0,0 +1,308 @@
+"""Parallel directory scanner used to load text files for the context."""
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from classifier import decode_text, default_classifier
+from ignore import IgnoreFilter
+
+MAX_FILE_SIZE = 1024 * 1024  # Skip files larger than 1MB
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+class ScanStats:
+    """Counters and timings collected while scanning a directory."""
+
+    def __init__(self):
+        self.files_scanned = 0
+        self.files_read = 0
+        self.bytes_read = 0
+        self.cache_hits = 0
+        self.dirs_pruned = 0
+        self.entries_skipped = 0
+        self.files_binary = 0
+        self.read_errors = 0
+        # Summed over the worker threads, so they can add up to more than elapsed
+        self.read_seconds = 0.0
+        self.classify_seconds = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add_file(self, read_seconds, classify_seconds, binary=False, error=False):
+        """Record the time spent on one file; called from the worker threads."""
+        with self._lock:
+            self.read_seconds += read_seconds
+            self.classify_seconds += classify_seconds
+            self.files_binary += binary
+            self.read_errors += error
+
+    def stop(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    @property
+    def files_per_sec(self):
+        return self.files_read / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes_read / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        summary = (f"{self.files_read} of {self.files_scanned} files, "
+                   f"{self.bytes_read / (1024 * 1024):.1f} MB read in {self.elapsed:.2f}s "
+                   f"({self.files_per_sec:.0f} files/s, {self.bytes_per_sec / (1024 * 1024):.1f} MB/s)")
+        if self.cache_hits:
+            summary += f", {self.cache_hits} unchanged from cache"
+        if self.dirs_pruned or self.entries_skipped:
+            summary += f", {self.dirs_pruned} dirs pruned and {self.entries_skipped} files ignored"
+        return summary
+
+
+def walk_entries(folder_path, ignore=None, stats=None, dirs=None, rel='', chain=None):
+    """Yield a DirEntry for every file under folder_path, in os.walk order.
+
+    With an IgnoreFilter, ignored files are skipped and ignored directories
+    are pruned before they are listed; both are counted in stats if given.
+    If dirs is a dict, each directory listed is recorded in it as
+    {path: (relative path, rule chain)}. To walk a subdirectory of the folder
+    being scanned, pass its relative path as rel and its parent's rule chain.
+    """
+    if chain is None:
+        chain = ignore.root_chain if ignore is not None else ()
+    stack = [(folder_path, rel, chain)]
+    while stack:
+        top, rel, chain = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(top) as it:
+                entries = list(it)
+        except OSError:
+            # os.walk silently skips directories it cannot list
+            continue
+
+        if ignore is not None:
+            chain = ignore.chain_for(top, rel, chain, {entry.name for entry in entries})
+        if dirs is not None:
+            dirs[top] = (rel, chain)
+
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            relpath = f"{rel}/{entry.name}" if rel else entry.name
+            if chain and ignore.ignored(chain, relpath, is_dir):
+                if stats is not None:
+                    if is_dir:
+                        stats.dirs_pruned += 1
+                    else:
+                        stats.entries_skipped += 1
+                continue
+
+            if is_dir:
+                # Like os.walk, list symlinked directories but don't follow them
+                if not entry.is_symlink():
+                    subdirs.append((entry.path, relpath, chain))
+            else:
+                yield entry
+
+        # Push in reverse so subdirectories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+
+class FileEntry:
+    """A path with the DirEntry attributes _read_entry() uses, for reading files the walk didn't list."""
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def _read_entry(entry, classifier, cache=None, stats=None):
+    """Classify, stat and read a single file, adding the time spent to stats if given.
+
+    Returns (size, content, from_cache) for readable text files, otherwise None.
+    """
+    started = time.perf_counter()
+    classify_seconds = 0.0
+    binary = error = False
+    try:
+        st = entry.stat()
+        if st.st_size > MAX_FILE_SIZE:
+            return None
+
+        # Unchanged files come straight from the cache without being opened
+        if cache is not None:
+            cached = cache.lookup(entry.path, st)
+            if cached is not None:
+                binary = not cached.is_text
+                return (st.st_size, cached.content, True) if cached.is_text else None
+
+        # Known extensions decide without opening the file; others are
+        # classified on the first bytes of the same read that loads them
+        verdict = classifier.extension_verdict(entry.path)
+        data = None
+        if verdict is not False:
+            with open(entry.path, 'rb') as f:
+                data = f.read()
+        if verdict is None:
+            classify_started = time.perf_counter()
+            verdict = classifier.classify(data)
+            classify_seconds = time.perf_counter() - classify_started
+        if not verdict:
+            binary = True
+            if cache is not None:
+                cache.store(entry.path, st, False)
+            return None
+
+        content = decode_text(data)
+        if cache is not None:
+            cache.store(entry.path, st, True, content)
+        return st.st_size, content, False
+    except Exception as e:
+        error = True
+        print(f"Error reading {entry.path}: {str(e)}")
+        return None
+    finally:
+        if stats is not None:
+            stats.add_file(time.perf_counter() - started - classify_seconds, classify_seconds, binary, error)
+
+
+def scan_files(folder_path, classifier=None, workers=DEFAULT_WORKERS, stats=None, cache=None, ignore=None):
+    """Yield (relative_path, content) for each readable text file under folder_path.
+
+    Files are classified and read on a bounded thread pool, but results are
+    yielded in the same order os.walk would visit them. Closing the generator
+    early cancels any reads that are still pending. When a FileCache is given,
+    unchanged files are served from it and only new or modified files are read.
+    Files are classified with classifier, a TextClassifier (the shared one by default).
+    Entries matched by ignore, an IgnoreFilter (.gitignore/.ignore files and the
+    default deny list unless given), are skipped without being stat'ed or read.
+    """
+    if classifier is None:
+        classifier = default_classifier
+    if ignore is None:
+        ignore = IgnoreFilter()
+    if stats is None:
+        stats = ScanStats()
+    if cache is not None:
+        cache.begin(folder_path)
+    complete = False
+
+    def results():
+        for entry in walk_entries(folder_path, ignore, stats):
+            stats.files_scanned += 1
+            yield entry, _read_entry(entry, classifier, cache, stats)
+
+    if workers <= 1:
+        # Serial path, useful as a baseline for comparison
+        pending = None
+        ordered = results()
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = deque()
+
+        def parallel():
+            # Keep a bounded window of reads in flight so memory stays flat
+            window = workers * 4
+            entries = walk_entries(folder_path, ignore, stats)
+            for entry in entries:
+                stats.files_scanned += 1
+                pending.append((entry, executor.submit(_read_entry, entry, classifier, cache, stats)))
+                if len(pending) >= window:
+                    done_entry, future = pending.popleft()
+                    yield done_entry, future.result()
+            while pending:
+                done_entry, future = pending.popleft()
+                yield done_entry, future.result()
+
+        ordered = parallel()
+
+    try:
+        for entry, result in ordered:
+            if result is None:
+                continue
+            size, content, from_cache = result
+            stats.files_read += 1
+            if from_cache:
+                stats.cache_hits += 1
+            else:
+                stats.bytes_read += size
+            yield os.path.relpath(entry.path, folder_path), content
+        complete = True
+    finally:
+        ordered.close()
+        if pending is not None:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+        if cache is not None:
+            cache.finish(complete)
+        stats.stop()
+
+
+def read_files(folder_path, relative_paths, classifier=None, cache=None, stats=None):
+    """Yield (relative_path, content) for each of relative_paths under folder_path, in order.
+
+    content is None for files that are gone, too large or not text. Used to
+    refresh a few changed files without walking the folder; unchanged files
+    are still served from the FileCache if one is given.
+    """
+    if classifier is None:
+        classifier = default_classifier
+    if stats is None:
+        stats = ScanStats()
+    if cache is not None:
+        cache.begin(folder_path)
+    try:
+        for relative_path in relative_paths:
+            stats.files_scanned += 1
+            path = os.path.join(folder_path, relative_path)
+            result = None
+            if os.path.isfile(path):
+                result = _read_entry(FileEntry(path), classifier, cache, stats)
+            if result is None:
+                yield relative_path, None
+                continue
+            size, content, from_cache = result
+            stats.files_read += 1
+            if from_cache:
+                stats.cache_hits += 1
+            else:
+                stats.bytes_read += size
+            yield relative_path, content
+    finally:
+        if cache is not None:
+            # Only some files were looked at, so nothing is dropped as removed
+            cache.finish(complete=False)
+        stats.stop()
+
+
+if __name__ == "__main__":
+    # Compare the serial and parallel scan paths, and the parallel path without
+    # any ignore rules: python scanner.py FOLDER [WORKERS]
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    parallel_workers = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_WORKERS
+    no_rules = IgnoreFilter(defaults=(), ignore_files=())
+
+    for label, count, rules in (("serial", 1, None),
+                                (f"parallel ({parallel_workers} workers)", parallel_workers, None),
+                                ("parallel, no ignore rules", parallel_workers, no_rules)):
+        run_stats = ScanStats()
+        for _ in scan_files(folder, workers=count, stats=run_stats, ignore=rules):
+            pass
+        print(f"{label}: {run_stats.summary()}")
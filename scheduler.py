@@ -0,0 +1,462 @@
+"""Scheduling API requests within the account's rate limits.
+
+Every request to the API goes through the Scheduler of the client making
+it, so concurrent questions, map-reduce shards and headless runs share one
+view of the limits instead of each finding them by failing:
+
+  - requests wait in a priority queue for one of `concurrency` slots, and
+    interactive ones are served before background work. A slot admits a
+    request: a stream gives it back as soon as its response has started,
+    so answers stream side by side however many there are, and only
+    requests being opened are limited
+  - the request and token budgets left, and when they refill, are read from
+    the anthropic-ratelimit-* headers of every response; a request that
+    wouldn't fit the remaining budget waits for the refill instead of
+    being sent to be refused
+  - concurrency adapts, like TCP's congestion window: it starts at
+    INITIAL_CONCURRENCY and grows by one with every success (slow start)
+    until the first 429 (rate limited) or 529 (overloaded). From then on it
+    is halved by each throttle and grows by one after as many successes as
+    there are slots
+  - throttled requests are retried after the server's retry-after, holding
+    back the whole queue meanwhile; server and connection errors are
+    retried with jittered exponential backoff. A stream is only retried
+    if it fails before the response starts.
+
+Clients are created with the SDK's own retries turned off (see clients.py),
+so retries happen here, outside the slots. Queue depth, active requests,
+wait times and retries are published in metrics.py.
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+
+import anthropic
+
+import metrics
+import tokens
+
+INTERACTIVE = 0  # Someone is watching the answer arrive
+BACKGROUND = 10  # Headless runs and batches, served once no interactive request is waiting
+
+INITIAL_CONCURRENCY = 2
+MAX_CONCURRENCY = 16
+MIN_CONCURRENCY = 1
+MAX_RETRIES = 6
+BASE_DELAY = 1.0  # Seconds before the first retry of a failed request, doubling with each one
+MAX_DELAY = 60.0
+THROTTLE_STATUSES = frozenset((429, 529))  # Rate limited or overloaded: slow everything down
+RETRY_STATUSES = THROTTLE_STATUSES | {500, 502, 503, 504}
+
+# (header kind, whether a request's input tokens count against it); requests count one each
+LIMIT_KINDS = (("requests", False), ("tokens", True), ("input-tokens", True), ("output-tokens", False))
+
+
+def _seconds_until(timestamp):
+    # Reset times are RFC 3339, e.g. 2025-01-01T00:00:30Z
+    if not timestamp:
+        return None
+    try:
+        reset = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=timezone.utc)
+    return max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def request_tokens(params):
+    """Estimate the input tokens of a Messages request from its system prompt and message text."""
+    count = tokens.estimate_tokens(params.get("system") or "")
+    for message in params.get("messages", ()):
+        content = message.get("content", "")
+        if isinstance(content, str):
+            count += tokens.estimate_tokens(content)
+            continue
+        for block in content:
+            count += tokens.estimate_tokens(block.get("text", ""))
+    return count
+
+
+class RateLimits:
+    """The request and token budgets left, from the anthropic-ratelimit-* response headers."""
+
+    def __init__(self):
+        self.remaining = {}  # kind -> count left
+        self.reset_at = {}  # kind -> time.monotonic() when it refills
+
+    def update(self, headers):
+        """Record the budgets reported in a response's headers."""
+        now = time.monotonic()
+        for kind, _ in LIMIT_KINDS:
+            remaining = headers.get(f"anthropic-ratelimit-{kind}-remaining")
+            if remaining is None:
+                continue
+            try:
+                self.remaining[kind] = int(remaining)
+            except ValueError:
+                continue
+            reset = _seconds_until(headers.get(f"anthropic-ratelimit-{kind}-reset"))
+            self.reset_at[kind] = now + (reset or 0.0)
+
+    def delay(self, input_tokens, now):
+        """Return the seconds until a request of input_tokens fits every budget; 0 if it fits now."""
+        wait = 0.0
+        for kind, counts_input in LIMIT_KINDS:
+            remaining = self.remaining.get(kind)
+            needed = input_tokens if counts_input else 1
+            if remaining is None or remaining >= needed:
+                continue
+            # Once the reset time has passed the budget has refilled, whatever was last reported
+            wait = max(wait, self.reset_at.get(kind, now) - now)
+        return wait
+
+    def reserve(self, input_tokens):
+        """Count a request about to be sent against the budgets, until its response reports them."""
+        for kind, counts_input in LIMIT_KINDS:
+            if kind in self.remaining and kind != "output-tokens":
+                self.remaining[kind] -= input_tokens if counts_input else 1
+
+
+class _Waiter:
+    """A request waiting for a slot; ordered by priority, then by when it first asked."""
+    __slots__ = ("priority", "seq", "tokens", "enqueued", "granted")
+
+    def __init__(self, priority, seq, tokens):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _ThreadWaiter(_Waiter):
+    __slots__ = ("event",)
+
+    def __init__(self, priority, seq, tokens):
+        super().__init__(priority, seq, tokens)
+        self.event = threading.Event()
+
+    def wake(self):
+        self.event.set()
+
+
+class _AsyncWaiter(_Waiter):
+    __slots__ = ("loop", "future")
+
+    def __init__(self, priority, seq, tokens, loop):
+        super().__init__(priority, seq, tokens)
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def wake(self):
+        # Slots are granted on whichever thread released one
+        self.loop.call_soon_threadsafe(self._set)
+
+    def _set(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Scheduler:
+    """Admits API requests within the rate limits, adapting concurrency and retrying failures.
+
+    Use stream() and astream() around client.messages.stream(), and call()
+    for requests that don't stream. Thread-safe; the async methods can be
+    used from any event loop.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, min_concurrency=MIN_CONCURRENCY, max_retries=MAX_RETRIES,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY, initial_concurrency=INITIAL_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.concurrency = max(min_concurrency, min(initial_concurrency, max_concurrency))
+        self.slow_start = True  # Until the first throttle, every success adds a slot
+        self.active = 0
+        self.limits = RateLimits()
+        self.blocked_until = 0.0  # time.monotonic() before which nothing is sent, after a throttle
+        self.throttled = 0
+        self.retries = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+        self._successes = 0
+        self._timer = None
+        self._timer_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        """Return the queue depth, slots, budgets and wait times as a dict."""
+        with self._lock:
+            return {
+                "queue_depth": len(self._queue),
+                "active": self.active,
+                "concurrency": self.concurrency,
+                "slow_start": self.slow_start,
+                "remaining": dict(self.limits.remaining),
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "mean_wait_seconds": self.wait_seconds / self.waits if self.waits else 0.0,
+            }
+
+    def _enqueue(self, waiter):
+        with self._lock:
+            heapq.heappush(self._queue, waiter)
+            metrics.QUEUE_DEPTH.inc()
+            self._dispatch()
+
+    def _dispatch(self):
+        # Called with the lock held: grant slots in priority order while the limits allow
+        now = time.monotonic()
+        while self._queue and self.active < self.concurrency:
+            head = self._queue[0]
+            wait = max(self.blocked_until - now, self.limits.delay(head.tokens, now))
+            if wait > 0:
+                self._dispatch_at(now + wait)
+                return
+            heapq.heappop(self._queue)
+            metrics.QUEUE_DEPTH.dec()
+            self.active += 1
+            metrics.ACTIVE_REQUESTS.inc()
+            self.limits.reserve(head.tokens)
+            waited = now - head.enqueued
+            self.waits += 1
+            self.wait_seconds += waited
+            metrics.QUEUE_WAIT_SECONDS.observe(waited)
+            head.granted = True
+            head.wake()
+
+    def _dispatch_at(self, when):
+        if self._timer is not None and self._timer_at <= when:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(0.0, when - time.monotonic()), self._on_timer)
+        self._timer.daemon = True
+        self._timer_at = when
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def acquire(self, priority=INTERACTIVE, input_tokens=0, seq=None):
+        """Block until a slot is free for a request of about input_tokens, and return it."""
+        waiter = _ThreadWaiter(priority, next(self._seq) if seq is None else seq, input_tokens)
+        self._enqueue(waiter)
+        waiter.event.wait()
+        return waiter
+
+    async def acquire_async(self, priority=INTERACTIVE, input_tokens=0, seq=None):
+        """acquire() for coroutines; cancelling the wait gives up the place in the queue."""
+        waiter = _AsyncWaiter(priority, next(self._seq) if seq is None else seq, input_tokens,
+                              asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError as e:
+            with self._lock:
+                if waiter.granted:
+                    # The slot was granted as the wait was cancelled
+                    self._release_locked(e)
+                else:
+                    self._queue.remove(waiter)
+                    heapq.heapify(self._queue)
+                    metrics.QUEUE_DEPTH.dec()
+            raise
+        return waiter
+
+    def release(self, waiter, error=None, headers=None):
+        """Give back a slot, learning from the response headers and how the request went.
+
+        error is the exception the request failed with, if it did. Only a
+        throttle (429/529) shrinks concurrency, and only successes grow it:
+        by one each during slow start, by one per round of slots after.
+        """
+        with self._lock:
+            if headers is not None:
+                self.limits.update(headers)
+            self._release_locked(error)
+
+    def _release_locked(self, error):
+        self.active -= 1
+        metrics.ACTIVE_REQUESTS.dec()
+        if getattr(error, "status_code", None) in THROTTLE_STATUSES:
+            self.throttled += 1
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            self.slow_start = False
+            self._successes = 0
+        elif error is None:
+            self._successes += 1
+            if self.slow_start:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self._successes = 0
+            elif self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._successes = 0
+        self._dispatch()
+
+    def _retry_delay(self, waiter, error, attempt):
+        """Release a failed request's slot; return the seconds to wait before retrying, or None to give up."""
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None)
+        retryable = status in RETRY_STATUSES or isinstance(error, anthropic.APIConnectionError)
+        if not retryable or attempt >= self.max_retries:
+            self.release(waiter, error, response.headers if response is not None else None)
+            return None
+
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        # Jitter spreads out the retries of requests that failed together
+        delay = random.uniform(backoff / 2, backoff)
+        throttled = status in THROTTLE_STATUSES
+        if throttled:
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, self.base_delay)
+        metrics.RETRIES.inc(reason="throttled" if throttled else "error")
+        with self._lock:
+            self.retries += 1
+            if throttled:
+                # Hold back the whole queue, not just this request. This is set before the slot is
+                # given back, so the release can't hand it straight to another request
+                self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            if response is not None:
+                self.limits.update(response.headers)
+            self._release_locked(error)
+        return 0.0 if throttled else delay
+
+    @contextmanager
+    def stream(self, client, priority=INTERACTIVE, **params):
+        """Open client.messages.stream(**params) in a slot, retrying until the response starts.
+
+        Use like client.messages.stream(): the MessageStream is yielded.
+        The slot is given back once the response has started, so the answer
+        streams without holding up the queue.
+        """
+        input_tokens = request_tokens(params)
+        seq = next(self._seq)
+        attempt = 0
+        while True:
+            waiter = self.acquire(priority, input_tokens, seq)
+            manager = client.messages.stream(**params)
+            try:
+                message_stream = manager.__enter__()
+                break
+            except Exception as e:
+                delay = self._retry_delay(waiter, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+        self.release(waiter, None, message_stream.response.headers)
+        try:
+            yield message_stream
+        finally:
+            manager.__exit__(None, None, None)
+
+    @asynccontextmanager
+    async def astream(self, client, priority=INTERACTIVE, **params):
+        """stream() for an AsyncAnthropic client."""
+        input_tokens = request_tokens(params)
+        seq = next(self._seq)
+        attempt = 0
+        while True:
+            waiter = await self.acquire_async(priority, input_tokens, seq)
+            manager = client.messages.stream(**params)
+            try:
+                message_stream = await manager.__aenter__()
+                break
+            except Exception as e:
+                delay = self._retry_delay(waiter, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+            except BaseException as e:
+                # Cancelled while connecting
+                self.release(waiter, e)
+                raise
+
+        self.release(waiter, None, message_stream.response.headers)
+        try:
+            yield message_stream
+        finally:
+            await manager.__aexit__(None, None, None)
+
+    def call(self, func, *args, priority=INTERACTIVE, **kwargs):
+        """Return func(*args, **kwargs), a request that doesn't stream, made in a slot with retries."""
+        seq = next(self._seq)
+        attempt = 0
+        while True:
+            waiter = self.acquire(priority, 0, seq)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(waiter, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.release(waiter)
+            return result
+
+
+_schedulers = weakref.WeakKeyDictionary()
+_schedulers_lock = threading.Lock()
+
+
+def for_client(client):
+    """Return the Scheduler shared by every request made with client.
+
+    A ClientRegistry keeps one client per API key, so this is one scheduler
+    per key, matching how the API applies its limits.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(client)
+        if scheduler is None:
+            scheduler = _schedulers[client] = Scheduler()
+        return scheduler
+
+
+def stream(client, priority=INTERACTIVE, **params):
+    """Open client.messages.stream(**params) through the client's Scheduler."""
+    return for_client(client).stream(client, priority, **params)
+
+
+def astream(client, priority=INTERACTIVE, **params):
+    """Open an AsyncAnthropic client.messages.stream(**params) through the client's Scheduler."""
+    return for_client(client).astream(client, priority, **params)
+
+
+def call(client, func, *args, priority=INTERACTIVE, **kwargs):
+    """Return func(*args, **kwargs), a request made with client, through the client's Scheduler."""
+    return for_client(client).call(func, *args, priority=priority, **kwargs)
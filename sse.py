@@ -0,0 +1,368 @@
+"""Server-Sent Events for streamed answers: coalesced frames, event IDs, resume and compression.
+
+An answer is generated into an AnswerStream, which keeps every event it
+produced. Connections render the stream as SSE frames, so generation
+carries on if the browser's connection drops, and the EventSource
+reconnects with the ID of the last frame it got (Last-Event-ID) and is
+sent only what came after it.
+
+Consecutive text chunks are merged into one frame per COALESCE_SECONDS
+window, or sooner once MAX_FRAME_CHARS are waiting, instead of a frame
+and a write per delta; other events go out as soon as they happen. A
+stream nobody has been reading for RESUME_GRACE seconds stops generating,
+and finished streams are kept for REPLAY_TTL seconds.
+"""
+import asyncio
+import json
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+COALESCE_SECONDS = 0.04
+MAX_FRAME_CHARS = 16 * 1024
+RETRY_MS = 1000  # How soon the browser reconnects after a dropped connection
+RESUME_GRACE = 30.0  # Seconds an unread stream keeps generating, waiting for its client to reconnect
+REPLAY_TTL = 5 * 60  # Seconds a finished stream can still be resumed
+MAX_STREAMS = 1000
+
+
+class StreamGone(Exception):
+    """Raised when generation stops because the stream was stopped, being abandoned or evicted."""
+
+
+def _is_chunk(event):
+    return len(event) == 1 and 'chunk' in event
+
+
+class AnswerStream:
+    """The events of one answer, in order, for any number of readers. Thread-safe.
+
+    The generator appends with append() and calls finish() at the end;
+    readers wait for events with wait_batch() or wait_batch_async().
+    """
+
+    def __init__(self, stream_id, owner):
+        self.id = stream_id
+        self.owner = owner
+        self.events = []
+        self.finished = False
+        self.finished_at = None
+        self.readers = 0
+        self.last_read = time.monotonic()
+        self.stopped = False
+        self.task = None  # The asyncio task generating the stream, so it isn't garbage collected
+        self._chars = [0]  # Characters of chunk text in events[:i]
+        self._last_control = -1  # Index of the last event that isn't a text chunk
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+    def append(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._chars.append(self._chars[-1] + (len(event['chunk']) if _is_chunk(event) else 0))
+            if not _is_chunk(event):
+                self._last_control = len(self.events) - 1
+            self._notify()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def _notify(self):
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def attach(self):
+        with self._cond:
+            self.readers += 1
+
+    def detach(self):
+        with self._cond:
+            self.readers -= 1
+            self.last_read = time.monotonic()
+            if self.readers == 0 and not self.finished:
+                self._watch(RESUME_GRACE)
+
+    def abandoned(self):
+        """True once no reader has been attached for RESUME_GRACE seconds."""
+        return self.readers == 0 and time.monotonic() - self.last_read >= RESUME_GRACE
+
+    def _watch(self, delay):
+        # Check for abandonment on a timer, rather than when the generator next produces something
+        try:
+            asyncio.get_running_loop().call_later(delay, self._check_abandoned)
+        except RuntimeError:
+            timer = threading.Timer(delay, self._check_abandoned)
+            timer.daemon = True
+            timer.start()
+
+    def _check_abandoned(self):
+        with self._cond:
+            if self.finished or self.readers:
+                return
+            remaining = RESUME_GRACE - (time.monotonic() - self.last_read)
+            if remaining > 0:
+                # A client came back and left again since the timer was set
+                self._watch(remaining)
+                return
+        self.stop()
+
+    def stop(self):
+        """Stop generating: cancels the task, or has run() stop at the next event."""
+        with self._cond:
+            if self.finished:
+                return
+            self.stopped = True
+            task = self.task
+        if task is not None:
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def _ready(self, after):
+        return self.finished or len(self.events) > after
+
+    def _batch_ready(self, after, max_chars):
+        # A batch goes out early once it ends the stream, holds another kind of event, or is big enough
+        return (self.finished or self._last_control >= after
+                or self._chars[len(self.events)] - self._chars[after] >= max_chars)
+
+    def wait_batch(self, after, window=COALESCE_SECONDS, max_chars=MAX_FRAME_CHARS):
+        """Wait for events after index after, then up to window seconds for more. Returns the end index."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._ready(after))
+            self._cond.wait_for(lambda: self._batch_ready(after, max_chars), timeout=window)
+            self.last_read = time.monotonic()
+            return len(self.events)
+
+    async def wait_batch_async(self, after, window=COALESCE_SECONDS, max_chars=MAX_FRAME_CHARS):
+        """wait_batch() for coroutines."""
+        await self._wait_async(lambda: self._ready(after))
+        await self._wait_async(lambda: self._batch_ready(after, max_chars), window)
+        with self._cond:
+            self.last_read = time.monotonic()
+            return len(self.events)
+
+    async def _wait_async(self, predicate, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self._cond:
+                if predicate():
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def render(self, start, end):
+        """Return the SSE frames for events[start:end], with consecutive text chunks merged."""
+        frames = []
+        text = []
+        for index in range(start, end):
+            event = self.events[index]
+            if _is_chunk(event):
+                text.append(event['chunk'])
+                if index + 1 < end and _is_chunk(self.events[index + 1]):
+                    continue
+                event = {'chunk': ''.join(text)}
+                text = []
+            # The ID counts the events delivered, so a reconnect says where to pick up
+            frames.append(f"id: {self.id}:{index + 1}\ndata: {json.dumps(event)}\n\n")
+        return "".join(frames)
+
+    def run(self, events):
+        """Append every event from an iterator, then finish. Stops early if the stream is stopped."""
+        try:
+            for event in events:
+                self.append(event)
+                if self.stopped:
+                    raise StreamGone()
+        except StreamGone:
+            pass
+        except Exception as e:
+            self.append({'error': f'Error: {str(e)}'})
+        finally:
+            close = getattr(events, 'close', None)
+            if close is not None:
+                close()
+            self.finish()
+
+    async def run_async(self, events):
+        """run() for an async iterator of events. Cancelling the task stops it like stop() does."""
+        try:
+            async for event in events:
+                self.append(event)
+                if self.stopped:
+                    raise StreamGone()
+        except StreamGone:
+            pass
+        except Exception as e:
+            self.append({'error': f'Error: {str(e)}'})
+        finally:
+            await events.aclose()
+            self.finish()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def frames(stream, after=0, window=COALESCE_SECONDS, max_chars=MAX_FRAME_CHARS):
+    """Yield stream's events after index after as SSE text, until the stream has finished."""
+    stream.attach()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            end = stream.wait_batch(after, window, max_chars)
+            if end > after:
+                yield stream.render(after, end)
+                after = end
+            elif stream.finished:
+                return
+    finally:
+        stream.detach()
+
+
+async def frames_async(stream, after=0, window=COALESCE_SECONDS, max_chars=MAX_FRAME_CHARS):
+    """frames() for coroutines."""
+    stream.attach()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            end = await stream.wait_batch_async(after, window, max_chars)
+            if end > after:
+                yield stream.render(after, end)
+                after = end
+            elif stream.finished:
+                return
+    finally:
+        stream.detach()
+
+
+def accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header value allows gzip."""
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class Gzipper:
+    """Compresses a stream of frames, flushing after each so the browser gets it at once.
+
+    Frames share one compression window, so the repetitive JSON framing
+    compresses well even though each flush is small.
+    """
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        return self._compressor.flush()
+
+
+def encode(frames, gzip=False):
+    """Yield SSE text from frames as bytes, gzip-compressed if gzip is set."""
+    gzipper = Gzipper() if gzip else None
+    try:
+        for text in frames:
+            data = text.encode('utf-8')
+            yield gzipper.compress(data) if gzipper else data
+        if gzipper:
+            yield gzipper.close()
+    finally:
+        # Let go of the stream even if the client leaves mid-answer
+        frames.close()
+
+
+async def encode_async(frames, gzip=False):
+    """encode() for async iterators."""
+    gzipper = Gzipper() if gzip else None
+    try:
+        async for text in frames:
+            data = text.encode('utf-8')
+            yield gzipper.compress(data) if gzipper else data
+        if gzipper:
+            yield gzipper.close()
+    finally:
+        await frames.aclose()
+
+
+def response_headers(gzip=False):
+    """Headers for an event stream response, keeping proxies from buffering or caching it."""
+    headers = [('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no'), ('Vary', 'Accept-Encoding')]
+    if gzip:
+        headers.append(('Content-Encoding', 'gzip'))
+    return headers
+
+
+def parse_event_id(event_id):
+    """Split a Last-Event-ID header into (stream ID, events received), or None if it isn't one of ours."""
+    stream_id, _, count = (event_id or "").rpartition(":")
+    if not stream_id or not count.isdigit():
+        return None
+    return stream_id, int(count)
+
+
+class StreamRegistry:
+    """The answer streams that can be read or resumed, by ID.
+
+    Finished streams are dropped REPLAY_TTL seconds after they end. Past
+    max_streams the oldest finished or abandoned stream goes; only when every
+    stream is still being read is the oldest of those stopped and dropped.
+    """
+
+    def __init__(self, max_streams=MAX_STREAMS, replay_ttl=REPLAY_TTL):
+        self.max_streams = max_streams
+        self.replay_ttl = replay_ttl
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._streams)
+
+    def start(self, owner):
+        """Create a stream read by owner (e.g. the session's context ID)."""
+        stream = AnswerStream(secrets.token_urlsafe(12), owner)
+        with self._lock:
+            self._evict()
+            self._streams[stream.id] = stream
+        return stream
+
+    def resume(self, last_event_id, owner):
+        """Return (stream, events already received) for a Last-Event-ID, or None if it can't be resumed."""
+        parsed = parse_event_id(last_event_id)
+        if parsed is None:
+            return None
+        stream_id, received = parsed
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None or stream.owner != owner or received > len(stream.events):
+            return None
+        return stream, received
+
+    def _evict(self):
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.finished and now - stream.finished_at > self.replay_ttl:
+                del self._streams[stream_id]
+        while len(self._streams) >= self.max_streams:
+            stream_id = next((stream_id for stream_id, stream in self._streams.items()
+                              if stream.finished or stream.abandoned()), next(iter(self._streams)))
+            # Don't leave a generator running for a stream no one can reach any more
+            self._streams.pop(stream_id).stop()
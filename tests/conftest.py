@@ -0,0 +1,26 @@
+"""Shared test setup: the repository and benchmarks/ importable, and mock API servers that shut down."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+
+@pytest.fixture
+def mock_api():
+    """Return a function starting a mock API server, as mock_api.start_mock_server() does."""
+    from mock_api import start_mock_server
+
+    servers = []
+
+    def start(config=None, handler=None):
+        server, base_url = start_mock_server(config) if handler is None else start_mock_server(config, handler=handler)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,87 @@
+"""run_batches() and batch polling against the mock API, including while it answers 429."""
+import pytest
+
+import batches
+import scheduler
+from clients import make_client
+from mock_api import MockConfig, MockHandler
+from pipeline import new_context
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+
+class ThrottlingBatchHandler(MockHandler):
+    """Answers 429 to the first GETs of each batch endpoint, until refusals runs out."""
+    refusals = {}  # "retrieve" or "results" -> GETs still to refuse; each server gets its own
+
+    def do_GET(self):
+        kind = "results" if self.path.split("?", 1)[0].endswith("/results") else "retrieve"
+        if self.refusals.get(kind):
+            self.refusals[kind] -= 1
+            error = {"type": "rate_limit_error", "message": "Mock throttled the request"}
+            return self._send_json({"type": "error", "error": error}, 429, {"retry-after": "0"})
+        return super().do_GET()
+
+
+def _context():
+    context = new_context(MODEL, 1024)
+    context.add_file("app.py", "def main():\n    return 42\n")
+    return context
+
+
+def _client(base_url):
+    client = make_client("test-key").with_options(base_url=base_url)
+    sched = scheduler.for_client(client)
+    sched.base_delay = 0.01
+    sched.max_delay = 0.1
+    return client
+
+
+def test_run_batches_answers_in_question_order(mock_api):
+    _, base_url = mock_api(MockConfig(answer_tokens=3, batch_seconds=0.2))
+    submitted = []
+    results = batches.run_batches(_client(base_url), _context(), ["a", "b", "c"], MODEL, 64,
+                                  on_submit=submitted.append, initial_delay=0.05)
+
+    assert len(submitted) == 1
+    assert [result["batch_id"] for result in results] == submitted * 3
+    assert all(result["answer"] == "token token token " for result in results)
+    assert all(result["usage"]["output_tokens"] == 3 for result in results)
+
+
+def test_run_batches_splits_large_question_sets(mock_api, monkeypatch):
+    split_requests = batches.split_requests
+    monkeypatch.setattr(batches, "split_requests", lambda requests: split_requests(requests, max_requests=2))
+    _, base_url = mock_api(MockConfig(answer_tokens=1, batch_seconds=0.1))
+    submitted = []
+    results = batches.run_batches(_client(base_url), _context(), ["a", "b", "c", "d", "e"], MODEL, 64,
+                                  on_submit=submitted.append, initial_delay=0.05)
+
+    assert len(submitted) == 3
+    assert [result["batch_id"] for result in results] == [submitted[0]] * 2 + [submitted[1]] * 2 + [submitted[2]]
+
+
+def test_polling_and_results_are_retried_through_429(mock_api):
+    handler = type("Handler", (ThrottlingBatchHandler,), {"refusals": {"retrieve": 3, "results": 1}})
+    server, base_url = mock_api(MockConfig(answer_tokens=2, batch_seconds=0.1), handler)
+    client = _client(base_url)
+    results = batches.run_batches(client, _context(), ["a", "b"], MODEL, 64, initial_delay=0.05)
+
+    assert all(result["answer"] == "token token " for result in results)
+    assert server.RequestHandlerClass.refusals == {"retrieve": 0, "results": 0}
+    assert scheduler.for_client(client).throttled == 4
+
+
+def test_wait_for_batch_times_out(mock_api):
+    _, base_url = mock_api(MockConfig(batch_seconds=60))
+    client = _client(base_url)
+    batch = client.messages.batches.create(requests=batches.batch_requests(_context(), ["a"], MODEL, 64))
+    delays = []
+    with pytest.raises(TimeoutError):
+        batches.wait_for_batch(client, batch.id, initial_delay=1.0, timeout=0.0, sleep=delays.append)
+    assert delays == []
+
+    with pytest.raises(TimeoutError):
+        batches.wait_for_batch(client, batch.id, initial_delay=0.01, max_delay=0.02, timeout=0.05,
+                               sleep=delays.append)
+    assert delays and max(delays) <= 0.02
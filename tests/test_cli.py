@@ -0,0 +1,46 @@
+"""cli.run() against the mock API: every question about every folder, with only a few folders loaded at once."""
+import io
+import json
+import threading
+import weakref
+
+import cli
+from clients import make_client
+from filecache import FileCache
+from mock_api import MockConfig
+
+
+def test_run_holds_at_most_parallel_folders(mock_api, tmp_path, monkeypatch):
+    _, base_url = mock_api(MockConfig(ttft=0.01, answer_tokens=8, tokens_per_sec=2000))
+    repos = []
+    for i in range(6):
+        repo = tmp_path / f"repo{i}"
+        repo.mkdir()
+        (repo / "main.py").write_text(f"def main():\n    return {i}\n")
+        repos.append(str(repo))
+
+    live = weakref.WeakSet()
+    peak = [0]
+    lock = threading.Lock()
+    load_repo = cli.load_repo
+
+    def tracked_load_repo(*args):
+        context, stats = load_repo(*args)
+        with lock:
+            live.add(context)
+            peak[0] = max(peak[0], len(live))
+        return context, stats
+
+    monkeypatch.setattr(cli, "load_repo", tracked_load_repo)
+    monkeypatch.setattr(cli, "FileCache", lambda: FileCache(str(tmp_path / "filecache.sqlite3")))
+    out = io.StringIO()
+    client = make_client("test-key").with_options(base_url=base_url)
+    failed = cli.run(repos, ["What does main return?", "Which files are there?"], client, cli.DEFAULT_MODEL,
+                     256, 2, out)
+
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert failed == 0
+    assert len([record for record in records if "answer" in record]) == 12
+    assert {record["repo"] for record in records if "loaded_files" in record} == set(repos)
+    # One folder may load while the last answers of another are being written
+    assert peak[0] <= 3
@@ -0,0 +1,66 @@
+"""ContextBuilder limits, and keeping them right as files are replaced and removed."""
+from contextbuilder import ContextBuilder
+from conversation import Conversation
+from pipeline import refresh_files
+from ranking import FileCorpus
+
+
+def _fill(context, sizes):
+    for i, size in enumerate(sizes):
+        if not context.add_file(f"f{i}.txt", "x" * size):
+            break
+
+
+def test_removing_the_cut_short_file_clears_truncated():
+    context = ContextBuilder(max_size=1000)
+    _fill(context, [300, 300, 600])
+    assert context.truncated and context.segment("f2.txt").truncated
+
+    context.remove_file("f2.txt")
+    assert not context.truncated
+    assert not context.overflowed
+    assert context.add_file("f3.txt", "y" * 100)
+
+
+def test_removing_another_file_keeps_truncated():
+    context = ContextBuilder(max_size=1000)
+    _fill(context, [300, 300, 600])
+    context.remove_file("f0.txt")
+    assert context.truncated
+
+
+def test_a_file_left_out_keeps_truncated():
+    context = ContextBuilder(max_size=1000)
+    _fill(context, [450, 450, 300])
+    assert context.truncated and context.files == ["f0.txt", "f1.txt"]
+
+    context.remove_file("f1.txt")
+    assert context.truncated
+
+
+def test_replacing_a_file_keeps_truncated_in_step():
+    context = ContextBuilder(max_size=1000)
+    _fill(context, [300, 300, 600])
+    assert context.replace_file("f0.txt", "z" * 100)
+    assert context.truncated
+
+    context.clear()
+    assert not context.truncated
+
+
+def test_refresh_repacks_once_the_cut_short_file_is_gone(tmp_path):
+    context = ContextBuilder(max_size=1000)
+    corpus = FileCorpus()
+    for name, size in (("a.txt", 300), ("b.txt", 800), ("c.txt", 200)):
+        corpus.add_file(name, "x" * size)
+        if not context.truncated:
+            context.add_file(name, "x" * size)
+    context.corpus = corpus
+    assert context.segment("b.txt").truncated and context.segment("c.txt") is None
+
+    # b.txt is gone from the folder
+    updated, removed = refresh_files(str(tmp_path), ["b.txt"], Conversation(context), corpus)
+
+    assert removed == ["b.txt"]
+    assert context.files == ["a.txt", "c.txt"]
+    assert not context.truncated
@@ -0,0 +1,42 @@
+"""Conversation history: trimming to the budget and the messages sent with each question."""
+from conversation import Conversation
+from pipeline import new_context
+from prompts import QUESTION_PREFIX
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+
+def _conversation():
+    context = new_context(MODEL, 1024)
+    context.add_file("app.py", "def main():\n    return 42\n")
+    conversation = Conversation(context)
+    for i in range(3):
+        conversation.add_turn(f"old question {i} " + "word " * 50, f"old answer {i} " + "word " * 50, context)
+    return conversation
+
+
+def test_trimming_history_keeps_the_new_question():
+    conversation = _conversation()
+    messages = conversation.messages("NEW QUESTION", conversation.pinned, history_budget=100)
+
+    assert conversation.omitted > 0
+    assert messages[-1]["role"] == "user"
+    assert messages[-1]["content"][-1]["text"] in ("NEW QUESTION", QUESTION_PREFIX + "NEW QUESTION")
+    assert not any("old question 0" in block["text"] for message in messages for block in message["content"])
+
+
+def test_trimming_history_releases_its_memory():
+    conversation = _conversation()
+    before = conversation.history_nbytes
+    conversation.messages("NEW QUESTION", conversation.pinned, history_budget=100)
+
+    assert 0 <= conversation.history_nbytes < before
+    assert len(conversation.turns) + conversation.omitted == 3
+
+
+def test_follow_up_is_sent_after_the_history():
+    conversation = _conversation()
+    messages = conversation.messages("NEW QUESTION", conversation.pinned)
+
+    assert [message["role"] for message in messages] == ["user", "assistant"] * 3 + ["user"]
+    assert messages[-1]["content"][-1]["text"] == "NEW QUESTION"
@@ -0,0 +1,135 @@
+"""Scheduler tests, against the mock API answering 429 (rate limited) and 529 (overloaded)."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import scheduler
+from clients import make_async_client, make_client
+from mock_api import MockConfig
+
+MODEL = "claude-3-7-sonnet-20250219"
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def _error(status, retry_after=None):
+    # Just what the scheduler reads from an anthropic.APIStatusError
+    headers = {} if retry_after is None else {"retry-after": str(retry_after)}
+    return SimpleNamespace(status_code=status, response=SimpleNamespace(headers=headers))
+
+
+def _fast_retries(sched):
+    sched.base_delay = 0.01
+    sched.max_delay = 0.2
+    sched.max_retries = 20
+    return sched
+
+
+def test_slow_start_grows_concurrency_until_the_first_throttle():
+    sched = scheduler.Scheduler(initial_concurrency=2, max_concurrency=8)
+    for _ in range(3):
+        sched.release(sched.acquire())
+    assert sched.concurrency == 5 and sched.slow_start
+
+    sched.release(sched.acquire(), _error(429))
+    assert sched.concurrency == 2 and not sched.slow_start
+
+    # After slow start it takes a round of successes, one per slot, to add a slot
+    sched.release(sched.acquire())
+    assert sched.concurrency == 2
+    sched.release(sched.acquire())
+    assert sched.concurrency == 3
+
+
+def test_throttle_holds_back_the_queue_before_the_slot_is_released():
+    sched = scheduler.Scheduler(initial_concurrency=1, max_concurrency=1)
+    throttled = sched.acquire()
+    granted = threading.Event()
+    thread = threading.Thread(target=lambda: (sched.acquire(), granted.set()), daemon=True)
+    thread.start()
+    while sched.queue_depth == 0:
+        time.sleep(0.001)
+
+    sched.base_delay = 0.0
+    assert sched._retry_delay(throttled, _error(429, retry_after=0.3), 0) == 0.0
+    # The freed slot isn't handed to the next request until retry-after has passed
+    assert not granted.wait(0.1)
+    assert granted.wait(2)
+
+
+def test_requests_past_the_concurrency_limit_are_retried(mock_api):
+    server, base_url = mock_api(MockConfig(ttft=0.05, answer_tokens=4, max_concurrent=2, retry_after=0))
+    client = make_client("test-key").with_options(base_url=base_url)
+    sched = _fast_retries(scheduler.for_client(client))
+
+    def ask(i):
+        return scheduler.call(client, client.messages.create, model=MODEL, max_tokens=16, messages=MESSAGES)
+
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        messages = list(executor.map(ask, range(24)))
+
+    throttle = server.RequestHandlerClass.throttle
+    assert all(message.content[0].text for message in messages)
+    assert throttle.refused > 0
+    assert sched.throttled == throttle.refused
+    assert not sched.slow_start and sched.concurrency < sched.max_concurrency
+    assert sched.stats()["active"] == 0 and sched.queue_depth == 0
+
+
+def test_overloaded_streams_are_retried(mock_api):
+    server, base_url = mock_api(MockConfig(ttft=0.01, answer_tokens=8, tokens_per_sec=10000, overload_ratio=0.3))
+    client = make_client("test-key").with_options(base_url=base_url)
+    sched = _fast_retries(scheduler.for_client(client))
+
+    def ask(i):
+        with scheduler.stream(client, model=MODEL, max_tokens=16, messages=MESSAGES) as stream:
+            return stream.get_final_text()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        answers = list(executor.map(ask, range(20)))
+
+    throttle = server.RequestHandlerClass.throttle
+    assert all(answers)
+    assert sched.throttled == throttle.overloaded > 0
+    assert sched.retries == throttle.overloaded
+
+
+def test_async_streams_share_the_rate_limits(mock_api):
+    server, base_url = mock_api(MockConfig(ttft=0.05, answer_tokens=8, tokens_per_sec=10000, requests_per_window=6,
+                                           window=0.5, max_concurrent=3, retry_after=0))
+    client = make_async_client("test-key").with_options(base_url=base_url)
+    sched = _fast_retries(scheduler.for_client(client))
+
+    async def ask():
+        async with scheduler.astream(client, model=MODEL, max_tokens=16, messages=MESSAGES) as stream:
+            return await stream.get_final_text()
+
+    async def main():
+        return await asyncio.gather(*(ask() for _ in range(15)))
+
+    answers = asyncio.run(main())
+    throttle = server.RequestHandlerClass.throttle
+    assert len(answers) == 15 and all(answers)
+    assert throttle.peak_active <= 3
+    assert sched.throttled == throttle.refused
+
+
+def test_time_to_first_token_does_not_grow_with_concurrent_streams(mock_api):
+    _, base_url = mock_api(MockConfig(ttft=0.2, answer_tokens=100, tokens_per_sec=100))
+
+    async def ask(client, started):
+        async with scheduler.astream(client, model=MODEL, max_tokens=16, messages=MESSAGES) as stream:
+            async for _ in stream.text_stream:
+                return asyncio.get_running_loop().time() - started
+
+    async def first_tokens(count):
+        # A client, and so a scheduler, of its own, starting cold each time
+        client = make_async_client("test-key").with_options(base_url=base_url)
+        started = asyncio.get_running_loop().time()
+        return await asyncio.gather(*(ask(client, started) for _ in range(count)))
+
+    few = asyncio.run(first_tokens(4))
+    many = asyncio.run(first_tokens(40))
+    # Each answer takes a second to stream; a slot held for all of it would queue the rest behind it
+    assert max(many) < max(few) + 0.5
@@ -0,0 +1,120 @@
+"""Token estimates and per-model context budgets."""
+import os
+import threading
+
+import scheduler
+from filecache import content_hash
+
+DEFAULT_CONTEXT_WINDOW = 200000
+
+# Context window per model, in tokens. Edit to change the budget for a model.
+MODEL_CONTEXT_WINDOWS = {
+    "claude-3-7-sonnet-20250219": 200000,
+    "claude-3-5-sonnet-20240620": 200000,
+    "claude-3-opus-20240229": 200000,
+    "claude-3-5-haiku-20240307": 200000,
+}
+
+# Room left for the system prompt, instructions and the question itself
+PROMPT_OVERHEAD_TOKENS = 2048
+
+# Room kept free for the earlier questions and answers of a conversation
+HISTORY_TOKENS = 16384
+
+# Average characters per token for ASCII text, by file type. Prose packs
+# more characters into a token than code; punctuation-heavy data fewer.
+DEFAULT_CHARS_PER_TOKEN = 3.3
+CHARS_PER_TOKEN = {
+    '.txt': 4.0, '.md': 3.9, '.rst': 3.9, '.log': 3.4,
+    '.py': 3.4, '.rb': 3.4, '.lua': 3.4, '.r': 3.3, '.sh': 3.2, '.bat': 3.2, '.ps1': 3.2,
+    '.js': 3.1, '.ts': 3.1, '.java': 3.2, '.kt': 3.2, '.scala': 3.2, '.swift': 3.2,
+    '.c': 3.0, '.h': 3.0, '.cpp': 3.0, '.cs': 3.2, '.go': 3.1, '.rs': 3.0, '.dart': 3.2,
+    '.php': 3.1, '.pl': 2.9, '.sql': 3.3,
+    '.html': 2.9, '.xml': 2.8, '.css': 2.9,
+    '.json': 2.7, '.yaml': 3.0, '.yml': 3.0, '.toml': 3.0, '.ini': 3.1, '.conf': 3.1,
+    '.csv': 2.4,
+}
+
+
+def context_budget(model, max_tokens, context_window=None, history_tokens=HISTORY_TOKENS):
+    """Return how many tokens of file context fit alongside max_tokens of output and the conversation."""
+    if context_window is None:
+        context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(0, context_window - max_tokens - PROMPT_OVERHEAD_TOKENS - history_tokens)
+
+
+def history_budget(model, max_tokens, context_tokens, context_window=None):
+    """Return how many tokens of conversation fit alongside the file context and max_tokens of output."""
+    if context_window is None:
+        context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(0, context_window - max_tokens - PROMPT_OVERHEAD_TOKENS - context_tokens)
+
+
+def estimate_tokens(text, path=""):
+    """Quickly estimate the token count of text using a per-file-type ratio."""
+    if not text:
+        return 0
+
+    _, ext = os.path.splitext(path.lower())
+    chars_per_token = CHARS_PER_TOKEN.get(ext, DEFAULT_CHARS_PER_TOKEN)
+
+    # Non-ASCII characters tokenize far less efficiently, roughly one token each
+    if text.isascii():
+        return int(len(text) / chars_per_token) + 1
+    non_ascii = len(text.encode('utf-8', errors='surrogatepass')) - len(text)
+    non_ascii_chars = min(len(text), non_ascii)
+    return int((len(text) - non_ascii_chars) / chars_per_token) + non_ascii_chars + 1
+
+
+class TokenCounter:
+    """Counts tokens per file, memoized on the content hash.
+
+    Uses the local estimate by default. With a client and model it asks the
+    API's token-counting endpoint instead, falling back to the estimate if
+    that call fails.
+    """
+
+    def __init__(self, client=None, model=None):
+        self.client = client
+        self.model = model
+        self._cache = {}
+        self._overhead = None
+        self._lock = threading.Lock()
+
+    @property
+    def exact(self):
+        return self.client is not None and self.model is not None
+
+    def count(self, text, path=""):
+        key = (content_hash(text), os.path.splitext(path.lower())[1], self.model if self.exact else None)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        tokens = None
+        if self.exact:
+            try:
+                tokens = max(0, self._count_exact(text) - self._message_overhead())
+            except Exception as e:
+                print(f"Token counting failed for {path}, using estimate: {str(e)}")
+        if tokens is None:
+            tokens = estimate_tokens(text, path)
+
+        with self._lock:
+            self._cache[key] = tokens
+        return tokens
+
+    def _count_exact(self, text):
+        response = scheduler.call(
+            self.client, self.client.messages.count_tokens,
+            model=self.model,
+            messages=[{"role": "user", "content": text or " "}],
+        )
+        return response.input_tokens
+
+    def _message_overhead(self):
+        # Tokens the API adds around any message, so they aren't billed per file
+        if self._overhead is None:
+            self._overhead = self._count_exact(" ")
+        return self._overhead
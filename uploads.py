@@ -0,0 +1,361 @@
+"""Incremental processing of multipart uploads, without writing parts to disk."""
+import bz2
+import codecs
+import io
+import lzma
+import posixpath
+import stat
+import tarfile
+import tempfile
+import zipfile
+import zlib
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+from classifier import text_encoding
+
+MAX_UPLOAD_FILE_SIZE = 1024 * 1024  # Skip files larger than 1MB
+HEAD_SIZE = 4096  # Bytes of each file used to classify it
+READ_CHUNK_SIZE = 64 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+FEED_SIZE = MAX_FIELD_SIZE // 2  # Leaves room in the decoder's buffer for a held-back partial boundary
+MAX_ARCHIVE_HEADER_SIZE = 64 * 1024  # Long names, long link names and pax headers inside a tar
+ZIP_SPOOL_SIZE = 32 * 1024 * 1024  # Zip archives larger than this are spooled to a temporary file
+
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+# Headers whose data describes the next member: GNU long name ('L') and long link name ('K'), and pax
+TAR_META_TYPES = (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK, tarfile.XHDTYPE, tarfile.XGLTYPE)
+
+
+def archive_kind(filename):
+    """Return 'zip' or 'tar' if filename names a supported archive, else None."""
+    name = filename.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(TAR_EXTENSIONS):
+        return 'tar'
+    return None
+
+
+def member_path(name):
+    """Normalise an archive member name to a safe relative path, or '' if nothing is left."""
+    parts = name.replace('\\', '/').split('/')
+    return posixpath.join(*[p for p in parts if p not in ('', '.', '..')] or [''])
+
+
+class _FilePart:
+    """Progress of one uploaded file through classification and decoding."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.head = bytearray()
+        self.size = 0
+        self.decoder = None
+        self.chunks = []
+        self.skipped = not filename
+
+
+class _TarReader:
+    """Push-style reader for a tar stream, gzip, bzip2 or xz compressed or not.
+
+    Members are handed to the parser block by block as the upload arrives,
+    so the archive is never buffered whole or extracted.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self._sniff = bytearray()
+        self._decompressor = None
+        self._compressed = None
+        self._buffer = bytearray()
+        self._remaining = 0  # Data bytes left in the current member
+        self._padding = 0  # Bytes up to the next 512-byte block
+        self._member = None  # _FilePart, bytearray for a long name or pax header, or None to skip
+        self._meta_type = None
+        self._next_name = None
+        self._next_size = None
+        self._done = False
+
+    def feed(self, data):
+        if self._compressed is None:
+            # Pick a decompressor from the magic bytes
+            self._sniff.extend(data)
+            if len(self._sniff) < 6:
+                return
+            data, self._sniff = bytes(self._sniff), None
+            if data.startswith(b'\x1f\x8b'):
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif data.startswith(b'BZh'):
+                self._decompressor = bz2.BZ2Decompressor()
+            elif data.startswith(b'\xfd7zXZ\x00'):
+                self._decompressor = lzma.LZMADecompressor()
+            self._compressed = self._decompressor is not None
+
+        if self._compressed:
+            try:
+                data = self._decompressor.decompress(data)
+            except (zlib.error, OSError, EOFError, lzma.LZMAError) as e:
+                raise ValueError(f"Invalid compressed archive: {e}")
+        self._process(data)
+
+    def close(self):
+        if self._compressed is None:
+            data, self._sniff, self._compressed = bytes(self._sniff), None, False
+            self._process(data)
+        if not self._done and (self._remaining or self._buffer or self._member is not None):
+            raise ValueError("Truncated tar archive")
+
+    def _process(self, data):
+        buf = self._buffer
+        buf.extend(data)
+        pos = 0
+        while pos < len(buf) and not self._done:
+            if self._remaining:
+                n = min(self._remaining, len(buf) - pos)
+                self._member_data(bytes(buf[pos:pos + n]))
+                pos += n
+                self._remaining -= n
+                if not self._remaining:
+                    self._member_end()
+            elif self._padding:
+                n = min(self._padding, len(buf) - pos)
+                pos += n
+                self._padding -= n
+            elif len(buf) - pos >= tarfile.BLOCKSIZE:
+                self._header(bytes(buf[pos:pos + tarfile.BLOCKSIZE]))
+                pos += tarfile.BLOCKSIZE
+            else:
+                break
+        del buf[:len(buf) if self._done else pos]
+
+    def _header(self, block):
+        if block == tarfile.NUL * tarfile.BLOCKSIZE:
+            # End-of-archive marker; anything after it is ignored
+            self._done = True
+            return
+        try:
+            info = tarfile.TarInfo.frombuf(block, 'utf-8', 'surrogateescape')
+        except tarfile.HeaderError as e:
+            raise ValueError(f"Invalid tar archive: {e}")
+
+        size = info.size
+        if info.type in TAR_META_TYPES:
+            if size > MAX_ARCHIVE_HEADER_SIZE:
+                raise ValueError("Tar header too large")
+            self._member = bytearray()
+            self._meta_type = info.type
+        else:
+            name, self._next_name = self._next_name or info.name, None
+            if self._next_size is not None:
+                size, self._next_size = self._next_size, None
+            # Only regular files are read. Links, devices, directories and GNU sparse files are skipped
+            self._member = None
+            if info.type in (tarfile.REGTYPE, tarfile.AREGTYPE, tarfile.CONTTYPE):
+                self._member = self.parser._start_member(name)
+
+        self._remaining = size
+        self._padding = -size % tarfile.BLOCKSIZE
+        if not size:
+            self._member_end()
+
+    def _member_data(self, data):
+        if isinstance(self._member, bytearray):
+            self._member.extend(data)
+        elif self._member is not None:
+            self.parser._file_data(self._member, data)
+
+    def _member_end(self):
+        member, self._member = self._member, None
+        if isinstance(member, bytearray):
+            if self._meta_type == tarfile.GNUTYPE_LONGNAME:
+                self._next_name = member.rstrip(tarfile.NUL).decode('utf-8', 'surrogateescape')
+            elif self._meta_type == tarfile.XHDTYPE:
+                self._read_pax(bytes(member))
+            # A long link name ('K') only matters to the link that follows, which is skipped,
+            # and global pax headers hold nothing needed here
+        elif member is not None:
+            self.parser._finish_file(member)
+
+    def _read_pax(self, data):
+        # Records are "<length> <key>=<value>\n"; only the path and size matter here
+        pos = 0
+        while pos < len(data):
+            try:
+                length = int(data[pos:].partition(b' ')[0])
+            except ValueError:
+                length = 0
+            if length <= 0:
+                raise ValueError("Invalid pax header")
+            key, _, value = data[pos:pos + length].partition(b' ')[2].rstrip(b'\n').partition(b'=')
+            if key == b'path':
+                self._next_name = value.decode('utf-8', 'surrogateescape')
+            elif key == b'size':
+                self._next_size = int(value)
+            pos += length
+
+
+class _ZipReader:
+    """Reader for a zip archive.
+
+    A zip's directory is at its end, so the compressed archive is spooled
+    (in memory up to ZIP_SPOOL_SIZE) and its members are decompressed one
+    at a time when the part ends. Members are never extracted.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self._spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE)
+
+    def feed(self, data):
+        self._spool.write(data)
+
+    def close(self):
+        parser = self.parser
+        try:
+            with self._spool, zipfile.ZipFile(self._spool) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or stat.S_ISLNK(info.external_attr >> 16):
+                        continue
+                    part = parser._start_member(info.filename)
+                    # Skip encrypted and oversized members without decompressing them
+                    if info.flag_bits & 0x1 or info.file_size > parser.max_file_size:
+                        part.skipped = True
+                    if not part.skipped:
+                        with archive.open(info) as f:
+                            while not part.skipped:
+                                data = f.read(READ_CHUNK_SIZE)
+                                if not data:
+                                    break
+                                parser._file_data(part, data)
+                    parser._finish_file(part)
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, EOFError, zlib.error) as e:
+            raise ValueError(f"Invalid zip archive: {e}")
+
+
+class UploadParser:
+    """Feeds a multipart/form-data body through werkzeug's sans-IO decoder.
+
+    Each file part is classified on its first bytes and decoded incrementally
+    as it arrives. A .zip or .tar(.gz) part is read as an archive instead,
+    and each of its members is treated like a file part under its relative
+    path. Binary and oversized parts are dropped as soon as they are
+    recognised, so only accepted text is held in memory and nothing is
+    written to disk. Once max_text_size characters of text have been
+    accepted, later files are counted but not kept, since they could not
+    fit in the context anyway.
+
+    is_text_file(filename, head) decides whether a file is text from its
+    name and first bytes.
+    """
+
+    def __init__(self, boundary, is_text_file, field_name='files[]',
+                 max_file_size=MAX_UPLOAD_FILE_SIZE, max_text_size=None):
+        self.is_text_file = is_text_file
+        self.field_name = field_name
+        self.max_file_size = max_file_size
+        self.max_text_size = max_text_size
+        self.fields = {}
+        self.files = []  # (filename, content) of accepted text files, in upload order
+        self.file_count = 0
+        self.text_size = 0
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'), MAX_FIELD_SIZE)
+        self._part = None
+        self._field = None
+
+    def feed(self, data):
+        """Process the next chunk of the request body."""
+        # The decoder rejects input that would take its buffer past MAX_FIELD_SIZE,
+        # so hand it large chunks in slices, draining it in between
+        data = memoryview(data)
+        for start in range(0, len(data), FEED_SIZE):
+            self._decoder.receive_data(data[start:start + FEED_SIZE])
+            self._drain()
+
+    def close(self):
+        """Signal the end of the body."""
+        self._decoder.receive_data(None)
+        self._drain()
+
+    def _drain(self):
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, (NeedData, Epilogue)):
+                return
+            if isinstance(event, File):
+                self._field = None
+                if event.name != self.field_name:
+                    self._part = None
+                elif archive_kind(event.filename or '') == 'zip':
+                    self._part = _ZipReader(self)
+                elif archive_kind(event.filename or '') == 'tar':
+                    self._part = _TarReader(self)
+                else:
+                    self.file_count += 1
+                    self._part = _FilePart(secure_filename(event.filename or ''))
+            elif isinstance(event, Field):
+                self._part = None
+                self._field = (event.name, bytearray())
+            elif isinstance(event, Data):
+                if self._field is not None:
+                    self._field[1].extend(event.data)
+                    if not event.more_data:
+                        name, value = self._field
+                        self.fields[name] = value.decode('utf-8', errors='replace')
+                        self._field = None
+                elif isinstance(self._part, _FilePart):
+                    self._file_data(self._part, event.data)
+                    if not event.more_data:
+                        self._finish_file(self._part)
+                        self._part = None
+                elif self._part is not None:
+                    self._part.feed(event.data)
+                    if not event.more_data:
+                        self._part.close()
+                        self._part = None
+
+    def _start_member(self, name):
+        """Return a _FilePart for an archive member, named by its relative path."""
+        self.file_count += 1
+        return _FilePart(member_path(name))
+
+    def _file_data(self, part, data):
+        if part.skipped:
+            return
+
+        part.size += len(data)
+        if part.size > self.max_file_size:
+            part.skipped = True
+            part.head = part.chunks = None
+            return
+
+        if part.decoder is None:
+            part.head.extend(data)
+            if len(part.head) >= HEAD_SIZE:
+                self._classify(part)
+            return
+
+        part.chunks.append(part.decoder.decode(data))
+
+    def _classify(self, part):
+        head, part.head = bytes(part.head), None
+        if self.max_text_size is not None and self.text_size >= self.max_text_size:
+            part.skipped = True
+        elif not self.is_text_file(part.filename, head):
+            part.skipped = True
+        else:
+            # Decode like classifier.decode_text would, newlines included
+            decoder = codecs.getincrementaldecoder(text_encoding(head))(errors='ignore')
+            part.decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+            part.chunks.append(part.decoder.decode(head))
+
+    def _finish_file(self, part):
+        if not part.skipped and part.decoder is None:
+            self._classify(part)
+        if part.skipped:
+            return
+
+        part.chunks.append(part.decoder.decode(b'', final=True))
+        content = ''.join(part.chunks)
+        self.files.append((part.filename, content))
+        self.text_size += len(content)
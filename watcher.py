@@ -0,0 +1,371 @@
+"""Watching a loaded folder for changes, so its context can be kept current.
+
+FolderWatcher reports the files that changed under a folder, as relative
+paths, once changes stop arriving for DEBOUNCE_SECONDS (or MAX_DELAY_SECONDS
+into a burst that doesn't let up), so a git checkout touching hundreds of
+files is one refresh. It follows the same ignore rules as the scanner.
+
+On Linux it listens for inotify events on every directory of the folder.
+Elsewhere, or once the system's inotify watches run out, it polls every
+POLL_INTERVAL seconds: each known file is stat'ed and compared on
+modification time and size, as the FileCache does, and a directory is
+listed again only if its own modification time changed. Nothing is read
+until a file has changed.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from ignore import IGNORE_FILES, IgnoreFilter
+from scanner import walk_entries
+
+DEBOUNCE_SECONDS = 0.3  # Quiet time that ends a burst of changes
+MAX_DELAY_SECONDS = 5.0  # Report a burst that keeps going at least this often
+POLL_INTERVAL = 2.0  # Seconds between polls when inotify isn't available
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONTFOLLOW = 0x2000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_ONLYDIR | IN_DONTFOLLOW)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def inotify_available():
+    return sys.platform.startswith("linux") and ctypes.util.find_library("c") is not None
+
+
+class Inotify:
+    """A minimal inotify(7) binding over ctypes."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Return [(wd, mask, name)] for the events that arrive within timeout seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            events.append((wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """Calls on_change(relative_paths) from a background thread whenever files under folder_path change.
+
+    Paths are relative to folder_path, as scan_files() yields them, and
+    cover files modified, added (including in new directories) and removed.
+    Call start() once the folder is loaded and stop() before loading another.
+    """
+
+    def __init__(self, folder_path, on_change, ignore=None, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS,
+                 poll_interval=POLL_INTERVAL, use_inotify=True):
+        self.root = os.path.abspath(folder_path)
+        self.on_change = on_change
+        self.ignore = ignore if ignore is not None else IgnoreFilter()
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.backend = "inotify" if use_inotify and inotify_available() else "polling"
+        self.dirs = {}  # directory -> (relative path with '/', ignore rule chain)
+        self.files = {}  # directory -> {name: (mtime_ns, size)}; None instead of the pair under inotify
+        self._dir_mtimes = {}  # directory -> mtime_ns, when polling
+        self._inotify = None
+        self._watches = {}  # wd -> directory
+        self._watch_ids = {}  # directory -> wd
+        self._pending = set()
+        self._first_change = None
+        self._last_change = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.backend == "inotify":
+            try:
+                self._inotify = Inotify()
+            except OSError as e:
+                print(f"Watching {self.root} by polling: {str(e)}")
+                self.backend = "polling"
+        try:
+            self._add_tree(self.root, "", None)
+        except OSError as e:
+            # Typically fs.inotify.max_user_watches reached on a large tree
+            print(f"Watching {self.root} by polling: {str(e)}")
+            self._close_inotify()
+            self.backend = "polling"
+            self.dirs, self.files = {}, {}
+            self._add_tree(self.root, "", None)
+        self._thread = threading.Thread(target=self._run, name="FolderWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """Stop watching. With wait=False, return without waiting for a refresh in progress to finish."""
+        self._stop.set()
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                due = None
+                if self._pending:
+                    due = min(self._last_change + self.debounce, self._first_change + self.max_delay) - now
+                    if due <= 0:
+                        self._flush()
+                        continue
+
+                if self.backend == "inotify":
+                    # Wake up now and then to notice stop()
+                    self._changed(self._read_events(0.5 if due is None else min(due, 0.5)))
+                else:
+                    wait = next_poll - now if due is None else min(next_poll - now, due)
+                    if self._stop.wait(max(0.0, wait)):
+                        break
+                    if time.monotonic() >= next_poll:
+                        self._changed(self._poll())
+                        next_poll = time.monotonic() + self.poll_interval
+        finally:
+            self._close_inotify()
+
+    def _changed(self, paths):
+        if not paths:
+            return
+        now = time.monotonic()
+        self._pending.update(paths)
+        if self._first_change is None:
+            self._first_change = now
+        self._last_change = now
+
+    def _flush(self):
+        paths, self._pending = sorted(os.path.relpath(path, self.root) for path in self._pending), set()
+        self._first_change = self._last_change = None
+        try:
+            self.on_change(paths)
+        except Exception as e:
+            print(f"Error refreshing changed files: {str(e)}")
+
+    # What is being watched
+
+    def _add_tree(self, top, rel, chain):
+        """Start watching a directory and everything under it. Returns the files found."""
+        before = set(self.dirs)
+        found = []
+        for entry in walk_entries(top, self.ignore, dirs=self.dirs, rel=rel, chain=chain):
+            directory = os.path.dirname(entry.path)
+            self.files.setdefault(directory, {})[entry.name] = self._signature(entry.path)
+            found.append(entry.path)
+        for directory in self.dirs:
+            if directory not in before:
+                self.files.setdefault(directory, {})
+                if self._inotify is not None:
+                    wd = self._inotify.add_watch(directory)
+                    self._watches[wd] = directory
+                    self._watch_ids[directory] = wd
+                else:
+                    self._dir_mtimes[directory] = _mtime(directory)
+        return found
+
+    def _drop_tree(self, top):
+        """Stop watching a directory and everything under it. Returns the files that were there."""
+        prefix = os.path.join(top, "")
+        gone = []
+        for directory in [d for d in self.dirs if d == top or d.startswith(prefix)]:
+            del self.dirs[directory]
+            self._dir_mtimes.pop(directory, None)
+            gone.extend(os.path.join(directory, name) for name in self.files.pop(directory, ()))
+            wd = self._watch_ids.pop(directory, None)
+            if wd is not None:
+                self._watches.pop(wd, None)
+                self._inotify.rm_watch(wd)
+        return gone
+
+    def _resync(self, report_all):
+        """Walk the whole folder again, after its ignore rules changed or events were lost.
+
+        Returns the files that came into or went out of view, or every file
+        if report_all is set.
+        """
+        before = set(self._drop_tree(self.root))
+        try:
+            after = set(self._add_tree(self.root, "", None))
+        except OSError:
+            after = set()
+        return sorted(before | after) if report_all else sorted(before ^ after)
+
+    def _wanted(self, directory, name, is_dir):
+        """False if an entry is ignored, or isn't in a directory being watched."""
+        known = self.dirs.get(directory)
+        if known is None:
+            return False
+        rel, chain = known
+        return not (chain and self.ignore.ignored(chain, f"{rel}/{name}" if rel else name, is_dir))
+
+    def _signature(self, path):
+        if self._inotify is not None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _close_inotify(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            self._watches, self._watch_ids = {}, {}
+
+    # inotify
+
+    def _read_events(self, timeout):
+        changed = []
+        for wd, mask, name in self._inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so any file may have changed
+                changed.extend(self._resync(report_all=True))
+                continue
+            directory = self._watches.get(wd)
+            if mask & IN_IGNORED:
+                # The directory is gone, and was or will be reported from its parent
+                self._watches.pop(wd, None)
+                continue
+            is_dir = bool(mask & IN_ISDIR)
+            if directory is None or not self._wanted(directory, name, is_dir):
+                continue
+            path = os.path.join(directory, name)
+            added = bool(mask & (IN_CREATE | IN_MOVED_TO | IN_MODIFY | IN_CLOSE_WRITE))
+            if is_dir:
+                if added and path not in self.dirs:
+                    rel, chain = self.dirs[directory]
+                    try:
+                        changed.extend(self._add_tree(path, f"{rel}/{name}" if rel else name, chain))
+                    except OSError:
+                        pass  # Out of watches: its files are reported, but changes under it won't be
+                elif not added:
+                    changed.extend(self._drop_tree(path))
+                continue
+
+            names = self.files.setdefault(directory, {})
+            if added:
+                names[name] = None
+            else:
+                names.pop(name, None)
+            changed.append(path)
+            if name in IGNORE_FILES:
+                # The rules changed, so files may have come into or gone out of view
+                changed.extend(self._resync(report_all=False))
+        return changed
+
+    # polling
+
+    def _poll(self):
+        changed = []
+        for directory in list(self.dirs):
+            if directory not in self.dirs:
+                continue  # Dropped along with its parent
+            mtime = _mtime(directory)
+            if mtime is None:
+                changed.extend(self._drop_tree(directory))
+            elif mtime != self._dir_mtimes.get(directory):
+                # Entries were added, removed or renamed
+                self._dir_mtimes[directory] = mtime
+                changed.extend(self._relist(directory))
+
+        for directory, names in list(self.files.items()):
+            for name, signature in list(names.items()):
+                path = os.path.join(directory, name)
+                current = self._signature(path)
+                if current != signature:
+                    if current is None:
+                        del names[name]
+                    else:
+                        names[name] = current
+                    changed.append(path)
+
+        if any(os.path.basename(path) in IGNORE_FILES for path in changed):
+            changed.extend(self._resync(report_all=False))
+        return changed
+
+    def _relist(self, directory):
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return []
+        changed = []
+        names = self.files.setdefault(directory, {})
+        listed = set()
+        rel, chain = self.dirs[directory]
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if not self._wanted(directory, entry.name, is_dir):
+                continue
+            if is_dir:
+                # Like the scanner, don't follow symlinked directories
+                if entry.path not in self.dirs and not entry.is_symlink():
+                    changed.extend(self._add_tree(entry.path, f"{rel}/{entry.name}" if rel else entry.name, chain))
+            elif entry.name not in names:
+                names[entry.name] = self._signature(entry.path)
+                changed.append(entry.path)
+            listed.add(entry.name)
+        for name in [name for name in names if name not in listed]:
+            del names[name]
+            changed.append(os.path.join(directory, name))
+        return changed
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
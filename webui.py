@@ -1,19 +1,42 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
+from flask import Flask, render_template, request, jsonify, session, Response
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import json
-import anthropic
-import time
 import mimetypes
 import tempfile
 import shutil
-from werkzeug.utils import secure_filename
+import threading
+import time
+from answercache import DEFAULT_ANSWER_CACHE_PATH, AnswerCache, answer_key, replay_chunks
+from classifier import is_text_file
+from clients import ClientRegistry
+from contextbuilder import ContextBuilder
+from contextstore import ContextStore
+from conversation import Conversation
+import metrics
+import scheduler
+import sse
+from mapreduce import map_reduce
+from pipeline import pack_files
+from prompts import SYSTEM_PROMPT, usage_dict
+from ranking import MAX_CORPUS_SIZE, FileCorpus
+from tokens import TokenCounter, context_budget, history_budget
+from uploads import READ_CHUNK_SIZE, UploadParser
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # For session management
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+app.config['MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024  # 256MB max upload size; parts are streamed, not buffered
 app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
 app.config['MAX_TEXT_SIZE'] = 4 * 1024 * 1024  # ~4MB limit for text content
+app.config['MAX_CORPUS_SIZE'] = MAX_CORPUS_SIZE  # Text kept for ranking when the files don't all fit
+app.config['CONTEXT_TOKEN_BUDGET'] = None  # Override the per-model token budget for file context
+app.config['CONTEXT_STORE_MAX_BYTES'] = 512 * 1024 * 1024  # Memory ceiling for all loaded contexts
+app.config['CONTEXT_TTL'] = 2 * 60 * 60  # Drop contexts unused for this many seconds
+app.config['ANSWER_CACHE_PATH'] = DEFAULT_ANSWER_CACHE_PATH  # None keeps cached answers in memory only
+app.config['ANSWER_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+app.config['ANSWER_CACHE_TTL'] = 24 * 60 * 60  # Seconds a cached answer is replayed for
+app.config['SSE_GZIP'] = True  # Compress answer streams for clients that accept gzip
 
 # Create templates folder if it doesn't exist
 os.makedirs(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'), exist_ok=True)
@@ -100,7 +123,7 @@ with open(template_path, 'w', encoding='utf-8') as f:
             </div>
             <div class="card-body">
                 <div class="mb-3">
-                    <label for="fileUpload" class="form-label">Select files to analyze:</label>
+                    <label for="fileUpload" class="form-label">Select files to analyze, or a .zip / .tar.gz of a project:</label>
                     <input class="form-control" type="file" id="fileUpload" multiple>
                 </div>
                 <button class="btn btn-primary" id="uploadBtn">Upload Files</button>
@@ -124,6 +147,11 @@ with open(template_path, 'w', encoding='utf-8') as f:
                     <textarea class="form-control" id="question" rows="3" placeholder="Ask a question about your files..."></textarea>
                 </div>
                 <button class="btn btn-primary" id="askBtn">Send to Claude</button>
+                <button class="btn btn-outline-secondary" id="newConversationBtn">New Conversation</button>
+                <div class="form-check form-check-inline ms-3">
+                    <input class="form-check-input" type="checkbox" id="shardedCheck">
+                    <label class="form-check-label" for="shardedCheck">Search all files (map-reduce)</label>
+                </div>
                 
                 <div class="mt-4">
                     <h6>Claude's Answer:</h6>
@@ -135,6 +163,7 @@ with open(template_path, 'w', encoding='utf-8') as f:
                     <div id="response" class="response-area">
                         Ask a question to see Claude's response here.
                     </div>
+                    <div id="usageInfo" class="form-text"></div>
                 </div>
             </div>
         </div>
@@ -145,12 +174,14 @@ with open(template_path, 'w', encoding='utf-8') as f:
             const connectBtn = document.getElementById('connectBtn');
             const uploadBtn = document.getElementById('uploadBtn');
             const askBtn = document.getElementById('askBtn');
+            const newConversationBtn = document.getElementById('newConversationBtn');
             const apiStatus = document.getElementById('apiStatus');
             const uploadStatus = document.getElementById('uploadStatus');
             const fileListContainer = document.getElementById('fileListContainer');
             const fileList = document.getElementById('fileList');
             const response = document.getElementById('response');
             const loadingResponse = document.getElementById('loadingResponse');
+            const usageInfo = document.getElementById('usageInfo');
             
             // Connect to API
             connectBtn.addEventListener('click', async function() {
@@ -208,6 +239,10 @@ with open(template_path, 'w', encoding='utf-8') as f:
                     formData.append('files[]', fileInput.files[i]);
                 }
                 
+                // The token budget depends on the model and the tokens reserved for the answer
+                formData.append('model', document.getElementById('modelSelect').value);
+                formData.append('max_tokens', document.getElementById('maxTokens').value);
+                
                 try {
                     const res = await fetch('/api/upload', {
                         method: 'POST',
@@ -255,6 +290,7 @@ with open(template_path, 'w', encoding='utf-8') as f:
                 const question = document.getElementById('question').value.trim();
                 const model = document.getElementById('modelSelect').value;
                 const maxTokens = document.getElementById('maxTokens').value;
+                const sharded = document.getElementById('shardedCheck').checked ? '&sharded=1' : '';
                 
                 if (!question) {
                     response.textContent = 'Error: Please enter a question';
@@ -264,13 +300,28 @@ with open(template_path, 'w', encoding='utf-8') as f:
                 // Show loading indicator and clear previous response
                 loadingResponse.classList.remove('hidden');
                 response.textContent = '';
+                usageInfo.textContent = '';
                 
                 // Disable the ask button during processing
                 askBtn.disabled = true;
                 
                 try {
                     // Start the streaming request
-                    const eventSource = new EventSource(`/api/ask-stream?question=${encodeURIComponent(question)}&model=${encodeURIComponent(model)}&max_tokens=${encodeURIComponent(maxTokens)}`);
+                    const eventSource = new EventSource(`/api/ask-stream?question=${encodeURIComponent(question)}&model=${encodeURIComponent(model)}&max_tokens=${encodeURIComponent(maxTokens)}${sharded}`);
+                    
+                    // Text is added to the page at most once per animation frame, however fast it arrives
+                    let pending = '';
+                    let frameRequested = false;
+                    let reconnecting = false;
+                    function flushText() {
+                        frameRequested = false;
+                        if (pending) {
+                            response.textContent += pending;
+                            pending = '';
+                            // Auto-scroll to bottom
+                            response.scrollTop = response.scrollHeight;
+                        }
+                    }
                     
                     // Process incoming stream events
                     eventSource.onmessage = function(event) {
@@ -279,8 +330,31 @@ with open(template_path, 'w', encoding='utf-8') as f:
                         
                         const data = JSON.parse(event.data);
                         
+                        if (data.chunk !== undefined) {
+                            // Queue the text for the next frame
+                            pending += data.chunk;
+                            if (!frameRequested) {
+                                frameRequested = true;
+                                requestAnimationFrame(flushText);
+                            }
+                            return;
+                        }
+                        flushText();
+                        
                         if (data.done) {
                             // Stream completed
+                            if (data.usage) {
+                                const u = data.usage;
+                                const sent = data.files_sent ? `${data.files_sent} most relevant files sent. ` : '';
+                                const turn = data.turn > 1 ? `Follow-up ${data.turn - 1}. ` : '';
+                                const cached = data.cached ? 'Answered from cache, no request sent. ' : '';
+                                const failed = data.failed ? `, ${data.failed} failed` : '';
+                                const merged = data.shards > 1 ? `Merged from ${data.shards} shards${failed}. ` : '';
+                                usageInfo.textContent = merged + cached + turn + sent + `Tokens: ${u.input_tokens} input, ` +
+                                    `${u.cache_read_input_tokens} cache read, ` +
+                                    `${u.cache_creation_input_tokens} cache write, ` +
+                                    `${u.output_tokens} output`;
+                            }
                             eventSource.close();
                             askBtn.disabled = false;
                         } else if (data.error) {
@@ -288,17 +362,34 @@ with open(template_path, 'w', encoding='utf-8') as f:
                             response.textContent = data.error;
                             eventSource.close();
                             askBtn.disabled = false;
-                        } else {
-                            // Append the chunk of text
-                            response.textContent += data.chunk;
-                            
-                            // Auto-scroll to bottom
-                            response.scrollTop = response.scrollHeight;
+                        } else if (data.plan) {
+                            // Map-reduce progress: the shards planned, then each one as it is answered
+                            const files = data.plan.reduce((total, count) => total + count, 0);
+                            usageInfo.textContent = `Asking ${data.plan.length} shards of ${files} files...`;
+                        } else if (data.shard) {
+                            usageInfo.textContent = data.failed !== undefined
+                                ? `Shard ${data.shard} of ${data.of} failed: ${data.failed}`
+                                : `Shard ${data.shard} of ${data.of} answered (${data.files} files)`;
+                        }
+                    };
+                    
+                    eventSource.onopen = function() {
+                        if (reconnecting) {
+                            reconnecting = false;
+                            usageInfo.textContent = '';
                         }
                     };
                     
                     // Handle errors
                     eventSource.onerror = function(err) {
+                        if (eventSource.readyState === EventSource.CONNECTING) {
+                            // The browser reconnects by itself with the ID of the last event it got,
+                            // and the answer carries on from there
+                            reconnecting = true;
+                            usageInfo.textContent = 'Connection lost, reconnecting...';
+                            return;
+                        }
+                        flushText();
                         loadingResponse.classList.add('hidden');
                         response.textContent += "\\n\\nError: Connection to server lost. Please try again.";
                         eventSource.close();
@@ -311,6 +402,18 @@ with open(template_path, 'w', encoding='utf-8') as f:
                     askBtn.disabled = false;
                 }
             });
+            
+            // Forget the questions asked so far; the files stay loaded
+            newConversationBtn.addEventListener('click', async function() {
+                try {
+                    const res = await fetch('/api/new-conversation', { method: 'POST' });
+                    const data = await res.json();
+                    response.textContent = data.success ? 'New conversation started.' : data.message;
+                    usageInfo.textContent = '';
+                } catch (err) {
+                    response.textContent = 'Error: ' + err.message;
+                }
+            });
         });
     </script>
 </body>
@@ -319,65 +422,29 @@ with open(template_path, 'w', encoding='utf-8') as f:
 # Set up mime types
 mimetypes.init()
 
-def is_text_file(file_path):
-    """Determine if a file is a text file that can be read."""
-    try:
-        # Check for common binary file extensions to exclude
-        binary_extensions = {
-            # Images
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.ico', '.svg',
-            # Audio
-            '.mp3', '.wav', '.ogg', '.flac', '.aac', '.wma', '.m4a',
-            # Video
-            '.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm',
-            # Archives
-            '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2',
-            # Executables
-            '.exe', '.dll', '.so', '.dylib', '.bin',
-            # Other binary
-            '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', 
-            '.db', '.sqlite', '.mdb', '.class', '.pyc', '.o'
-        }
-        
-        # Get file extension
-        _, ext = os.path.splitext(file_path.lower())
-        
-        # Check if it's a binary file by extension
-        if ext in binary_extensions:
-            return False
-        
-        # Known text file extensions
-        text_extensions = {
-            '.txt', '.md', '.py', '.js', '.html', '.css', '.java', '.c', '.cpp', '.h',
-            '.cs', '.php', '.rb', '.go', '.rs', '.ts', '.swift', '.kt', '.scala', '.pl',
-            '.sql', '.json', '.xml', '.yaml', '.yml', '.toml', '.ini', '.conf', '.sh',
-            '.bat', '.ps1', '.log', '.csv', '.rst', '.r', '.dart', '.lua'
-        }
-        
-        # If it's a known text extension, return True
-        if ext in text_extensions:
-            return True
-        
-        # For files we're not sure about, try to read them
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            sample = f.read(1024)  # Read first 1KB
-            
-            # Simple heuristic: if the sample contains mostly printable ASCII, 
-            # it's probably text
-            if sample:
-                # Count printable characters
-                printable_count = sum(1 for c in sample if 32 <= ord(c) <= 126 or c in '\n\r\t')
-                ratio = printable_count / len(sample)
-                
-                # If more than 90% characters are printable, consider it text
-                return ratio > 0.9
-            
-            return True  # Empty file is considered text
-            
-    except UnicodeDecodeError:
-        return False
-    except Exception:
-        return False
+# Token estimates are memoized per file content, so share them across sessions
+token_counter = TokenCounter()
+
+# One long-lived client per API key, shared by all worker threads
+client_registry = ClientRegistry()
+
+# Loaded contexts live on the server; the session cookie only carries their ID.
+# Contexts evicted for memory are spilled under UPLOAD_FOLDER rather than lost.
+context_store = ContextStore(
+    max_bytes=app.config['CONTEXT_STORE_MAX_BYTES'],
+    ttl=app.config['CONTEXT_TTL'],
+    spill_dir=os.path.join(app.config['UPLOAD_FOLDER'], 'contexts'),
+)
+
+# Completed answers, shared by all sessions, so repeated questions about the same files cost nothing
+answer_cache = AnswerCache(
+    db_path=app.config['ANSWER_CACHE_PATH'],
+    max_bytes=app.config['ANSWER_CACHE_MAX_BYTES'],
+    ttl=app.config['ANSWER_CACHE_TTL'],
+)
+
+# Answers being streamed, kept for a while so a dropped connection can resume where it left off
+answer_streams = sse.StreamRegistry()
 
 @app.route('/')
 def index():
@@ -391,8 +458,8 @@ def connect_api():
         return jsonify({"success": False, "message": "API key is required"})
     
     try:
-        # Test connection by creating a client
-        client = anthropic.Anthropic(api_key=api_key)
+        # Create (or reuse) the pooled client so the first question doesn't pay for it
+        client_registry.get(api_key)
         
         # Store API key in session
         session['api_key'] = api_key
@@ -403,78 +470,83 @@ def connect_api():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
-    if 'files[]' not in request.files:
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
         return jsonify({"success": False, "message": "No files provided"})
     
-    # Get uploaded files
-    files = request.files.getlist('files[]')
+    # Parse the body as it arrives: each file is classified on its first bytes
+    # and decoded incrementally, without being written to disk
+    parser = new_upload_parser(boundary)
+    started = time.perf_counter()
+    try:
+        while True:
+            chunk = request.stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        parser.close()
+    except RequestEntityTooLarge:
+        # Past MAX_CONTENT_LENGTH, or a form field too large for the decoder; answer in JSON like other errors
+        return jsonify({"success": False, "message": "Upload is too large"})
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid upload: {str(e)}"})
+    metrics.observe_upload(parser, time.perf_counter() - started)
     
-    # Clear previous uploads if any
-    if 'upload_dir' in session:
-        try:
-            shutil.rmtree(session['upload_dir'])
-        except:
-            pass
+    return jsonify(finish_upload(parser, session))
+
+def new_upload_parser(boundary):
+    """Return an UploadParser for a multipart body with the given boundary."""
+    return UploadParser(boundary, is_text_file, max_text_size=app.config['MAX_CORPUS_SIZE'])
+
+def finish_upload(parser, session):
+    """Pack a parsed upload into a new context for the session. Returns the JSON body."""
+    if not parser.file_count:
+        return {"success": False, "message": "No files provided"}
     
-    # Create a new temporary directory for this session
-    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(time.time()))
-    os.makedirs(upload_dir, exist_ok=True)
-    session['upload_dir'] = upload_dir
+    model = parser.fields.get('model', 'claude-3-7-sonnet-20250219')
+    try:
+        max_tokens = int(parser.fields.get('max_tokens', 100000))
+    except ValueError:
+        return {"success": False, "message": "Max tokens must be a number"}
     
-    # Process files
-    processed_files = []
-    total_size = 0
-    max_content_size = app.config['MAX_TEXT_SIZE']
-    truncated = False
-    file_contents = ""
+    context, processed_files, budget = build_upload_context(parser.files, model, max_tokens)
     
-    for file in files:
-        if file.filename == '':
-            continue
-        
-        # Save file to temporary directory with secure filename
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
-        
-        # Check if it's a text file and not too large
-        if is_text_file(file_path) and os.path.getsize(file_path) <= 1024 * 1024:  # 1MB max per file
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    processed_files.append(filename)
-                    
-                    # Add file content with header to the combined content
-                    file_header = f"\n\n==== FILE: {filename} ====\n\n"
-                    
-                    # Check if adding this file would exceed our limit
-                    content_to_add = file_header + content
-                    if total_size + len(content_to_add) > max_content_size:
-                        truncated = True
-                        # Only add if we have room for at least the header and some content
-                        if total_size + len(file_header) + 100 < max_content_size:
-                            truncated_content = content[:max_content_size - total_size - len(file_header) - 50]
-                            file_contents += file_header + truncated_content + "\n[Content truncated due to size]"
-                            total_size = max_content_size
-                    else:
-                        file_contents += content_to_add
-                        total_size += len(content_to_add)
-            except Exception as e:
-                print(f"Error reading {file_path}: {str(e)}")
+    # Keep the context, and the conversation about it, on the server and remember its ID in the session
+    context_store.delete(session.pop('context_id', None))
+    session['context_id'] = context_store.put(Conversation(context))
     
-    # Add a note about truncation if needed
-    if truncated:
-        file_contents += "\n\n==== NOTE: Content was truncated due to size limitations ====\n"
+    return upload_result(context, processed_files, budget)
+
+def build_upload_context(files, model, max_tokens):
+    """Pack (filename, content) pairs of uploaded text files into a ContextBuilder.
     
-    # Store the file contents in the session
-    session['file_contents'] = file_contents
+    Returns (context, processed_files, budget).
+    """
+    # Stop packing files at the model's token budget, leaving room for the answer
+    budget = app.config['CONTEXT_TOKEN_BUDGET'] or context_budget(model, max_tokens)
+    # Files past the budget go in as outlines while those still fit
+    context = ContextBuilder(app.config['MAX_TEXT_SIZE'], token_budget=budget, counter=token_counter, outline=True)
+    # Keep every file that fits in the corpus, so questions can be
+    # matched against all of them when the context overflows
+    processed_files = pack_files(files, context, FileCorpus(app.config['MAX_CORPUS_SIZE']))
     
-    return jsonify({
+    return context, processed_files, budget
+
+def upload_result(context, processed_files, budget):
+    """Return the JSON body describing a finished upload."""
+    message = f"Loaded {len(processed_files)} files (~{context.total_tokens:,} of {budget:,} tokens)"
+    if context.corpus is not None:
+        message = (f"Indexed {len(processed_files)} files; each question is sent the most relevant ones, "
+                   f"in full or as outlines (up to {budget:,} tokens)")
+    return {
         "success": True, 
-        "message": f"Loaded {len(processed_files)} files",
+        "message": message,
         "files": processed_files,
-        "truncated": truncated
-    })
+        "truncated": context.truncated,
+        "outlined": context.outlined,
+        "tokens": context.total_tokens,
+        "token_budget": budget
+    }
 
 # Streaming endpoint using Server-Sent Events (SSE)
 @app.route('/api/ask-stream')
@@ -482,9 +554,20 @@ def ask_claude_stream():
     if 'api_key' not in session:
         return jsonify({"error": "Not connected to Claude API"})
     
-    if 'file_contents' not in session or not session['file_contents']:
+    conversation = context_store.get(session.get('context_id'))
+    if not conversation:
         return jsonify({"error": "No files loaded"})
     
+    # A reconnecting EventSource sends the ID of the last event it got: carry on from there
+    # instead of asking again
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id:
+        resumed = answer_streams.resume(last_event_id, session.get('context_id'))
+        if resumed is None:
+            error = {'error': 'Error: The answer can no longer be resumed. Please ask again.'}
+            return Response(f"data: {json.dumps(error)}\n\n", mimetype='text/event-stream')
+        return event_stream(*resumed)
+    
     question = request.args.get('question', '').strip()
     model = request.args.get('model', 'claude-3-7-sonnet-20250219')
     max_tokens = int(request.args.get('max_tokens', 100000))
@@ -492,44 +575,103 @@ def ask_claude_stream():
     if not question:
         return jsonify({"error": "Please enter a question"})
     
+    api_key = session['api_key']
+    sharded = request.args.get('sharded') == '1'
+    
     def generate():
+        started = time.perf_counter()
         try:
-            # Create a client with the stored API key
-            client = anthropic.Anthropic(api_key=session['api_key'])
+            # Pack the files most relevant to the question if they don't all fit,
+            # or keep the files the conversation started with
+            question_context = conversation.context_for(question)
             
-            # Prepare the system prompt
-            system_prompt = (
-                "You are an assistant that analyzes and answers questions about the provided files. "
-                "The user will provide file contents and ask questions about them. "
-                "Be concise but thorough in your responses."
-            )
+            # File context goes in cached blocks, followed by the conversation so far
+            budget = history_budget(model, max_tokens, question_context.total_tokens)
+            messages = conversation.messages(question, question_context, budget)
             
-            # Create the prompt for Claude with context
-            prompt = f"Here are the files to analyze:\n\n{session['file_contents']}\n\nBased on these files, please answer the following question:\n{question}"
+            # A question already answered about the same files and history is replayed from the cache
+            key = answer_key(question_context, question, model, max_tokens, *conversation.history())
+            cached = answer_cache.get(key)
+            metrics.PROMPT_SECONDS.observe(time.perf_counter() - started)
+            if cached is not None:
+                text, usage = cached
+                first_token = time.perf_counter() - started
+                for chunk in replay_chunks(text):
+                    yield {'chunk': chunk}
+                conversation.add_turn(question, text, question_context)
+                metrics.observe_answer(usage, first_token, time.perf_counter() - started, cached=True)
+                done = {'done': True, 'usage': usage, 'cached': True, 'turn': len(conversation)}
+                if question_context is not conversation.context:
+                    done['files_sent'] = len(question_context)
+                yield done
+                return
             
-            # Use streaming API for long requests
-            with client.messages.stream(
+            answer = []
+            first_token = None
+            # Borrow the pooled client for this API key, reusing its open connections, and wait
+            # for the scheduler to admit the request within the key's rate limits
+            with client_registry.client(api_key) as client, scheduler.stream(
+                client,
                 model=model,
-                system=system_prompt,
+                system=SYSTEM_PROMPT,
                 max_tokens=max_tokens,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
+                messages=messages
             ) as stream:
                 # Process the text stream
                 for text in stream.text_stream:
-                    # Yield each chunk as a Server-Sent Event (SSE)
-                    yield f"data: {json.dumps({'chunk': text})}\n\n"
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    answer.append(text)
+                    yield {'chunk': text}
                     
-                # Signal completion
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                usage = usage_dict(stream.get_final_message().usage)
+                answer_cache.put(key, ''.join(answer), usage)
+                conversation.add_turn(question, ''.join(answer), question_context)
+                metrics.observe_answer(usage, first_token, time.perf_counter() - started)
+                
+                # Signal completion, with token usage including prompt cache reads and writes
+                done = {'done': True, 'usage': usage, 'turn': len(conversation)}
+                if question_context is not conversation.context:
+                    done['files_sent'] = len(question_context)
+                yield done
                 
         except Exception as e:
             # Send error information
-            yield f"data: {json.dumps({'error': f'Error: {str(e)}'})}\n\n"
+            metrics.ANSWER_ERRORS.inc()
+            yield {'error': f'Error: {str(e)}'}
+    
+    def generate_sharded():
+        # Every shard of the files is asked in parallel and the partial answers merged.
+        # Progress events come first, then the merged answer streams like any other
+        with client_registry.client(api_key) as client:
+            yield from map_reduce(client, conversation.context, question, model, max_tokens)
     
-    # Return a streaming response
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # Generate in the background, so the answer carries on while a dropped connection reconnects
+    stream = answer_streams.start(session.get('context_id'))
+    events = generate_sharded() if sharded else generate()
+    threading.Thread(target=stream.run, args=(events,), daemon=True).start()
+    return event_stream(stream)
+
+def event_stream(stream, after=0):
+    """Respond with a stream's events from index after, as coalesced SSE frames, gzipped if the client accepts it."""
+    gzip = app.config['SSE_GZIP'] and sse.accepts_gzip(request.headers.get('Accept-Encoding'))
+    # Time how long each frame takes to reach the client
+    body = metrics.timed_delivery(sse.encode(sse.frames(stream, after), gzip))
+    return Response(body, mimetype='text/event-stream', headers=sse.response_headers(gzip))
+
+@app.route('/api/new-conversation', methods=['POST'])
+def new_conversation():
+    conversation = context_store.get(session.get('context_id'))
+    if not conversation:
+        return jsonify({"success": False, "message": "No files loaded"})
+    
+    conversation.reset()
+    return jsonify({"success": True})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text format: per-phase timings, file counts, cache hits and token usage
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == '__main__':
     try:
@@ -540,6 +682,8 @@ if __name__ == '__main__':
         
         app.run(debug=True)
     finally:
+        client_registry.close()
+        
         # Clean up temp files when the server shuts down
         if os.path.exists(app.config['UPLOAD_FOLDER']):
             shutil.rmtree(app.config['UPLOAD_FOLDER'])
\ No newline at end of file
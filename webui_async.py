@@ -0,0 +1,381 @@
+"""ASGI serving mode for the web UI, streaming answers with AsyncAnthropic.
+
+The Flask app in webui.py holds a worker thread for the whole length of each
+streamed answer. This app serves the same page and endpoints from a single
+asyncio event loop, so one process can hold hundreds of concurrent streams.
+It shares webui.py's configuration, context store and upload processing.
+
+Run it with any ASGI server, for example:
+
+    uvicorn webui_async:app
+"""
+import asyncio
+import json
+import secrets
+import threading
+import time
+from functools import partial
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+
+import metrics
+import scheduler
+import sse
+import webui
+from answercache import answer_key, replay_chunks
+from clients import ClientRegistry, make_async_client
+from mapreduce import map_reduce_async
+from prompts import SYSTEM_PROMPT, usage_dict
+from tokens import history_budget
+
+SESSION_COOKIE = "claudefc_session"
+
+with open(webui.template_path, 'rb') as f:
+    INDEX_HTML = f.read()
+
+
+class SessionStore:
+    """Server-side sessions keyed by a random cookie value, expiring after ttl seconds unused."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, scope):
+        """Return (session_id, session dict, is_new) for the request's cookie."""
+        cookie = SimpleCookie()
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                cookie.load(value.decode('latin-1'))
+
+        now = time.monotonic()
+        with self._lock:
+            # Drop expired sessions, then find (or start) this one
+            for sid in [sid for sid, s in self._sessions.items() if now - s['last_used'] > self.ttl]:
+                expired = self._sessions.pop(sid)
+                webui.context_store.delete(expired.get('context_id'))
+
+            session_id = cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+            session = self._sessions.get(session_id)
+            is_new = session is None
+            if is_new:
+                session_id = secrets.token_urlsafe(24)
+                session = self._sessions[session_id] = {}
+            session['last_used'] = now
+            return session_id, session, is_new
+
+
+sessions = SessionStore(ttl=webui.app.config['CONTEXT_TTL'])
+
+# One long-lived async client per API key, shared by every stream on the loop
+client_registry = ClientRegistry(factory=make_async_client)
+
+
+class Request:
+    """The bits of an ASGI HTTP request the handlers need."""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.path = scope['path']
+        self.method = scope['method']
+        self.query = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', [])}
+        self.session_id, self.session, is_new = sessions.load(scope)
+        self.cookie_headers = []
+        if is_new:
+            cookie = f"{SESSION_COOKIE}={self.session_id}; Path=/; HttpOnly; SameSite=Lax"
+            self.cookie_headers.append((b'set-cookie', cookie.encode('latin-1')))
+
+    async def body(self, limit):
+        """Read the request body, or return None if it is larger than limit."""
+        length = self.headers.get('content-length')
+        if length is not None and length.isdigit() and int(length) > limit:
+            return None
+
+        chunks = []
+        size = 0
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionResetError("Client disconnected during upload")
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    async def start(self, status, content_type, extra_headers=()):
+        headers = [(b'content-type', content_type.encode('latin-1'))] + self.cookie_headers + list(extra_headers)
+        await self.send({'type': 'http.response.start', 'status': status, 'headers': headers})
+
+    async def respond(self, status, content_type, body):
+        await self.start(status, content_type, [(b'content-length', str(len(body)).encode('latin-1'))])
+        await self.send({'type': 'http.response.body', 'body': body})
+
+    async def json(self, payload, status=200):
+        await self.respond(status, 'application/json', json.dumps(payload).encode('utf-8'))
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call (parsing, disk, classification) off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+
+async def index(request):
+    await request.respond(200, 'text/html; charset=utf-8', INDEX_HTML)
+
+
+async def connect_api(request):
+    body = await request.body(64 * 1024)
+    try:
+        api_key = json.loads(body or b'{}').get('api_key')
+    except ValueError:
+        api_key = None
+
+    if not api_key:
+        return await request.json({"success": False, "message": "API key is required"})
+
+    try:
+        # Create (or reuse) the pooled client so the first question doesn't pay for it
+        client_registry.get(api_key)
+        request.session['api_key'] = api_key
+        return await request.json({"success": True, "message": "Connected to Claude API"})
+    except Exception as e:
+        return await request.json({"success": False, "message": f"Error connecting: {str(e)}"})
+
+
+async def upload_files(request):
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    boundary = params.get('boundary')
+    if content_type != 'multipart/form-data' or not boundary:
+        return await request.json({"success": False, "message": "No files provided"})
+
+    # Feed the body to the parser as it arrives; nothing is buffered or written to disk.
+    # Parsing, classifying and unpacking archives run in the executor, one chunk at a time,
+    # so the answers streaming on the loop don't stall behind a large upload
+    limit = webui.app.config['MAX_CONTENT_LENGTH']
+    parser = webui.new_upload_parser(boundary)
+    size = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            message = await request.receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > limit:
+                return await request.json({"success": False, "message": "Upload is too large"}, status=413)
+            if chunk:
+                await run_blocking(parser.feed, chunk)
+            if not message.get('more_body', False):
+                break
+        await run_blocking(parser.close)
+    except RequestEntityTooLarge:
+        return await request.json({"success": False, "message": "Upload is too large"})
+    except ValueError as e:
+        return await request.json({"success": False, "message": f"Invalid upload: {str(e)}"})
+    metrics.observe_upload(parser, time.perf_counter() - started)
+
+    # Token counting can take a while for large uploads, so keep it off the loop
+    await request.json(await run_blocking(webui.finish_upload, parser, request.session))
+
+
+async def ask_claude_stream(request):
+    session = request.session
+    if 'api_key' not in session:
+        return await request.json({"error": "Not connected to Claude API"})
+
+    conversation = webui.context_store.get(session.get('context_id'))
+    if not conversation:
+        return await request.json({"error": "No files loaded"})
+
+    # A reconnecting EventSource sends the ID of the last event it got: carry on from there
+    last_event_id = request.headers.get('last-event-id')
+    if last_event_id:
+        resumed = webui.answer_streams.resume(last_event_id, session.get('context_id'))
+        if resumed is None:
+            error = {'error': 'Error: The answer can no longer be resumed. Please ask again.'}
+            return await request.respond(200, 'text/event-stream', f"data: {json.dumps(error)}\n\n".encode('utf-8'))
+        return await send_stream(request, *resumed)
+
+    question = request.query.get('question', '').strip()
+    model = request.query.get('model', 'claude-3-7-sonnet-20250219')
+    try:
+        max_tokens = int(request.query.get('max_tokens', 100000))
+    except ValueError:
+        return await request.json({"error": "Max tokens must be a number"})
+
+    if not question:
+        return await request.json({"error": "Please enter a question"})
+    sharded = request.query.get('sharded') == '1'
+
+    async def stream_answer():
+        started = time.perf_counter()
+        try:
+            # Pack the files most relevant to the question if they don't all fit,
+            # or keep the files the conversation started with
+            question_context = await run_blocking(conversation.context_for, question)
+
+            # File context goes in cached blocks, followed by the conversation so far
+            budget = history_budget(model, max_tokens, question_context.total_tokens)
+            messages = conversation.messages(question, question_context, budget)
+
+            # A question already answered about the same files and history is replayed from the cache
+            key = answer_key(question_context, question, model, max_tokens, *conversation.history())
+            cached = await run_blocking(webui.answer_cache.get, key)
+            metrics.PROMPT_SECONDS.observe(time.perf_counter() - started)
+            if cached is not None:
+                text, usage = cached
+                first_token = time.perf_counter() - started
+                for chunk in replay_chunks(text):
+                    yield {'chunk': chunk}
+                conversation.add_turn(question, text, question_context)
+                metrics.observe_answer(usage, first_token, time.perf_counter() - started, cached=True)
+                done = {'done': True, 'usage': usage, 'cached': True, 'turn': len(conversation)}
+                if question_context is not conversation.context:
+                    done['files_sent'] = len(question_context)
+                yield done
+                return
+
+            answer = []
+            first_token = None
+
+            with client_registry.client(session['api_key']) as client:
+                async with scheduler.astream(
+                    client,
+                    model=model,
+                    system=SYSTEM_PROMPT,
+                    max_tokens=max_tokens,
+                    messages=messages
+                ) as stream:
+                    async for text in stream.text_stream:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        answer.append(text)
+                        yield {'chunk': text}
+
+                    # Signal completion, with token usage including prompt cache reads and writes
+                    message = await stream.get_final_message()
+                    usage = usage_dict(message.usage)
+                    await run_blocking(webui.answer_cache.put, key, ''.join(answer), usage)
+                    conversation.add_turn(question, ''.join(answer), question_context)
+                    metrics.observe_answer(usage, first_token, time.perf_counter() - started)
+                    done = {'done': True, 'usage': usage, 'turn': len(conversation)}
+                    if question_context is not conversation.context:
+                        done['files_sent'] = len(question_context)
+                    yield done
+        except Exception as e:
+            metrics.ANSWER_ERRORS.inc()
+            yield {'error': f'Error: {str(e)}'}
+
+    async def stream_sharded():
+        # Every shard of the files is asked concurrently and the partial answers merged.
+        # Progress events come first, then the merged answer streams like any other
+        with client_registry.client(session['api_key']) as client:
+            async for event in map_reduce_async(client, conversation.context, question, model, max_tokens,
+                                                run_blocking=run_blocking):
+                yield event
+
+    # Generate in a task of its own, so the answer carries on while a dropped connection reconnects.
+    # A stream nobody reads for sse.RESUME_GRACE seconds stops, closing the upstream request
+    stream = webui.answer_streams.start(session.get('context_id'))
+    stream.task = asyncio.ensure_future(stream.run_async(stream_sharded() if sharded else stream_answer()))
+    await send_stream(request, stream)
+
+
+async def send_stream(request, stream, after=0):
+    """Send a stream's events from index after, as coalesced SSE frames, gzipped if the client accepts it."""
+    gzip = webui.app.config['SSE_GZIP'] and sse.accepts_gzip(request.headers.get('accept-encoding'))
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in sse.response_headers(gzip)]
+    await request.start(200, 'text/event-stream', headers)
+
+    async def send_frames():
+        frames = sse.encode_async(sse.frames_async(stream, after), gzip)
+        try:
+            async for data in frames:
+                sent = time.perf_counter()
+                await request.send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                metrics.DELIVERY_SECONDS.inc(time.perf_counter() - sent)
+        finally:
+            # Detach from the stream now, even when cancelled mid-send
+            await frames.aclose()
+
+    async def wait_for_disconnect():
+        while True:
+            message = await request.receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    # If the browser goes away, stop sending; the stream keeps generating for a while in case it reconnects
+    sender = asyncio.ensure_future(send_frames())
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        done, _ = await asyncio.wait([sender, watcher], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (sender, watcher):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(sender, watcher, return_exceptions=True)
+
+    if sender in done:
+        try:
+            await request.send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except Exception:
+            pass
+
+
+async def new_conversation(request):
+    conversation = webui.context_store.get(request.session.get('context_id'))
+    if not conversation:
+        return await request.json({"success": False, "message": "No files loaded"})
+
+    conversation.reset()
+    await request.json({"success": True})
+
+
+async def metrics_endpoint(request):
+    await request.respond(200, metrics.CONTENT_TYPE, metrics.REGISTRY.render().encode('utf-8'))
+
+
+ROUTES = {
+    ('GET', '/'): index,
+    ('POST', '/api/connect'): connect_api,
+    ('POST', '/api/upload'): upload_files,
+    ('GET', '/api/ask-stream'): ask_claude_stream,
+    ('POST', '/api/new-conversation'): new_conversation,
+    ('GET', '/metrics'): metrics_endpoint,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await client_registry.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope, receive, send)
+    handler = ROUTES.get((request.method, request.path))
+    if handler is None:
+        return await request.json({"error": "Not found"}, status=404)
+    await handler(request)